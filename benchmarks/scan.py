@@ -0,0 +1,112 @@
+""" Compare directory scanning by 'compoze index' / 'compoze pool'.
+
+Builds a release directory of N archives (every tenth a symlink into a
+pool), then lists it with the former ``os.listdir`` + ``os.path`` scans and
+with the current :func:`compoze._util.scan_directory`-based ones, reporting
+the best wall-clock time of a few runs.  Both variants do the same work:
+neither stats the candidates for a metadata cache key.  To count the
+syscalls actually made, run under ``strace -f -c -e trace=%stat``
+with ``--only=legacy`` or ``--only=scandir`` (and subtract a run with
+N=0, which counts start-up alone).
+
+Usage:  PYTHONPATH=. python benchmarks/scan.py [N] [--only=legacy|scandir]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from compoze.indexer import Indexer
+from compoze.pooler import Pooler
+from compoze.pooler import is_archive
+
+
+REPEAT = 5
+
+def legacy_index_candidates(path):
+    candidates = []
+    for candidate in sorted(os.listdir(path)):
+        cname = os.path.join(path, candidate)
+        if os.path.isfile(cname):
+            candidates.append(candidate)
+    return candidates
+
+def legacy_list_archives(release_dir):
+    all, pending = [], []
+    for filename in os.listdir(release_dir):
+        full = os.path.join(release_dir, filename)
+        if is_archive(full) and os.path.isfile(full):
+            if not os.path.islink(full):
+                pending.append(filename)
+            all.append(filename)
+    return all, pending
+
+def scandir_index_candidates(indexer, path):
+    entries, sidecars = indexer._scanPath(path)
+    return sorted(entries)
+
+def scandir_list_archives(pooler):
+    return pooler.listArchives()
+
+def make_tree(count):
+    root = tempfile.mkdtemp()
+    release_dir = os.path.join(root, 'release')
+    pool_dir = os.path.join(root, 'pool')
+    os.mkdir(release_dir)
+    os.mkdir(pool_dir)
+    for i in range(count):
+        name = 'project%06d-1.0.tar.gz' % i
+        if i % 10 == 0:
+            target = os.path.join(pool_dir, name)
+            open(target, 'w').close()
+            os.symlink(target, os.path.join(release_dir, name))
+        else:
+            open(os.path.join(release_dir, name), 'w').close()
+    return root, release_dir
+
+def measure(label, func, *args):
+    best = None
+    for i in range(REPEAT):
+        started = time.time()
+        result = func(*args)
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    print('%-28s %8.3fs' % (label, best))
+    return result
+
+def main(argv=sys.argv[1:]):
+    only = None
+    args = []
+    for arg in argv:
+        if arg.startswith('--only='):
+            only = arg[len('--only='):]
+        else:
+            args.append(arg)
+    count = int(args[0]) if args else 20000
+    root, release_dir = make_tree(count)
+    try:
+        indexer = Indexer(None, '--path=%s' % release_dir)
+        pooler = Pooler(None, '--path=%s' % release_dir, 'unused')
+        print('%d entries in %s' % (count, release_dir))
+        if only in (None, 'legacy'):
+            old_index = measure('index (listdir + isfile)',
+                                legacy_index_candidates, release_dir)
+            old_pool = measure('pool (listdir + isfile)',
+                               legacy_list_archives, release_dir)
+        if only in (None, 'scandir'):
+            new_index = measure('index (scan_directory)',
+                                scandir_index_candidates, indexer,
+                                release_dir)
+            new_pool = measure('pool (scan_directory)',
+                               scandir_list_archives, pooler)
+        if only is None:
+            assert old_index == new_index
+            assert sorted(old_pool[0]) == sorted(new_pool[0])
+            assert sorted(old_pool[1]) == sorted(new_pool[1])
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -31,3 +31,47 @@ def must_encode(value):             #pragma NO COVER
     if type(value) is u:
         return value.encode('utf-8')
     return value
+
+try:
+    from urlparse import urldefrag
+except ImportError:                 #pragma NO COVER Py3k
+    from urllib.parse import urldefrag
+
+try:
+    from urllib2 import HTTPError
+    from urllib import addinfourl
+except ImportError:                 #pragma NO COVER Py3k
+    from urllib.error import HTTPError
+    from urllib.response import addinfourl
+
+try:
+    from httplib import HTTPMessage
+except ImportError:                 #pragma NO COVER Py3k
+    from http.client import HTTPMessage
+    from email.parser import Parser
+    def parse_http_headers(text):
+        return Parser(_class=HTTPMessage).parsestr(text)
+else:                               #pragma NO COVER Py2
+    def parse_http_headers(text):
+        return HTTPMessage(StringIO(text))
+
+try:
+    import tomllib
+except ImportError:                 #pragma NO COVER Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import brotli
+except ImportError:                 #pragma NO COVER optional
+    brotli = None
+
+try:
+    from os import scandir
+except ImportError:                 #pragma NO COVER Python < 3.5
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
@@ -0,0 +1,144 @@
+""" Internal helpers shared between :mod:`compoze` subcommands.
+"""
+import hashlib
+import os
+import re
+import stat
+import tempfile
+
+from compoze._compat import scandir
+
+_BLOCKSIZE = 1 << 16
+
+_SIZE_SUFFIXES = {'K': 1 << 10,
+                  'M': 1 << 20,
+                  'G': 1 << 30,
+                  'T': 1 << 40,
+                 }
+
+_NAME_SEPARATORS = re.compile(r'[-_.]+')
+
+def normalize_name(name):
+    """ Return the PEP 503 normalized form of project `name`.
+    """
+    return _NAME_SEPARATORS.sub('-', name).lower()
+
+def file_sha256(filename, blocksize=_BLOCKSIZE):
+    """ Return the hex SHA-256 digest of `filename`, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+def parse_size(text):
+    """ Parse a byte count, allowing a ``K``, ``M``, ``G`` or ``T`` suffix.
+
+    Return ``None`` for an empty value.
+    """
+    if text is None:
+        return None
+    original, text = text, text.strip().upper()
+    if not text:
+        return None
+    if text.endswith('B'):
+        text = text[:-1]
+    multiplier = 1
+    if text and text[-1] in _SIZE_SUFFIXES:
+        multiplier = _SIZE_SUFFIXES[text[-1]]
+        text = text[:-1]
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError('Invalid size: %s' % original)
+    if value < 0:
+        raise ValueError('Invalid size: %s' % original)
+    return int(value * multiplier)
+
+def mkstemp_beside(target):
+    """ Create a hidden temporary file in the directory of `target`.
+
+    Create the directory if needed.  Return ``(fd, path)``, as
+    :func:`tempfile.mkstemp` does.
+    """
+    dirname = os.path.dirname(target)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError: # created concurrently
+            if not os.path.isdir(dirname):
+                raise
+    return tempfile.mkstemp(dir=dirname, prefix='.')
+
+def write_atomically(target, data):
+    """ Replace `target` with the bytes `data`, synced to disk first.
+
+    Readers see either the old or the new contents, never a mix.
+    """
+    fd, tmp = mkstemp_beside(target)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.rename(tmp, target)
+
+class _ListdirEntry(object):
+    """ Stand-in for :class:`os.DirEntry` where ``scandir`` is unavailable.
+
+    Stat results are fetched lazily and cached, as ``DirEntry`` does.
+    """
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+        self._stat = None
+        self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            if self._lstat is None:
+                self._lstat = os.lstat(self.path)
+            return self._lstat
+        if self._stat is None:
+            if self.is_symlink():
+                self._stat = os.stat(self.path)
+            else:
+                self._stat = self.stat(follow_symlinks=False)
+        return self._stat
+
+    def inode(self):
+        return self.stat(follow_symlinks=False).st_ino
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+
+    def is_file(self, follow_symlinks=True):
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+        except OSError: # dangling symlink
+            return False
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError: # dangling symlink
+            return False
+
+def scan_directory(path):
+    """ Return the entries of directory `path`, sorted by name.
+
+    Entries are :class:`os.DirEntry` objects (or work-alikes), whose
+    ``is_file()`` / ``is_symlink()`` answers usually come from the directory
+    listing itself, and whose ``stat()`` result is cached, so callers make
+    no further syscalls per entry for the common cases.
+    """
+    if scandir is not None:
+        entries = list(scandir(path))
+    else:                           #pragma NO COVER Python < 3.5
+        entries = [_ListdirEntry(path, x) for x in os.listdir(path)]
+    entries.sort(key=lambda x: x.name)
+    return entries
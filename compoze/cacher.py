@@ -0,0 +1,506 @@
+import hashlib
+import json
+import optparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+
+from compoze._compat import BytesIO
+from compoze._compat import StringIO
+from compoze._compat import addinfourl
+from compoze._compat import must_encode
+from compoze._compat import parse_http_headers
+from compoze._compat import urldefrag
+from compoze._util import file_sha256
+from compoze._util import mkstemp_beside
+from compoze._util import parse_size
+from compoze._util import write_atomically
+
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+def _isDigest(text):
+    # Digests come from remote index pages and from files on disk:  only
+    # well-formed ones may become paths.
+    return _DIGEST.match(text) is not None
+
+# As checked by setuptools' HashChecker, which cache hits bypass.
+_HASH_FRAGMENT = re.compile(r'^(sha1|sha224|sha384|sha256|sha512|md5)='
+                            r'([0-9a-fA-F]+)$')
+
+def _fileHash(filename, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(1 << 16)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadCache(object):
+    """ Persistent, content-addressed store of downloaded archives.
+
+    Archive contents are stored once, under their SHA-256 digest;  a
+    separate map records the digest downloaded from each URL.  Each use
+    of a blob is recorded in a ``.used`` file beside it (not on the blob,
+    which is hardlinked into release directories), and :meth:`prune`
+    evicts the least recently used blobs first.
+    """
+    def __init__(self, path, max_size=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_size = max_size
+        self.blob_dir = os.path.join(self.path, 'sha256')
+        self.url_dir = os.path.join(self.path, 'urls')
+
+    def blobPath(self, digest):
+        if not _isDigest(digest):
+            raise ValueError('Invalid SHA-256 digest: %r' % digest)
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _usedPath(self, digest):
+        return self.blobPath(digest) + '.used'
+
+    def _urlPath(self, url):
+        url, fragment = urldefrag(url)
+        key = hashlib.sha256(must_encode(url)).hexdigest()
+        return os.path.join(self.url_dir, key[:2], key)
+
+    def lookup(self, url):
+        """ Return the cached blob path for `url`, or ``None``.
+
+        A ``#sha256=`` fragment on `url` is honored before the URL map;  a
+        blob is only returned if it matches the hash in any fragment.
+        """
+        url, fragment = urldefrag(url)
+        match = _HASH_FRAGMENT.match(fragment)
+        if match is not None:
+            algorithm, expected = match.group(1), match.group(2).lower()
+            if algorithm == 'sha256':
+                if not _isDigest(expected):
+                    return None
+                blob = self.blobPath(expected)
+                if os.path.isfile(blob):
+                    return blob
+                return None
+        try:
+            with open(self._urlPath(url)) as f:
+                digest = f.read().strip()
+        except (IOError, OSError):
+            return None
+        if not _isDigest(digest):
+            return None
+        blob = self.blobPath(digest)
+        if not os.path.isfile(blob):
+            return None
+        if match is not None and _fileHash(blob, algorithm) != expected:
+            return None
+        return blob
+
+    def retrieve(self, url, filename):
+        """ Hardlink (or, across filesystems, copy) the cached archive for
+        `url` to `filename`.
+
+        Return true on a cache hit.
+        """
+        blob = self.lookup(url)
+        if blob is None:
+            return False
+        if os.path.exists(filename):
+            os.remove(filename)
+        try:
+            os.link(blob, filename)
+        except (AttributeError, OSError):
+            shutil.copyfile(blob, filename)
+        self._touch(os.path.basename(blob))
+        return True
+
+    def store(self, url, filename):
+        """ Add the archive at `filename`, downloaded from `url`.
+
+        Return its SHA-256 digest.
+        """
+        digest = file_sha256(filename)
+        blob = self.blobPath(digest)
+        if not os.path.isfile(blob):
+            self._atomicCopy(filename, blob)
+        self._touch(digest)
+        if url is not None:
+            write_atomically(self._urlPath(url), must_encode(digest + '\n'))
+        return digest
+
+    def entries(self):
+        """ Return a list of ``(last used, size, digest)`` for cached blobs.
+
+        The list is sorted from least to most recently used.
+        """
+        result = []
+        if not os.path.isdir(self.blob_dir):
+            return result
+        for prefix in os.listdir(self.blob_dir):
+            subdir = os.path.join(self.blob_dir, prefix)
+            if not os.path.isdir(subdir):
+                continue
+            for digest in os.listdir(subdir):
+                if not _isDigest(digest):
+                    continue
+                st = os.stat(os.path.join(subdir, digest))
+                try:
+                    used = os.stat(self._usedPath(digest)).st_mtime
+                except OSError: # never used since storing
+                    used = st.st_mtime
+                result.append((used, st.st_size, digest))
+        result.sort()
+        return result
+
+    def totalSize(self):
+        return sum([x[1] for x in self.entries()])
+
+    def prune(self, max_size=None):
+        """ Evict least recently used blobs until under `max_size` bytes.
+
+        `max_size` defaults to the size passed to the constructor.  Return
+        a list of the evicted digests.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return []
+        entries = self.entries()
+        total = sum([x[1] for x in entries])
+        evicted = []
+        for used, size, digest in entries:
+            if total <= max_size:
+                break
+            os.remove(self.blobPath(digest))
+            if os.path.exists(self._usedPath(digest)):
+                os.remove(self._usedPath(digest))
+            total -= size
+            evicted.append(digest)
+        if evicted:
+            self._removeDanglingURLs()
+        return evicted
+
+    def clear(self):
+        """ Remove all cached blobs and URL mappings.
+        """
+        for x in (self.blob_dir, self.url_dir):
+            if os.path.isdir(x):
+                shutil.rmtree(x)
+
+    def _removeDanglingURLs(self):
+        if not os.path.isdir(self.url_dir):
+            return
+        for prefix in os.listdir(self.url_dir):
+            subdir = os.path.join(self.url_dir, prefix)
+            for key in os.listdir(subdir):
+                url_path = os.path.join(subdir, key)
+                with open(url_path) as f:
+                    digest = f.read().strip()
+                if (not _isDigest(digest) or
+                        not os.path.isfile(self.blobPath(digest))):
+                    os.remove(url_path)
+
+    def _touch(self, digest):
+        # Record a use of the blob for 'digest'.  Its own mtime is left
+        # alone:  hardlinked copies share it, and the indexer's metadata
+        # cache is keyed on it.
+        used = self._usedPath(digest)
+        try:
+            os.utime(used, None)
+        except OSError:
+            try:
+                open(used, 'a').close()
+            except (IOError, OSError): #pragma NO COVERAGE
+                pass
+
+    def _atomicCopy(self, source, target):
+        fd, tmp = mkstemp_beside(target)
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmp)
+            # mkstemp's 0600 would follow the blob into release dirs.
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, target)
+        except:
+            os.remove(tmp)
+            raise
+
+
+class PageCache(object):
+    """ Persistent store of index pages, with their HTTP validators.
+
+    Pages are kept under the ``pages`` subdirectory of `path`, along with
+    the headers returned by the server, so that a later request can be
+    made conditional on the ``ETag`` / ``Last-Modified`` values.
+    """
+    def __init__(self, path):
+        self.path = os.path.join(os.path.abspath(os.path.expanduser(path)),
+                                 'pages')
+
+    def _pagePath(self, url):
+        url, fragment = urldefrag(url)
+        key = hashlib.sha256(must_encode(url)).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def load(self, url):
+        """ Return a :class:`CachedPage` for `url`, or ``None``.
+        """
+        page_path = self._pagePath(url)
+        try:
+            with open(page_path + '.json') as f:
+                info = json.load(f)
+            with open(page_path, 'rb') as f:
+                body = f.read()
+        except (IOError, OSError, ValueError):
+            return None
+        return CachedPage(info['url'], info['headers'], body)
+
+    def save(self, url, final_url, headers, body):
+        """ Record `body` and `headers` (as text) fetched from `url`.
+        """
+        page_path = self._pagePath(url)
+        write_atomically(page_path, body)
+        info = {'url': final_url, 'headers': headers}
+        write_atomically(page_path + '.json', must_encode(json.dumps(info)))
+
+    def count(self):
+        result = 0
+        if os.path.isdir(self.path):
+            for prefix in os.listdir(self.path):
+                names = os.listdir(os.path.join(self.path, prefix))
+                result += len([x for x in names if x.endswith('.json')])
+        return result
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+
+class CachedPage(object):
+    """ An index page loaded from a :class:`PageCache`.
+    """
+    def __init__(self, url, headers, body):
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+    def validators(self):
+        """ Return request headers making a fetch conditional on this page.
+        """
+        headers = parse_http_headers(self.headers)
+        result = []
+        if headers.get('etag'):
+            result.append(('If-None-Match', headers.get('etag')))
+        if headers.get('last-modified'):
+            result.append(('If-Modified-Since', headers.get('last-modified')))
+        return result
+
+    def response(self):
+        """ Return a response object replaying the cached page.
+        """
+        return addinfourl(BytesIO(self.body),
+                          parse_http_headers(self.headers),
+                          self.url,
+                          200)
+
+
+class MetadataCache(object):
+    """ Persistent map from archive files to their extracted metadata.
+
+    Entries are keyed by absolute filename, and are valid only while the
+    file's size and mtime match those recorded when it was parsed;  pool
+    archives are immutable, so unchanged files need never be re-opened.
+    Negative results (``None`` project / version) are cached as well.
+    """
+    _SCHEMA = ("CREATE TABLE IF NOT EXISTS archives ("
+               " filename TEXT PRIMARY KEY,"
+               " size INTEGER,"
+               " mtime REAL,"
+               " sha256 TEXT,"
+               " project TEXT,"
+               " version TEXT,"
+               " extra TEXT)")
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+        dirname = os.path.dirname(self.filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(self.filename)
+        self._conn.execute(self._SCHEMA)
+
+    def lookup(self, filename, st=None):
+        """ Return a dict of cached metadata for `filename`, or ``None``.
+
+        `st`, if passed, is a stat result for `filename`, saving a call to
+        :func:`os.stat`.
+        """
+        if st is None:
+            st = os.stat(filename)
+        row = self._conn.execute(
+                "SELECT size, mtime, sha256, project, version, extra"
+                " FROM archives WHERE filename = ?",
+                (os.path.abspath(filename),)).fetchone()
+        if row is None:
+            return None
+        size, mtime, sha256, project, version, extra = row
+        if size != st.st_size or mtime != st.st_mtime:
+            return None
+        return {'sha256': sha256,
+                'project': project,
+                'version': version,
+                'extra': json.loads(extra or '{}'),
+               }
+
+    def store(self, filename, project, version, sha256=None, extra=None,
+              st=None):
+        """ Record metadata for `filename`, replacing any previous entry.
+        """
+        if st is None:
+            st = os.stat(filename)
+        self._conn.execute(
+                "INSERT OR REPLACE INTO archives"
+                " (filename, size, mtime, sha256, project, version, extra)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(filename), st.st_size, st.st_mtime, sha256,
+                 project, version, json.dumps(extra or {})))
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+class Cacher(object):
+    """ Inspect or prune the shared download cache.
+    """
+    actions = ('list', 'prune', 'clear')
+
+    def __init__(self, global_options, *argv, **kw):
+
+        argv = list(argv)
+        parser = optparse.OptionParser(
+            usage="%prog cache [OPTIONS] [list|prune|clear]\n\n  " +
+                   self.__doc__.strip())
+
+        parser.add_option(
+            '-q', '--quiet',
+            action='store_false',
+            dest='verbose',
+            help="Run quietly")
+
+        parser.add_option(
+            '-v', '--verbose',
+            action='store_true',
+            dest='verbose',
+            default=getattr(global_options, 'verbose', False),
+            help="Show progress")
+
+        parser.add_option(
+            '-C', '--cache-dir',
+            action='store',
+            dest='cache_dir',
+            default=getattr(global_options, 'cache_dir', None),
+            help="Path of the download cache")
+
+        parser.add_option(
+            '-M', '--cache-max-size',
+            action='store',
+            dest='cache_max_size',
+            default=getattr(global_options, 'cache_max_size', None),
+            help="Prune the cache to this size (e.g. '500M', '20G')")
+
+        self.usage = parser.format_help()
+
+        options, args = parser.parse_args(argv)
+
+        self.options = options
+        self.action = 'list'
+        if len(args) == 1:
+            self.action = args[0]
+
+        if len(args) > 1 or self.action not in self.actions:
+            msg = StringIO()
+            msg.write('cache: Invalid action: %s\n\n' % ' '.join(args))
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+
+        self._logger = kw.get('logger', _print)
+
+    def blather(self, text):
+        if self.options.verbose:
+            self._logger(text)
+
+    def getCache(self):
+        """ Return the :class:`DownloadCache` named by the options.
+        """
+        if self.options.cache_dir is None:
+            msg = StringIO()
+            msg.write('No cache_dir!\n\n')
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+        return DownloadCache(self.options.cache_dir,
+                             parse_size(self.options.cache_max_size))
+
+    def getPageCache(self):
+        """ Return the :class:`PageCache` sharing the download cache's path.
+        """
+        return PageCache(self.getCache().path)
+
+    def list_cache(self):
+        """ Report cached blobs, least recently used first.
+        """
+        cache = self.getCache()
+        entries = cache.entries()
+        for used, size, digest in entries:
+            self._logger('%s %12d' % (digest, size))
+        self._logger('%d archives, %d bytes in %s'
+                        % (len(entries), sum([x[1] for x in entries]),
+                           cache.path))
+        self._logger('%d index pages' % self.getPageCache().count())
+        return entries
+
+    def prune_cache(self):
+        """ Evict least recently used blobs down to ``--cache-max-size``.
+        """
+        cache = self.getCache()
+        if cache.max_size is None:
+            raise ValueError('prune: --cache-max-size is required')
+        evicted = cache.prune()
+        for digest in evicted:
+            self.blather('Evicted %s' % digest)
+        self.blather('Evicted %d archives' % len(evicted))
+        return evicted
+
+    def clear_cache(self):
+        """ Remove every archive and index page from the cache.
+        """
+        cache = self.getCache()
+        cache.clear()
+        self.getPageCache().clear()
+        self.blather('Cleared %s' % cache.path)
+
+    def __call__(self): #pragma NO COVERAGE
+        """ Dispatch to the method for the requested action.
+        """
+        getattr(self, '%s_cache' % self.action)()
+
+def _print(text): #pragma NO COVERAGE
+    print(text)
+
+def main(): #pragma NO COVERAGE
+    try:
+        cacher = Cacher(None, *sys.argv[1:])
+        cacher()
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+
+if __name__ == '__main__': #pragma NO COVERAGE
+    main()
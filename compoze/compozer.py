@@ -156,6 +156,20 @@ class Compozer:
             default=False,
             help="Keep temporary directory")
 
+        parser.add_option(
+            '-C', '--cache-dir',
+            action='store',
+            dest='cache_dir',
+            default=None,
+            help="Use a shared download cache in this directory")
+
+        parser.add_option(
+            '-M', '--cache-max-size',
+            action='store',
+            dest='cache_max_size',
+            default=None,
+            help="Prune the download cache to this size (e.g. '20G')")
+
         options, args = parser.parse_args(mine)
 
         if len(options.index_urls) == 0:
@@ -230,6 +244,10 @@ class Compozer:
                     if cp.has_option('global', 'keep-tempdir'):
                         op.keep_tempdir = cp.getboolean('global',
                                                         'keep-tempdir')
+                    if cp.has_option('global', 'cache-dir'):
+                        op.cache_dir = cp.get('global', 'cache-dir')
+                    if cp.has_option('global', 'cache-max-size'):
+                        op.cache_max_size = cp.get('global', 'cache-max-size')
                 else:
                     s_data = cf_data[s_name] = {}
                     for o_name in cp.options(s_name):
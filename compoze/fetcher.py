@@ -1,13 +1,20 @@
+from multiprocessing.pool import ThreadPool
 import optparse
 import os
 import pkg_resources
 import shutil
 import sys
 import tempfile
+import threading
+import warnings
 
+from setuptools.package_index import distros_for_filename
 
+from compoze.cacher import DownloadCache
+from compoze.cacher import PageCache
 from compoze.index import CompozePackageIndex
 from compoze._compat import StringIO
+from compoze._util import parse_size
 
 
 class Fetcher:
@@ -84,6 +91,13 @@ class Fetcher:
             default=getattr(global_options, 'source_only', True),
             help="Include binary distributions")
 
+        parser.add_option(
+            '-W', '--include-wheels',
+            action='store_true',
+            dest='include_wheels',
+            default=getattr(global_options, 'include_wheels', False),
+            help="Include wheels (but not other binary distributions)")
+
         parser.add_option(
             '-k', '--keep-tempdir',
             action='store_true',
@@ -91,9 +105,53 @@ class Fetcher:
             default=getattr(global_options, 'keep_tempdir', False),
             help="Keep temporary directory")
 
+        parser.add_option(
+            '-j', '--jobs',
+            action='store',
+            type='int',
+            dest='jobs',
+            default=getattr(global_options, 'jobs', 1),
+            help="Resolve and download up to JOBS requirements concurrently")
+
+        parser.add_option(
+            '-C', '--cache-dir',
+            action='store',
+            dest='cache_dir',
+            default=getattr(global_options, 'cache_dir', None),
+            help="Consult and populate a download / index page cache "
+                 "in this directory")
+
+        parser.add_option(
+            '-M', '--cache-max-size',
+            action='store',
+            dest='cache_max_size',
+            default=getattr(global_options, 'cache_max_size', None),
+            help="Prune the download cache to this size (e.g. '20G')")
+
+        parser.add_option(
+            '-I', '--download-in-path',
+            action='store_true',
+            dest='download_in_path',
+            default=getattr(global_options, 'download_in_path', False),
+            help="Download into a temporary directory inside PATH, and "
+                 "rename archives into place rather than copying them")
+
+        parser.add_option(
+            '-e', '--skip-existing',
+            action='store_true',
+            dest='skip_existing',
+            default=getattr(global_options, 'skip_existing', False),
+            help="Skip requirements already satisfied by an archive in PATH")
+
         self.usage = parser.format_help()
         options, args = parser.parse_args(argv)
 
+        if options.jobs < 1:
+            msg = StringIO()
+            msg.write('fetch: --jobs must be a positive integer\n\n')
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+
         if len(options.index_urls) == 0:
             options.index_urls = ['http://pypi.python.org/simple']
 
@@ -109,6 +167,12 @@ class Fetcher:
         self.options = options
         self._expandRequirements(args)
 
+        self.download_cache = self.page_cache = None
+        if options.cache_dir is not None:
+            self.download_cache = DownloadCache(
+                options.cache_dir, parse_size(options.cache_max_size))
+            self.page_cache = PageCache(options.cache_dir)
+
         path = os.path.abspath(os.path.expanduser(options.path))
 
         self.path = path
@@ -146,18 +210,128 @@ class Fetcher:
             msg.write(self.usage)
             raise ValueError(msg.getvalue())
 
+        results = {}
+        pending = self.requirements
+        if self.options.skip_existing:
+            results.update(self._findExisting())
+            pending = [x for x in self.requirements if x not in results]
+
+        if pending and self.options.jobs > 1:
+            results.update(self._scanConcurrently(pending))
+        elif pending:
+            results.update(self._scanSerially(pending))
+
+        self.blather('=' * 50)
+        self.blather('Merging indexes')
+        self.blather('=' * 50)
+
+        # Each found dist's location is the archive already downloaded
+        # for it, so copy those directly rather than re-scanning tmpdir.
+        copied = set()
+        for rqmt in self.requirements:
+            dist = results.get(rqmt)
+            if dist is None:
+                continue
+            location = dist.location
+            if location in copied or not os.path.isfile(location):
+                continue
+            if os.path.dirname(location) == self.path:
+                continue # already in place
+            self._installArchive(location)
+            copied.add(location)
+
+        if self.download_cache is not None:
+            evicted = self.download_cache.prune()
+            if evicted:
+                self.blather('Evicted %d archives from download cache'
+                                % len(evicted))
+
+        self.blather('=' * 50)
+        self.blather('Final Results')
+        self.blather('=' * 50)
+
+        found = [k for k, v in results.items() if v is not None]
+        notfound = [k for k, v in results.items() if v is None]
+        self.blather('Found eggs:')
+        for x in found:
+            self.blather('  ' + str(x))
+        self.blather('Not found eggs:')
+        for x in notfound:
+            self.blather('  ' + str(x))
+
+    def _installArchive(self, location):
+        # Archives downloaded into a tmpdir inside the target path can be
+        # renamed into place atomically, without writing them a second time.
+        if (self.options.download_in_path and
+                os.path.dirname(location) == self.tmpdir):
+            target = os.path.join(self.path, os.path.basename(location))
+            os.rename(location, target)
+        else:
+            shutil.copy(location, self.path)
+
+    def _makeIndex(self, **kw):
+        # Remote indexes share the download and page caches, if any.
+        if self.download_cache is not None:
+            kw['download_cache'] = self.download_cache
+            kw['page_cache'] = self.page_cache
+        if self.options.source_only and self.options.include_wheels:
+            kw['exclude_eggs'] = True
+        return self.index_factory(**kw)
+
+    def _sourceOnly(self):
+        # Wheels rank above sdists in setuptools' precedence:  admitting
+        # them means fetching binaries, with the index dropping eggs.
+        return self.options.source_only and not self.options.include_wheels
+
+    def _accepts(self, dist):
+        # Is 'dist', found in path, of a kind we would have fetched?
+        if dist.precedence <= pkg_resources.SOURCE_DIST:
+            return True
+        if not self.options.source_only:
+            return True
+        return self.options.include_wheels and dist.location.endswith('.whl')
+
+    def _findExisting(self):
+        # -> {rqmt: dist} for requirements satisfied by archives in path.
+        #
+        # One listing of the directory; project / version are parsed from
+        # the archive filenames, without opening the archives.
+        self.blather('=' * 50)
+        self.blather('Scanning %s for existing archives' % self.path)
+        self.blather('=' * 50)
+        available = {}
+        for filename in sorted(os.listdir(self.path)):
+            full = os.path.join(self.path, filename)
+            if not os.path.isfile(full):
+                continue
+            for dist in distros_for_filename(full):
+                if _hasValidVersion(dist):
+                    available.setdefault(dist.key, []).append(dist)
+
+        existing = {}
+        for rqmt in self.requirements:
+            for dist in available.get(rqmt.key, ()):
+                if dist in rqmt and self._accepts(dist):
+                    self.blather('  Already present: %s (%s)'
+                                    % (rqmt, os.path.basename(dist.location)))
+                    existing[rqmt] = dist
+                    break
+        return existing
+
+    def _scanSerially(self, requirements):
+        # -> {rqmt: dist or None}
+        source_only = self._sourceOnly()
+
         self.blather('=' * 50)
         self.blather('Scanning indexes for requirements')
         self.blather('=' * 50)
         results = {}
         for index_url in self.options.index_urls:
             self.blather('Package index: %s' % index_url)
-            index = self.index_factory(index_url=index_url)
-
-            source_only = self.options.source_only
+            index = self._makeIndex(index_url=index_url)
 
-            for rqmt in self.requirements:
-                if results.get(rqmt, False):
+            for rqmt in requirements:
+                if results.get(rqmt) is not None:
                     continue
                 try:
                     dist = index.fetch_distribution(rqmt, self.tmpdir,
@@ -165,66 +339,107 @@ class Fetcher:
                 except Exception as e:
                     self.error('  Error fetching: %s' % rqmt)
                     self.blather('    %s' % e)
-                    results[rqmt] = False
+                    results[rqmt] = None
                 else:
                     self.blather('  Searched for %s; found: %s'
                                 % (rqmt, (dist is not None)))
-                    results[rqmt] = (dist is not None)
+                    results[rqmt] = dist
 
         if self.options.find_links:
             self.blather('=' * 50)
             self.blather('Scanning find-links for requirements')
-            index = self.index_factory()
+            index = self._makeIndex()
             for find_link in self.options.find_links:
                 index.add_find_links([find_link])
                 self.blather('  ' + find_link)
             self.blather('=' * 50)
 
-            for rqmt in self.requirements:
-                if results.get(rqmt, False):
+            for rqmt in requirements:
+                if results.get(rqmt) is not None:
                     continue
                 dist = index.fetch_distribution(rqmt, self.tmpdir,
                                                 source=source_only)
                 self.blather('  Searched for %s; found: %s'
                               % (rqmt, (dist is not None)))
-                results[rqmt] = (dist is not None)
-
+                results[rqmt] = dist
+
+        return results
+
+    def _scanConcurrently(self, requirements):
+        # -> {rqmt: dist or None}
+        #
+        # Each worker thread resolves whole requirements, trying the indexes
+        # (and then the find-links) in command-line order, so the first
+        # index which satisfies a requirement still wins.  Package indexes
+        # cache scanned pages and are not thread-safe, so each worker gets
+        # its own set.  Messages are buffered per requirement and logged in
+        # requirement order, keeping the report deterministic.
         self.blather('=' * 50)
-        self.blather('Merging indexes')
+        self.blather('Scanning indexes for requirements (%d jobs)'
+                        % self.options.jobs)
         self.blather('=' * 50)
+        local = threading.local()
 
-        local_index = os.path.join(self.tmpdir)
-        local = self.index_factory(index_url=local_index,
-                                   search_path=(), # ignore installed!
-                                  )
+        def _resolve(rqmt):
+            return self._resolveRequirement(rqmt, local)
 
-        for rqmt in self.requirements:
+        results = {}
+        pool = ThreadPool(self.options.jobs)
+        try:
+            for rqmt, dist, messages in pool.imap(_resolve, requirements):
+                for is_error, text in messages:
+                    if is_error:
+                        self.error(text)
+                    else:
+                        self.blather(text)
+                results[rqmt] = dist
+        finally:
+            pool.close()
+            pool.join()
+
+        return results
+
+    def _getThreadIndexes(self, local):
+        # -> [(label, index)], created once per worker thread.
+        indexes = getattr(local, 'indexes', None)
+        if indexes is None:
+            indexes = local.indexes = []
+            for index_url in self.options.index_urls:
+                indexes.append((index_url,
+                                self._makeIndex(index_url=index_url)))
+            if self.options.find_links:
+                index = self._makeIndex()
+                index.add_find_links(self.options.find_links)
+                indexes.append(('find-links', index))
+        return indexes
+
+    def _resolveRequirement(self, rqmt, local):
+        # -> (rqmt, dist or None, [(is_error, text)])
+        messages = []
+        source_only = self._sourceOnly()
+        for label, index in self._getThreadIndexes(local):
             try:
-                dist = local.fetch_distribution(rqmt,
-                                                self.tmpdir,
-                                                force_scan=True)
-            except Exception:
-                dist = None
-            if dist is not None:
-                shutil.copy(dist.location, self.path)
-
-        self.blather('=' * 50)
-        self.blather('Final Results')
-        self.blather('=' * 50)
-
-        found = [k for k, v in results.items() if v]
-        notfound = [k for k, v in results.items() if not v]
-        self.blather('Found eggs:')
-        for x in found:
-            self.blather('  ' + str(x))
-        self.blather('Not found eggs:')
-        for x in notfound:
-            self.blather('  ' + str(x))
+                dist = index.fetch_distribution(rqmt, self.tmpdir,
+                                                source=source_only)
+            except Exception as e:
+                messages.append((True, '  Error fetching: %s' % rqmt))
+                messages.append((False, '    %s' % e))
+            else:
+                messages.append((False, '  Searched %s for %s; found: %s'
+                                    % (label, rqmt, (dist is not None))))
+                if dist is not None:
+                    return rqmt, dist, messages
+        return rqmt, None, messages
 
     def __call__(self): #pragma NO COVERAGE
         """ Call :meth:`download_distributions` and clean up.
         """
-        self.tmpdir = tempfile.mkdtemp(dir='.')
+        if self.options.download_in_path:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            self.tmpdir = tempfile.mkdtemp(dir=self.path, prefix='.compoze-')
+        else:
+            self.tmpdir = tempfile.mkdtemp(dir='.')
         try:
             self.download_distributions()
         finally:
@@ -255,6 +470,18 @@ class Fetcher:
         self.requirements = [x for x in pkg_resources.parse_requirements(args)
                                  if x.project_name != 'Python']
 
+def _hasValidVersion(dist):
+    # setuptools splits a filename every possible way:  'zope-interface-4.0'
+    # also yields project 'zope', version 'interface-4.0'.  Keep only the
+    # splits whose version is a real (PEP 440) one.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            version = pkg_resources.parse_version(dist.version)
+        except ValueError: # InvalidVersion, in newer setuptools
+            return False
+    return type(version).__name__ != 'LegacyVersion'
+
 def _print(text): #pragma NO COVERAGE
     print(text)
 
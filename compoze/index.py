@@ -1,16 +1,44 @@
+from pkg_resources import BINARY_DIST
+from pkg_resources import EGG_DIST
 from setuptools.package_index import PackageIndex
 
+from compoze.cacher import CachedPage
+from compoze._compat import HTTPError
+
 
 class CompozePackageIndex(PackageIndex):
     """ Override logging of :class:`setuptools.package_index.PackageIndex`.
 
     Collect logged messages, rather than spewing to :data:`sys.stdout`.
+
+    If passed a `download_cache` (see :class:`compoze.cacher.DownloadCache`),
+    consult it before downloading an archive, and add each archive it
+    downloads.
+
+    If passed a `page_cache` (see :class:`compoze.cacher.PageCache`), keep
+    each HTML page served with an ``ETag`` or ``Last-Modified`` header, and
+    revalidate it with a conditional request on later runs.
+
+    If `exclude_eggs` is true, ignore binary distributions other than
+    wheels, so that fetching with ``source=False`` yields either a wheel
+    or a source distribution.
     """
     def __init__(self, *args, **kwargs):
+        self.download_cache = kwargs.pop('download_cache', None)
+        self.page_cache = kwargs.pop('page_cache', None)
+        self.exclude_eggs = kwargs.pop('exclude_eggs', False)
         PackageIndex.__init__(self, *args, **kwargs)
         self.debug_msgs = []
         self.info_msgs = []
         self.warn_msgs = []
+        if self.page_cache is not None:
+            self._uncached_opener = self.opener
+            self.opener = self._conditionalOpen
+
+    def add(self, dist):
+        if self.exclude_eggs and dist.precedence in (BINARY_DIST, EGG_DIST):
+            return
+        return PackageIndex.add(self, dist)
 
     def debug(self, msg, *args):
         self.debug_msgs.append((msg, args))
@@ -20,3 +48,41 @@ class CompozePackageIndex(PackageIndex):
 
     def warn(self, msg, *args):
         self.warn_msgs.append((msg, args))
+
+    def _download_to(self, url, filename):
+        cache = self.download_cache
+        if cache is None:
+            return PackageIndex._download_to(self, url, filename)
+        if cache.retrieve(url, filename):
+            self.info("Using cached %s", url)
+            return {'content-type': 'application/octet-stream'}
+        headers = PackageIndex._download_to(self, url, filename)
+        if 'html' not in headers.get('content-type', '').lower():
+            cache.store(url, filename)
+        return headers
+
+    def _conditionalOpen(self, request):
+        url = request.get_full_url()
+        cached = self.page_cache.load(url)
+        if cached is not None:
+            for name, value in cached.validators():
+                request.add_header(name, value)
+        try:
+            fp = self._uncached_opener(request)
+        except HTTPError as e:
+            if e.code == 304 and cached is not None:
+                self.debug("Not modified: %s", url)
+                return cached.response()
+            raise
+        headers = fp.info()
+        if 'html' not in headers.get('content-type', '').lower():
+            return fp
+        if not (headers.get('etag') or headers.get('last-modified')):
+            return fp
+        try:
+            body = fp.read()
+            final_url = fp.geturl()
+        finally:
+            fp.close()
+        self.page_cache.save(url, final_url, str(headers), body)
+        return CachedPage(final_url, str(headers), body).response()
@@ -1,14 +1,35 @@
+import gzip
+import hashlib
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import optparse
 import os
 import pkginfo
 import shutil
+import signal
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
 import zipfile
+from xml.sax.saxutils import quoteattr
 
+try:
+    import resource
+except ImportError:                 #pragma NO COVER Windows
+    resource = None
+
+from compoze.cacher import MetadataCache
+from compoze.metadata import static_name_version
+from compoze._util import file_sha256
+from compoze._util import normalize_name
+from compoze._util import parse_size
+from compoze._util import scan_directory
+from compoze._compat import BytesIO
 from compoze._compat import StringIO
+from compoze._compat import brotli
 from compoze._compat import must_decode
 from compoze._compat import must_encode
 
@@ -17,18 +38,34 @@ class TarArchive:
     def __init__(self, filename):
         self.filename = filename
         self.tar = tarfile.open(filename, 'r')
+        self._seen = {}
 
     def names(self):
         return self.tar.getnames()
 
+    def iternames(self):
+        # Reads the (compressed) stream only as far as the caller consumes.
+        for member in self.tar:
+            self._seen[member.name] = member
+            yield member.name
+
     def lines(self, name):
         return [ x.rstrip() for x in self.tar.extractfile(name).readlines() ]
 
+    def read(self, name):
+        # Looking a member up by name would load the whole member list.
+        member = self._seen.get(name, name)
+        return self.tar.extractfile(member).read()
+
     def extract(self, name, tempdir):
         return self.tar.extract(name, tempdir)
 
-    def extractall(self, tempdir):
-        return self.tar.extractall(tempdir)
+    def extractall(self, tempdir, names=None):
+        members = None
+        if names is not None:
+            wanted = set(names)
+            members = [x for x in self.tar.getmembers() if x.name in wanted]
+        return self.tar.extractall(tempdir, members)
 
     def close(self):
         self.tar.close()
@@ -44,11 +81,19 @@ class ZipArchive:
             raise IOError('closed')
         return self.zipf.namelist()
 
+    def iternames(self):
+        return iter(self.names())
+
     def lines(self, name):
         if self.closed:
             raise IOError('closed')
         return must_encode(self.zipf.read(name)).split(b'\n')
 
+    def read(self, name):
+        if self.closed:
+            raise IOError('closed')
+        return self.zipf.read(name)
+
     def extract(self, name, tempdir):
         if self.closed:
             raise IOError('closed')
@@ -64,8 +109,10 @@ class ZipArchive:
             f.write(data)
             f.close()
 
-    def extractall(self, tempdir):
-        return self.zipf.extractall(tempdir)
+    def extractall(self, tempdir, names=None):
+        if self.closed:
+            raise IOError('closed')
+        return self.zipf.extractall(tempdir, names)
 
     def close(self):
         self.zipf.close()
@@ -77,8 +124,18 @@ _ARCHIVERS = [('.tar.gz', TarArchive),
               ('.bz2', TarArchive),
               ('.zip', ZipArchive),
               ('.egg', ZipArchive),
+              ('.whl', ZipArchive),
              ]
 
+_FORMATS = ('html', 'json', 'both')
+
+# Files kept next to archives which are not themselves distributions.
+_CORE_METADATA_SUFFIX = '.metadata'
+_SIDECAR_SUFFIXES = (_CORE_METADATA_SUFFIX, '.yanked')
+
+# PEP 691 simple repository API version of the JSON pages.
+_API_VERSION = '1.0'
+
 def _getArchiver(filename):
     for suffix, archiver in _ARCHIVERS:
         if filename.endswith(suffix):
@@ -126,17 +183,164 @@ class Indexer:
             default=getattr(global_options, 'keep_tempdir', False),
             help="Keep temporary directory")
 
+        parser.add_option(
+            '-w', '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=getattr(global_options, 'workers', 1),
+            help="Extract archive metadata using WORKERS processes")
+
+        parser.add_option(
+            '-m', '--metadata-cache',
+            action='store',
+            dest='metadata_cache',
+            default=getattr(global_options, 'metadata_cache', None),
+            help="Reuse metadata of unchanged archives cached in this file")
+
+        parser.add_option(
+            '-U', '--update',
+            action='store_true',
+            dest='update',
+            default=False,
+            help="Update an existing index in place, rewriting only the "
+                 "pages which changed")
+
+        parser.add_option(
+            '-a', '--atomic',
+            action='store_true',
+            dest='atomic',
+            default=False,
+            help="Build the index in a staging directory, then publish it "
+                 "by atomically swapping a symlink")
+
+        parser.add_option(
+            '-r', '--rollback',
+            action='store_true',
+            dest='rollback',
+            default=False,
+            help="Point the index symlink back at the previous generation")
+
+        parser.add_option(
+            '-F', '--format',
+            action='store',
+            type='choice',
+            choices=list(_FORMATS),
+            dest='format',
+            default=getattr(global_options, 'format', 'html'),
+            help="Write PEP 503 HTML pages ('html'), PEP 691 JSON pages "
+                 "('json'), or both ('both');  default 'html'")
+
+        parser.add_option(
+            '-z', '--compress',
+            action='store_true',
+            dest='compress',
+            default=getattr(global_options, 'compress', False),
+            help="Write pre-compressed '.gz' (and, if the 'brotli' module "
+                 "is installed, '.br') copies of each page")
+
+        parser.add_option(
+            '--core-metadata',
+            action='store_true',
+            dest='core_metadata',
+            default=getattr(global_options, 'core_metadata', False),
+            help="Write each archive's PKG-INFO next to it as a PEP 658 "
+                 "'.metadata' file, and advertise it in the index pages")
+
+        parser.add_option(
+            '--no-hashes',
+            action='store_false',
+            dest='hashes',
+            default=getattr(global_options, 'hashes', True),
+            help="Don't append '#sha256=' fragments to archive links")
+
+        parser.add_option(
+            '-x', '--run-setup-py',
+            action='store_true',
+            dest='run_setup_py',
+            default=getattr(global_options, 'run_setup_py', False),
+            help="Fall back to running 'setup.py --name --version' for "
+                 "archives whose metadata cannot be read statically")
+
+        parser.add_option(
+            '--setup-timeout',
+            action='store',
+            type='float',
+            dest='setup_timeout',
+            default=getattr(global_options, 'setup_timeout', 60.0),
+            help="Kill 'setup.py' after SETUP_TIMEOUT seconds "
+                 "(default 60)")
+
+        parser.add_option(
+            '--setup-cpu-limit',
+            action='store',
+            type='int',
+            dest='setup_cpu_limit',
+            default=getattr(global_options, 'setup_cpu_limit', None),
+            help="Limit 'setup.py' to SETUP_CPU_LIMIT seconds of CPU time")
+
+        parser.add_option(
+            '--setup-memory-limit',
+            action='store',
+            dest='setup_memory_limit',
+            default=getattr(global_options, 'setup_memory_limit', None),
+            help="Limit the address space of 'setup.py' (e.g. '512M')")
+
+        parser.add_option(
+            '--failure-report',
+            action='store',
+            dest='failure_report',
+            default=None,
+            help="Write archives whose metadata could not be extracted, "
+                 "with the reason, to this file")
+
         self.usage = parser.format_help()
 
         options, args = parser.parse_args(argv)
 
+        if options.workers < 1:
+            msg = StringIO()
+            msg.write('index: --workers must be a positive integer\n\n')
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+
+        if options.setup_timeout <= 0:
+            msg = StringIO()
+            msg.write('index: --setup-timeout must be positive\n\n')
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+
+        try:
+            options.setup_memory_limit = parse_size(
+                                            options.setup_memory_limit)
+        except ValueError as e:
+            msg = StringIO()
+            msg.write('index: %s\n\n' % e)
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+
+        if resource is None and (options.setup_cpu_limit is not None or
+                                 options.setup_memory_limit is not None):
+            msg = StringIO()
+            msg.write('index: resource limits are not supported on this '
+                      'platform\n\n')
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+
         self.options = options
 
         path = os.path.abspath(os.path.expanduser(options.path))
 
         self.path = path
+        self.failures = []
         self._logger = kw.get('logger', _print)
 
+    def __getstate__(self):
+        # Worker processes get their own logger;  see :func:`_initWorker`.
+        state = self.__dict__.copy()
+        state.pop('_logger', None)
+        return state
+
     def blather(self, text):
         if self.options.verbose:
             self._logger(text)
@@ -156,67 +360,320 @@ class Indexer:
             raise ValueError(msg.getvalue())
 
         index_dir = os.path.join(path, self.options.index_name)
-        if os.path.exists(index_dir):
+        atomic = self.options.atomic
+        update = self.options.update and os.path.isdir(index_dir)
+        if os.path.exists(index_dir) and not (update or atomic):
             raise ValueError('Index directory exists: %s' % index_dir)
 
         self.blather('=' * 50)
-        self.blather('Building index: %s' % index_dir)
+        if update:
+            self.blather('Updating index: %s' % index_dir)
+        else:
+            self.blather('Building index: %s' % index_dir)
         self.blather('=' * 50)
 
         projects = {}
+        self.failures = []
 
-        candidates = os.listdir(path)
-        for candidate in candidates:
-            cname = os.path.join(path, candidate)
-            if not os.path.isfile(cname):
-                continue
-            project, revision = self._extractNameVersion(cname)
-            if project is not None:
-                projects.setdefault(project, []).append((revision, candidate))
+        entries, sidecars = self._scanPath(path)
+        candidates = sorted(entries)
+
+        cache = None
+        if self.options.metadata_cache is not None:
+            cache = MetadataCache(self.options.metadata_cache)
+        try:
+            for candidate, (project, revision), sha256, extra in (
+                            self._extractAll(path, candidates, cache,
+                                             entries)):
+                if project is not None:
+                    extra = dict(extra)
+                    if not self.options.core_metadata:
+                        extra.pop('core_metadata_sha256', None)
+                    yanked = self._yanked(path, candidate, sidecars)
+                    if yanked is not None:
+                        extra['yanked'] = yanked
+                    projects.setdefault(normalize_name(project), []).append(
+                                        (revision, candidate, sha256, extra))
+        finally:
+            if cache is not None:
+                cache.close()
+
+        self._reportFailures()
 
         items = sorted(projects.items())
         if len(items) == 0:
             raise ValueError('No distributions in %s' % path)
 
-        os.makedirs(index_dir)
-        index_html = os.path.join(index_dir, 'index.html')
-        top = open(index_html, 'w')
-        top.writelines(['<html>\n',
-                        '<body>\n',
-                        '<h1>Package Index</h1>\n',
-                        '<ul>\n'])
+        if atomic:
+            build_dir = self._stagingDir(path)
+            self.blather('Staging: %s' % build_dir)
+            try:
+                if update:
+                    _linkTree(os.path.realpath(index_dir), build_dir)
+                else:
+                    os.makedirs(build_dir)
+                self._buildIndex(build_dir, projects, items, update)
+            except:
+                # Leave no partial generation behind.
+                shutil.rmtree(build_dir, ignore_errors=True)
+                raise
+            self._publish(path, build_dir)
+        else:
+            if not update:
+                os.makedirs(index_dir)
+            self._buildIndex(index_dir, projects, items, update)
 
+    def _buildIndex(self, build_dir, projects, items, update):
+        pages = self._pageRenderers()
+        written = 0
         for key, value in items:
             self.blather('Project: %s' % key)
-            dirname = os.path.join(index_dir, key)
-            os.makedirs(dirname)
-            top.write('<li><a href="%s">%s</a></li>\n' % (key, key))
+            for revision, archive, sha256, extra in value:
+                self.blather('  -> %s, %s' % (revision, archive))
+            for page, project_page, top_page in pages:
+                written += self._writePage(os.path.join(build_dir, key, page),
+                                           project_page(key, value))
 
-            sub_html = os.path.join(index_dir, key, 'index.html')
-            sub = open(sub_html, 'w')
-            sub.writelines(['<html>\n',
-                            '<body>\n',
-                            '<h1>%s Distributions</h1>\n' % key,
-                            '<ul>\n'])
+        for page, project_page, top_page in pages:
+            written += self._writePage(os.path.join(build_dir, page),
+                                       top_page(items))
 
-            for revision, archive in value:
-                self.blather('  -> %s, %s' % (revision, archive))
-                sub.write('<li><a href="../../%s">%s</a></li>\n'
-                                % (archive, archive))
+        if update:
+            removed = self._removeVanished(build_dir, projects)
+            self.blather('Rewrote %d pages; removed %d projects'
+                            % (written, removed))
 
-            sub.writelines(['</ul>\n',
-                            '</body>\n',
-                            '</html>\n'])
-            sub.close()
+    def rollback_index(self, path=None):
+        """ Re-publish the generation preceding the current one.
 
-        top.writelines(['</ul>\n',
-                        '</body>\n',
-                        '</html>\n'])
-        top.close()
+        Only meaningful for indexes built with ``--atomic``.
+        """
+        if path is None:
+            path = self.path
+        index_dir = os.path.join(path, self.options.index_name)
+        if not os.path.islink(index_dir):
+            raise ValueError('Not an atomically published index: %s'
+                                % index_dir)
+        current = os.path.basename(os.path.realpath(index_dir))
+        previous = None
+        for number, name in self._generations(path):
+            if name == current:
+                break
+            previous = name
+        if previous is None:
+            raise ValueError('No previous generation for: %s' % index_dir)
+        self._swapLink(index_dir, previous)
+        self.blather('Rolled back %s to %s' % (index_dir, previous))
+        return os.path.join(path, previous)
+
+    def _generations(self, path):
+        # -> sorted [(number, name)] of index generations in path.
+        prefix = '.%s-' % self.options.index_name
+        result = []
+        for name in os.listdir(path):
+            suffix = name[len(prefix):]
+            if (name.startswith(prefix) and suffix.isdigit() and
+                    os.path.isdir(os.path.join(path, name))):
+                result.append((int(suffix), name))
+        return sorted(result)
+
+    def _stagingDir(self, path):
+        generations = self._generations(path)
+        number = generations and generations[-1][0] + 1 or 1
+        index_dir = os.path.join(path, self.options.index_name)
+        if os.path.isdir(index_dir) and not os.path.islink(index_dir):
+            number += 1 # reserve a generation for the existing directory
+        return os.path.join(path, '.%s-%d' % (self.options.index_name,
+                                              number))
+
+    def _publish(self, path, build_dir):
+        # Swap the index symlink to point at build_dir, keeping the
+        # generation it replaces (for rollback), and removing older ones.
+        index_dir = os.path.join(path, self.options.index_name)
+        build_name = os.path.basename(build_dir)
+        build_number = int(build_name.rsplit('-', 1)[1])
+        previous = None
+        if os.path.islink(index_dir):
+            previous = os.path.basename(os.path.realpath(index_dir))
+        elif os.path.isdir(index_dir):
+            # Convert a plain index directory into the previous generation.
+            previous = '.%s-%d' % (self.options.index_name, build_number - 1)
+            os.rename(index_dir, os.path.join(path, previous))
+        self._swapLink(index_dir, build_name)
+        self.blather('Published: %s -> %s' % (index_dir, build_name))
+
+        keep = (build_name, previous)
+        for number, name in self._generations(path):
+            if name not in keep and number < build_number:
+                shutil.rmtree(os.path.join(path, name))
+
+    def _swapLink(self, index_dir, target):
+        tmp_link = '%s.%d.tmp' % (index_dir, os.getpid())
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(target, tmp_link)
+        os.rename(tmp_link, index_dir)
+
+    def _pageRenderers(self):
+        # -> [(page filename, project page renderer, top page renderer)]
+        result = []
+        if self.options.format in ('html', 'both'):
+            result.append(('index.html', self._projectPage, self._topPage))
+        if self.options.format in ('json', 'both'):
+            result.append(('index.json', self._projectJSON, self._topJSON))
+        return result
+
+    def _scanPath(self, path):
+        # -> ({candidate: DirEntry}, set([sidecar])) from a single listing.
+        entries = {}
+        sidecars = set()
+        for entry in scan_directory(path):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(_SIDECAR_SUFFIXES):
+                sidecars.add(entry.name)
+            else:
+                entries[entry.name] = entry
+        return entries, sidecars
+
+    def _yanked(self, path, candidate, sidecars=None):
+        # -> None, or the reason ('' if none given) an archive is yanked,
+        #    marked by a '<archive>.yanked' file next to it.  'sidecars',
+        #    if passed, holds the names of such files known to exist.
+        name = '%s.yanked' % candidate
+        if sidecars is not None and name not in sidecars:
+            return None
+        marker = os.path.join(path, name)
+        if os.path.isfile(marker):
+            with open(marker) as f:
+                return f.read().strip()
+
+    def _topPage(self, items):
+        lines = ['<html>\n',
+                 '<body>\n',
+                 '<h1>Package Index</h1>\n',
+                 '<ul>\n']
+        for key, value in items:
+            lines.append('<li><a href="%s">%s</a></li>\n' % (key, key))
+        lines.extend(['</ul>\n',
+                      '</body>\n',
+                      '</html>\n'])
+        return ''.join(lines)
+
+    def _projectPage(self, key, value):
+        lines = ['<html>\n',
+                 '<body>\n',
+                 '<h1>%s Distributions</h1>\n' % key,
+                 '<ul>\n']
+        for revision, archive, sha256, extra in value:
+            href = '../../%s' % archive
+            if sha256 is not None:
+                href = '%s#sha256=%s' % (href, sha256)
+            attrs = ''
+            if extra.get('requires_python'):
+                attrs += ' data-requires-python=%s' % quoteattr(
+                                                extra['requires_python'])
+            if 'yanked' in extra:
+                attrs += ' data-yanked=%s' % quoteattr(extra['yanked'])
+            if 'core_metadata_sha256' in extra:
+                # PEP 658 named the attribute;  PEP 714 renamed it.
+                value = quoteattr('sha256=%s' % extra['core_metadata_sha256'])
+                attrs += ' data-dist-info-metadata=%s' % value
+                attrs += ' data-core-metadata=%s' % value
+            lines.append('<li><a href="%s"%s>%s</a></li>\n'
+                            % (href, attrs, archive))
+        lines.extend(['</ul>\n',
+                      '</body>\n',
+                      '</html>\n'])
+        return ''.join(lines)
+
+    def _topJSON(self, items):
+        data = {'meta': {'api-version': _API_VERSION},
+                'projects': [{'name': key} for key, value in items],
+               }
+        return json.dumps(data, sort_keys=True) + '\n'
+
+    def _projectJSON(self, key, value):
+        files = []
+        for revision, archive, sha256, extra in value:
+            info = {'filename': archive,
+                    'url': '../../%s' % archive,
+                    'hashes': {},
+                    'yanked': extra.get('yanked', False),
+                   }
+            if info['yanked'] == '':
+                info['yanked'] = True
+            if sha256 is not None:
+                info['hashes']['sha256'] = sha256
+            if extra.get('requires_python'):
+                info['requires-python'] = extra['requires_python']
+            if 'core_metadata_sha256' in extra:
+                hashes = {'sha256': extra['core_metadata_sha256']}
+                info['dist-info-metadata'] = hashes
+                info['core-metadata'] = hashes
+            files.append(info)
+        data = {'meta': {'api-version': _API_VERSION},
+                'name': key,
+                'files': files,
+               }
+        return json.dumps(data, sort_keys=True) + '\n'
+
+    def _writePage(self, filename, text):
+        # -> 1 if written, 0 if already up to date.
+        compressors = self._compressors()
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                unchanged = f.read() == text
+            # Pre-compressed copies must exist iff compression is enabled.
+            for suffix, compress in _COMPRESSORS:
+                enabled = (suffix, compress) in compressors
+                if os.path.isfile(filename + suffix) != enabled:
+                    unchanged = False
+            if unchanged:
+                return 0
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        data = must_encode(text)
+        # Write the compressed copies first, so that a server preferring
+        # them never pairs a new page with a stale copy for long.
+        for suffix, compress in _COMPRESSORS:
+            if (suffix, compress) in compressors:
+                _replaceFile(filename + suffix, compress(data))
+            elif os.path.isfile(filename + suffix):
+                os.remove(filename + suffix)
+        _replaceFile(filename, data)
+        return 1
+
+    def _compressors(self):
+        # -> [(suffix, compress)] for the pre-compressed copies to write.
+        if not self.options.compress:
+            return []
+        return [x for x in _COMPRESSORS if x[1] is not None]
+
+    def _removeVanished(self, index_dir, projects):
+        # Remove project pages for projects no longer in the directory.
+        # Only subdirectories holding an 'index.html' or 'index.json' are
+        # considered ours.
+        removed = 0
+        for name in sorted(os.listdir(index_dir)):
+            dirname = os.path.join(index_dir, name)
+            if name in projects or not os.path.isdir(dirname):
+                continue
+            if not [x for x in ('index.html', 'index.json')
+                        if os.path.isfile(os.path.join(dirname, x))]:
+                continue
+            self.blather('Removed project: %s' % name)
+            shutil.rmtree(dirname)
+            removed += 1
+        return removed
 
     def __call__(self): #pragma NO COVERAGE
-        """ Call :meth:`make_index` and clean up.
+        """ Call :meth:`make_index` (or :meth:`rollback_index`) and clean up.
         """
+        if self.options.rollback:
+            self.rollback_index()
+            return
         self.tmpdir = tempfile.mkdtemp(dir='.')
         try:
             self.make_index()
@@ -224,26 +681,176 @@ class Indexer:
             if not self.options.keep_tempdir:
                 shutil.rmtree(self.tmpdir)
 
+    def _extractAll(self, path, candidates, cache=None, entries=None):
+        # -> iterate (candidate, (project, version), sha256, {extra}) in
+        #    candidate order;  sha256 is None for non-distributions, or if
+        #    disabled.
+        results = {}
+        hashes = {}
+        stats = {}
+        extras = {}
+        misses = []
+        for candidate in candidates:
+            if cache is None:
+                misses.append(candidate)
+                continue
+            cname = os.path.join(path, candidate)
+            if entries is not None:
+                st = entries[candidate].stat()
+            else:
+                st = os.stat(cname)
+            stats[candidate] = st
+            cached = cache.lookup(cname, st)
+            if cached is None or self._needsCoreMetadata(cname, cached):
+                misses.append(candidate)
+            else:
+                self.blather('Cached: %s' % cname)
+                results[candidate] = cached['project'], cached['version']
+                hashes[candidate] = cached['sha256']
+                extras[candidate] = cached['extra']
+
+        for candidate, (project, version, extra) in self._extractMany(
+                                                            path, misses):
+            results[candidate] = project, version
+            core_metadata = extra.pop('core_metadata', None)
+            if core_metadata is not None and self.options.core_metadata:
+                extra['core_metadata_sha256'] = self._writeCoreMetadata(
+                            os.path.join(path, candidate), core_metadata)
+            extras[candidate] = extra
+
+        unhashed = []
+        if self.options.hashes:
+            unhashed = [x for x in candidates
+                            if results[x][0] is not None and
+                               hashes.get(x) is None]
+            hashes.update(self._hashMany(path, unhashed))
+
+        if cache is not None:
+            # Failures (e.g. a timeout) may be transient:  retry next run.
+            failed = set([x[0] for x in self.failures])
+            for candidate in set(misses) | set(unhashed):
+                cname = os.path.join(path, candidate)
+                if cname not in failed:
+                    project, version = results[candidate]
+                    cache.store(cname, project, version,
+                                sha256=hashes.get(candidate),
+                                extra=extras.get(candidate),
+                                st=stats[candidate])
+            cache.commit()
+
+        for candidate in candidates:
+            yield (candidate, results[candidate], hashes.get(candidate),
+                   extras.get(candidate) or {})
+
+    def _needsCoreMetadata(self, filename, cached):
+        # A cached distribution must be re-read if its '.metadata' file is
+        # wanted but was not written (or has since been removed).
+        if not self.options.core_metadata or cached['project'] is None:
+            return False
+        return ('core_metadata_sha256' not in cached['extra'] or
+                not os.path.isfile(filename + _CORE_METADATA_SUFFIX))
+
+    def _writeCoreMetadata(self, filename, data):
+        # -> sha256 of the PEP 658 '.metadata' file written for 'filename'.
+        sidecar = filename + _CORE_METADATA_SUFFIX
+        if os.path.isfile(sidecar):
+            with open(sidecar, 'rb') as f:
+                existing = f.read()
+        else:
+            existing = None
+        if existing != data:
+            self.blather('Metadata: %s' % sidecar)
+            _replaceFile(sidecar, data)
+        return hashlib.sha256(data).hexdigest()
+
+    def _hashMany(self, path, candidates):
+        # -> {candidate: sha256}.  hashlib releases the GIL while digesting
+        #    large blocks, so threads hash files in parallel.
+        cnames = [os.path.join(path, x) for x in candidates]
+        if self.options.workers == 1 or len(cnames) < 2:
+            digests = [_hashFile(x) for x in cnames]
+        else:
+            pool = ThreadPool(self.options.workers)
+            try:
+                digests = pool.map(_hashFile, cnames)
+            finally:
+                pool.close()
+                pool.join()
+        return dict(zip(candidates, digests))
+
+    def _extractMany(self, path, candidates):
+        # -> iterate (candidate, (project, version, {extra})) in candidate
+        #    order.
+        if self.options.workers == 1 or len(candidates) < 2:
+            for candidate in candidates:
+                cname = os.path.join(path, candidate)
+                yield candidate, self._extractMetadata(cname)
+            return
+
+        # Farm extraction out to worker processes;  results (and the
+        # messages logged while producing them) come back in candidate
+        # order, so the index is the same as for a serial run.
+        cnames = [os.path.join(path, x) for x in candidates]
+        pool = multiprocessing.Pool(self.options.workers,
+                                    _initWorker, (self,))
+        try:
+            results = pool.imap(_extractInWorker, cnames)
+            for candidate, (result, messages, failures) in zip(candidates,
+                                                               results):
+                for message in messages:
+                    self._logger(message)
+                self.failures.extend(failures)
+                yield candidate, result
+        finally:
+            pool.terminate()
+            pool.join()
+
     def _extractNameVersion(self, filename):
         # -> (project, version)
-        self.blather('Parsing: %s' % filename)
+        return self._extractMetadata(filename)[:2]
 
-        md = pkginfo.utils.get_metadata(filename)
-        if md is not None:
-            return md.name, md.version
+    def _extractMetadata(self, filename):
+        # -> (project, version, {extra})
+        self.blather('Parsing: %s' % filename)
 
-        # no PKG-INFO found, do it the hard way.
-        archive = _getArchiver(filename)
+        # Even for wheels, read the METADATA:  the pages advertise its
+        # 'Requires-Python' (and the result is cached).
+        wheel = _wheelNameVersion(filename)
+        try:
+            archive = _getArchiver(filename)
+        except (zipfile.BadZipfile, IOError, OSError):
+            if wheel is None:
+                raise
+            self.blather('Unreadable wheel -- using its filename')
+            return wheel + ({},)
         if archive is None:
+            md = pkginfo.utils.get_metadata(filename)
+            if md is not None:
+                return md.name, md.version, _pkgInfoExtra(md)
             self.blather('Unknown archive -- ignored')
 
         else:
             try:
+                # Stop at the first top-level PKG-INFO (or wheel METADATA),
+                # rather than walking the whole archive to list its members.
+                for name in archive.iternames():
+                    if _isPkgInfo(name) or _isWheelMetadata(name):
+                        data = archive.read(name)
+                        md = _parsePkgInfo(data)
+                        if md is not None:
+                            extra = _pkgInfoExtra(md)
+                            extra['core_metadata'] = data
+                            return md.name, md.version, extra
+
+                if wheel is not None:
+                    return wheel + ({},)
+
+                # no PKG-INFO found, do it the hard way.
                 names = archive.names()
                 if len(names) == 0:
                     self.blather('Unknown archive -- ignored')
-                    return None, None
-                setup, a_setup = None, None
+                    return None, None, {}
+                setup, a_setup, prefix = None, None, None
                 archive_dir = names[0].split('/', 1)[0]
                 the_setup = '%s/setup.py' %  archive_dir
                 for name in names:
@@ -263,33 +870,240 @@ class Indexer:
                     if a_setup:
                         setup = a_setup
 
+                if setup is None:
+                    prefix = None
+                    for static in ('pyproject.toml', 'setup.cfg'):
+                        if '%s/%s' % (archive_dir, static) in names:
+                            prefix = archive_dir
+                        elif static in names:
+                            prefix = ''
+                        if prefix is not None:
+                            break
+
+                if prefix is not None:
+                    name, version = static_name_version(archive, prefix)
+                    if name and version:
+                        return name, version, {}
+
+                if setup is not None and not self.options.run_setup_py:
+                    # A failure, so that it is reported, and not cached as
+                    # a miss for later runs with '--run-setup-py'.
+                    self._recordFailure(filename,
+                            'No static metadata (use --run-setup-py '
+                            'to execute setup.py)')
+                    return None, None, {}
+
                 if setup is not None:
                     tmpdir = tempfile.mkdtemp()
                     try:
-                        archive.extractall(tmpdir)
-                        command = ('cd %s/%s && %s setup.py --name --version'
-                                    % (tmpdir, prefix, sys.executable))
-                        popen = subprocess.Popen(command,
-                                                 stdout=subprocess.PIPE,
-                                                 stderr=subprocess.PIPE,
-                                                 shell=True,
-                                                )
-                        stdout, stderr = popen.communicate()
-                        rc = popen.wait()
-                        if rc == 0:
+                        archive.extractall(tmpdir,
+                                           _setupFiles(names, prefix))
+                        rc, stdout, stderr = self._runSetup(
+                                            os.path.join(tmpdir, prefix))
+                        if rc is None:
+                            self._recordFailure(filename,
+                                    'setup.py timed out after %s seconds'
+                                        % self.options.setup_timeout)
+                        elif rc < 0:
+                            self._recordFailure(filename,
+                                    'setup.py killed by signal %d' % -rc)
+                        elif rc == 0:
                             result = stdout.splitlines()[:2]
                             if len(result) == 2:
-                                return tuple([must_decode(x) for x in result])
+                                name, version = [must_decode(x)
+                                                    for x in result]
+                                return name, version, {}
                             else:
-                                self.blather('No name / version in setup.py')
+                                self._recordFailure(filename,
+                                            'No name / version in setup.py')
                         else:
-                            self.blather('Error in setup.py: %s' % stderr)
+                            self._recordFailure(filename,
+                                'Error in setup.py: %s' % must_decode(stderr))
                     finally:
                         shutil.rmtree(tmpdir)
             finally:
                 archive.close()
 
-        return None, None
+        return None, None, {}
+
+    def _runSetup(self, directory):
+        # -> (returncode, stdout, stderr);  returncode is None on timeout.
+        options = self.options
+        popen = subprocess.Popen([sys.executable, 'setup.py',
+                                  '--name', '--version'],
+                                 cwd=directory,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 preexec_fn=_prepareChild(
+                                                options.setup_cpu_limit,
+                                                options.setup_memory_limit),
+                                )
+        timed_out = []
+        def _kill():
+            timed_out.append(True)
+            _killProcessGroup(popen)
+        timer = threading.Timer(options.setup_timeout, _kill)
+        timer.start()
+        try:
+            stdout, stderr = popen.communicate()
+        finally:
+            timer.cancel()
+        rc = popen.wait()
+        if timed_out:
+            return None, stdout, stderr
+        return rc, stdout, stderr
+
+    def _recordFailure(self, filename, reason):
+        self.blather(reason)
+        self.failures.append((filename, reason))
+
+    def _reportFailures(self):
+        if self.failures:
+            self.blather('Failed archives:')
+            for filename, reason in self.failures:
+                self.blather('    %s: %s' % (filename, reason.splitlines()[0]))
+        report = self.options.failure_report
+        if report is not None:
+            with open(report, 'w') as f:
+                for filename, reason in self.failures:
+                    f.write('%s\t%s\n' % (filename,
+                                           ' '.join(reason.split())))
+
+def _prepareChild(cpu_limit, memory_limit):
+    # -> a 'preexec_fn' putting the child in its own process group (so that
+    #    any processes it starts can be killed with it) and applying the
+    #    limits, or None.
+    setsid = getattr(os, 'setsid', None)
+    if setsid is None and cpu_limit is None and memory_limit is None:
+        return None                 #pragma NO COVER Windows
+    def _apply():
+        if setsid is not None:
+            setsid()
+        if cpu_limit is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+        if memory_limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS,
+                               (memory_limit, memory_limit))
+    return _apply
+
+def _killProcessGroup(popen):
+    # Grandchildren hold the output pipes open too:  kill them as well.
+    killpg = getattr(os, 'killpg', None)
+    if killpg is None or getattr(os, 'setsid', None) is None:
+        popen.kill()                #pragma NO COVER Windows
+        return
+    try:
+        killpg(popen.pid, signal.SIGKILL)
+    except OSError: # already gone
+        pass
+
+_HASH_BLOCKSIZE = 1 << 20
+
+def _replaceFile(filename, data):
+    # Replace, rather than overwrite, so that readers never see a partial
+    # page, and pages hardlinked from another generation are left alone.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename),
+                               prefix='.%s' % os.path.basename(filename))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.rename(tmp, filename)
+
+def _gzip(data):
+    # mtime=0 keeps the output identical for identical pages.
+    buffer = BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', compresslevel=9,
+                       fileobj=buffer, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+_COMPRESSORS = [('.gz', _gzip),
+                ('.br', brotli is not None and brotli.compress or None),
+               ]
+
+def _hashFile(filename):
+    return file_sha256(filename, _HASH_BLOCKSIZE)
+
+def _isPkgInfo(name):
+    # PKG-INFO at the root of the archive, or one directory down.
+    parts = name.split('/')
+    return parts[-1] == 'PKG-INFO' and len(parts) <= 2
+
+def _isWheelMetadata(name):
+    # METADATA in a wheel's top-level '.dist-info' directory.
+    parts = name.split('/')
+    return (len(parts) == 2 and parts[0].endswith('.dist-info') and
+            parts[1] == 'METADATA')
+
+def _wheelNameVersion(filename):
+    # -> (project, version) parsed from a PEP 427 wheel filename, or None:
+    #    '{name}-{version}(-{build})?-{python}-{abi}-{platform}.whl'.
+    basename = os.path.basename(filename)
+    if not basename.endswith('.whl'):
+        return None
+    parts = basename[:-len('.whl')].split('-')
+    if len(parts) not in (5, 6) or not all(parts):
+        return None
+    return parts[0], parts[1]
+
+def _parsePkgInfo(data):
+    # -> a pkginfo.Distribution, or None if 'data' is not a usable PKG-INFO.
+    if b'Metadata-Version' not in data:
+        return None
+    md = pkginfo.Distribution()
+    md.parse(data)
+    if md.name and md.version:
+        return md
+
+def _pkgInfoExtra(md):
+    # -> metadata beyond name / version which index pages advertise.
+    extra = {}
+    requires_python = getattr(md, 'requires_python', None)
+    if requires_python:
+        extra['requires_python'] = requires_python
+    return extra
+
+# Files below the setup.py directory which running 'setup.py --name
+# --version' may plausibly need:  the package's modules (for a version
+# imported from it), plus setup.cfg / README / VERSION-style files.
+_SETUP_SUFFIXES = ('.py', '.cfg', '.toml', '.txt', '.rst', '.md', '.in')
+
+def _setupFiles(names, prefix):
+    # -> names to extract so that setup.py can run, skipping data payloads.
+    result = []
+    start = prefix and prefix + '/' or ''
+    for name in names:
+        if not name.startswith(start) or name.endswith('/'):
+            continue
+        relative = name[len(start):]
+        if '/' not in relative or relative.endswith(_SETUP_SUFFIXES):
+            result.append(name)
+    return result
+
+def _linkTree(source, target):
+    # Copy a directory of pages by hardlinking each file.
+    for dirpath, dirnames, filenames in os.walk(source):
+        relative = os.path.relpath(dirpath, source)
+        t_dir = os.path.normpath(os.path.join(target, relative))
+        os.makedirs(t_dir)
+        for filename in filenames:
+            os.link(os.path.join(dirpath, filename),
+                    os.path.join(t_dir, filename))
+
+_worker_indexer = None
+_worker_messages = []
+
+def _initWorker(indexer):
+    global _worker_indexer
+    _worker_indexer = indexer
+    indexer._logger = _worker_messages.append
+
+def _extractInWorker(filename):
+    # -> ((project, version, {extra}), [message], [(filename, reason)])
+    del _worker_messages[:]
+    _worker_indexer.failures = []
+    result = _worker_indexer._extractMetadata(filename)
+    return result, list(_worker_messages), _worker_indexer.failures
 
 def _print(text): #pragma NO COVERAGE
     print(text)
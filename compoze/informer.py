@@ -2,6 +2,7 @@ import optparse
 import pkg_resources
 import sys
 
+from compoze.cacher import PageCache
 from compoze.index import CompozePackageIndex
 from compoze._compat import StringIO
 
@@ -77,6 +78,13 @@ class Informer:
             default=False,
             help="Include development distributions")
 
+        parser.add_option(
+            '-C', '--cache-dir',
+            action='store',
+            dest='cache_dir',
+            default=getattr(global_options, 'cache_dir', None),
+            help="Revalidate index pages cached in this directory")
+
         self.usage = parser.format_help()
 
         options, args = parser.parse_args(argv)
@@ -95,6 +103,11 @@ class Informer:
 
         self.options = options
         self._expandRequirements(args)
+
+        self.page_cache = None
+        if options.cache_dir is not None:
+            self.page_cache = PageCache(options.cache_dir)
+
         self._logger = kw.get('logger', _print)
 
     def blather(self, text):
@@ -115,7 +128,7 @@ class Informer:
             self.blather('=' * 50)
             self.blather('Package index: %s' % index_url)
             self.blather('=' * 50)
-            index = self.index_factory(index_url=index_url)
+            index = self._makeIndex(index_url=index_url)
             index.prescan()
 
             for rqmt in self.requirements:
@@ -133,6 +146,11 @@ class Informer:
         """
         self.show_distributions()
 
+    def _makeIndex(self, **kw):
+        if self.page_cache is not None:
+            kw['page_cache'] = self.page_cache
+        return self.index_factory(**kw)
+
     def _expandRequirements(self, args):
         args = list(args)
         if self.options.fetch_site_packages:
@@ -0,0 +1,133 @@
+""" Static extraction of project name / version from source archives.
+
+Reads ``pyproject.toml``, ``setup.cfg`` and literal keyword arguments to
+``setup()`` in ``setup.py`` directly from the archive, without extracting
+or executing anything.
+"""
+import ast
+
+from compoze._compat import ConfigParser
+from compoze._compat import StringIO
+from compoze._compat import must_decode
+from compoze._compat import tomllib
+
+
+def static_name_version(archive, prefix=''):
+    """ Return ``(name, version)`` for the project rooted at `prefix`.
+
+    `archive` is an open :class:`compoze.indexer.TarArchive` or
+    :class:`compoze.indexer.ZipArchive`.  Return ``(None, None)`` unless
+    both values can be determined statically.
+    """
+    names = set(archive.names())
+
+    def _read(relname):
+        name = prefix and '%s/%s' % (prefix, relname) or relname
+        if name in names:
+            return must_decode(archive.read(name))
+
+    name = version = None
+    for source in (_fromPyproject, _fromSetupCfg, _fromSetupPy):
+        try:
+            s_name, s_version = source(_read)
+        except Exception:
+            continue
+        name = name or s_name
+        version = version or s_version
+        if name and version:
+            return name, version
+    return None, None
+
+def _fromPyproject(read):
+    text = read('pyproject.toml')
+    if text is None or tomllib is None:
+        return None, None
+    project = tomllib.loads(text).get('project', {})
+    dynamic = project.get('dynamic', ())
+    name = 'name' not in dynamic and project.get('name') or None
+    version = 'version' not in dynamic and project.get('version') or None
+    return name, version
+
+def _fromSetupCfg(read):
+    text = read('setup.cfg')
+    if text is None:
+        return None, None
+    parser = ConfigParser()
+    read_string = getattr(parser, 'read_string', None)
+    if read_string is not None:     #pragma NO COVER Py3k
+        read_string(text)
+    else:                           #pragma NO COVER Py2
+        parser.readfp(StringIO(text))
+    if not parser.has_section('metadata'):
+        return None, None
+    name = version = None
+    if parser.has_option('metadata', 'name'):
+        name = parser.get('metadata', 'name').strip() or None
+    if parser.has_option('metadata', 'version'):
+        version = _resolveCfgValue(parser.get('metadata', 'version').strip(),
+                                   read)
+    return name, version
+
+def _resolveCfgValue(value, read):
+    # Handle the 'file:' and 'attr:' directives understood by setuptools.
+    if value.startswith('file:'):
+        text = read(value[len('file:'):].strip())
+        return text and text.strip() or None
+    if value.startswith('attr:'):
+        dotted = value[len('attr:'):].strip()
+        module, attr = dotted.rsplit('.', 1)
+        path = module.replace('.', '/')
+        for candidate in ('%s.py' % path,
+                          '%s/__init__.py' % path,
+                          'src/%s.py' % path,
+                          'src/%s/__init__.py' % path):
+            text = read(candidate)
+            if text is not None:
+                return _moduleConstants(ast.parse(text)).get(attr)
+        return None
+    return value or None
+
+def _fromSetupPy(read):
+    text = read('setup.py')
+    if text is None:
+        return None, None
+    tree = ast.parse(text)
+    constants = _moduleConstants(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and _callName(node.func) == 'setup':
+            found = {}
+            for keyword in node.keywords:
+                if keyword.arg in ('name', 'version'):
+                    found[keyword.arg] = _literalString(keyword.value,
+                                                        constants)
+            return found.get('name'), found.get('version')
+    return None, None
+
+def _callName(func):
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+
+def _moduleConstants(tree):
+    # -> {name: string} for module-level assignments of string literals.
+    result = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            value = _literalString(node.value, result)
+            if value is None:
+                continue
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    result[target.id] = value
+    return result
+
+def _literalString(node, constants):
+    if isinstance(node, ast.Name):
+        return constants.get(node.id)
+    try:
+        value = ast.literal_eval(node)
+    except ValueError:
+        return None
+    if isinstance(value, (type(''), type(u''))):
+        return value
@@ -1,11 +1,33 @@
+import errno
+import glob
+import json
+from multiprocessing.pool import ThreadPool
 import optparse
 import os
 import shutil
+import stat
 import sys
 
 from compoze._compat import StringIO
+from compoze._compat import must_encode
+from compoze._util import file_sha256
+from compoze._util import scan_directory
+from compoze._util import write_atomically
 
-ARCHIVE_EXTS = ('tar.gz', 'tgz', 'zip', 'tar.bz2', 'tbz')
+try:
+    import fcntl
+except ImportError: #pragma NO COVER Windows
+    fcntl = None
+
+ARCHIVE_EXTS = ('tar.gz', 'tgz', 'zip', 'tar.bz2', 'tbz', 'whl')
+
+MANIFEST_NAME = 'manifest.json'
+
+JOURNAL_NAME = '.journal.json'
+
+REFLINKS_NAME = 'reflinks.json'
+
+LINK_MODES = ('symlink', 'relative', 'hardlink', 'reflink')
 
 
 def is_archive(f):
@@ -46,6 +68,57 @@ class Pooler(object):
             default=getattr(global_options, 'path', '.'),
             help="Path to process")
 
+        parser.add_option(
+            '-r', '--release-dir',
+            action='append',
+            dest='release_dirs',
+            default=[],
+            help="Release directory (or glob pattern) to pool, or to "
+                 "consult with --gc, instead of --path;  may be repeated")
+
+        parser.add_option(
+            '-j', '--jobs',
+            action='store',
+            type='int',
+            dest='jobs',
+            default=getattr(global_options, 'jobs', 1),
+            help="Scan release directories and hash archives using JOBS "
+                 "threads")
+
+        parser.add_option(
+            '-g', '--gc',
+            action='store_true',
+            dest='gc',
+            default=False,
+            help="List pooled archives which no --release-dir links to")
+
+        parser.add_option(
+            '--remove',
+            action='store_true',
+            dest='gc_remove',
+            default=False,
+            help="With --gc, remove the unreferenced archives")
+
+        parser.add_option(
+            '-L', '--link-mode',
+            action='store',
+            type='choice',
+            choices=LINK_MODES,
+            dest='link_mode',
+            default='symlink',
+            help="How to link pooled archives back into the release dirs:  "
+                 "absolute 'symlink' (the default), 'relative' symlink, "
+                 "'hardlink', or copy-on-write 'reflink'")
+
+        parser.add_option(
+            '--content-addressed',
+            action='store_true',
+            dest='content_addressed',
+            default=False,
+            help="Store archives in the pool under their SHA-256 digest, "
+                 "recording each archive name in the pool's "
+                 "'%s'" % MANIFEST_NAME)
+
         self.usage = parser.format_help()
 
         options, args = parser.parse_args(argv)
@@ -55,29 +128,211 @@ class Pooler(object):
         if len(args) == 1:
             self.pool_dir = args[0]
 
+        if options.jobs < 1:
+            raise ValueError('--jobs must be at least 1')
+
         self.release_dir = os.path.abspath(options.path)
+        self.release_dirs = []
+        # '--path' (which defaults to '.') is only a fallback:  pooling the
+        # current directory by accident could move the wrong archives.
+        for pattern in options.release_dirs or [options.path]:
+            for release_dir in _expandReleaseDir(pattern):
+                release_dir = os.path.abspath(release_dir)
+                if release_dir not in self.release_dirs:
+                    self.release_dirs.append(release_dir)
+
+        if self.pool_dir is not None:
+            real_pool_dir = os.path.realpath(self.pool_dir)
+            for release_dir in self.release_dirs:
+                if os.path.realpath(release_dir) == real_pool_dir:
+                    raise ValueError('Release dir is the pool dir: %s'
+                                        % release_dir)
+        self.mismatches = []
+        self.report = []
         self._logger = kw.get('logger', _print)
 
     def blather(self, text):
         if self.options.verbose:
             self._logger(text)
 
-    def listArchives(self):
+    def listArchives(self, release_dir=None, pooled=None, reflinks=None):
+        """ Return ``(all, pending)`` archive names in `release_dir`.
+
+        `release_dir` defaults to the '--path' option;  `pending` holds the
+        archives which are not yet symlinks, nor hardlinks to the files in
+        `pooled` (a mapping as returned by :meth:`_pooledInodes`), nor
+        unchanged clones recorded in `reflinks` (as returned by
+        :meth:`loadReflinks`).
+        """
+        if release_dir is None:
+            release_dir = self.release_dir
         all = []
         pending = []
-        archives = ([], [])
-        for filename in os.listdir(self.release_dir):
-            full = os.path.join(self.release_dir, filename)
-            if is_archive(full) and os.path.isfile(full):
-                if not os.path.islink(full):
-                    pending.append(filename)
-                all.append(filename)
+        # The archive test is on the name alone;  the directory listing
+        # itself says which entries are (links to) files.
+        for entry in scan_directory(release_dir):
+            if is_archive(entry.name) and entry.is_file():
+                if not (entry.is_symlink() or
+                        pooled and _findSameFile(entry, pooled) or
+                        reflinks and _reflinkTarget(
+                                        entry.path,
+                                        entry.stat(follow_symlinks=False),
+                                        reflinks)):
+                    pending.append(entry.name)
+                all.append(entry.name)
         return all, pending
 
+    def listReferences(self):
+        """ Return the set of normalized paths linked to from the release
+        directories.
+
+        Each release directory is listed once;  only its symlinks are read.
+        """
+        return self._collectReferences()[0]
+
+    def _collectReferences(self):
+        # -> (set of symlink targets, {inode: [entry]} of regular files)
+        targets = set()
+        files = {}
+        reflinks = self.loadReflinks()
+        for r_targets, r_files in self._map(
+                        lambda x: self._scanReleaseDir(x, reflinks),
+                        self.release_dirs):
+            targets.update(r_targets)
+            for entry in r_files:
+                files.setdefault(entry.inode(), []).append(entry)
+        return targets, files
+
+    def _scanReleaseDir(self, release_dir, reflinks=None):
+        if not os.path.isdir(release_dir):
+            raise ValueError('Release dir is not a directory: %s'
+                                % release_dir)
+        targets = []
+        files = []
+        for entry in scan_directory(release_dir):
+            if entry.is_symlink():
+                target = os.readlink(entry.path)
+                targets.append(os.path.normpath(
+                                os.path.join(release_dir, target)))
+            elif is_archive(entry.name):
+                files.append(entry) # may be hardlinked from the pool
+                if reflinks:
+                    target = _reflinkTarget(entry.path,
+                                            entry.stat(follow_symlinks=False),
+                                            reflinks)
+                    if target is not None:
+                        targets.append(target)
+        return targets, files
+
+    def listPooled(self):
+        """ Return the absolute paths of the archives in the pool.
+
+        Include both archives pooled by name and blobs pooled by digest.
+        """
+        return [entry.path for entry in self._pooledEntries()]
+
+    def _pooledEntries(self):
+        pool_dir = os.path.abspath(self.pool_dir)
+        result = [entry for entry in scan_directory(pool_dir)
+                    if is_archive(entry.name) and entry.is_file()
+                        and not entry.is_symlink()]
+        blob_dir = os.path.join(pool_dir, 'sha256')
+        if os.path.isdir(blob_dir):
+            for prefix in scan_directory(blob_dir):
+                if not prefix.is_dir():
+                    continue
+                result.extend([entry for entry
+                                in scan_directory(prefix.path)
+                                if not entry.name.startswith('.')
+                                    and entry.is_file()])
+        return result
+
+    def _pooledInodes(self):
+        # -> {inode: [entry]}.  Directory listings report inode numbers
+        #    for free;  devices are only compared on a match.
+        result = {}
+        for entry in self._pooledEntries():
+            result.setdefault(entry.inode(), []).append(entry)
+        return result
+
+    def collectGarbage(self):
+        """ Find pooled archives which no release directory links to.
+
+        Remove them if the '--remove' option is set, also dropping their
+        digests from the manifest and stale records of reflinked copies.
+        Return their paths.
+        """
+        if self.pool_dir is None:
+            msg = StringIO()
+            msg.write('No pool_dir!\n\n')
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+
+        if not os.path.isdir(self.pool_dir):
+            raise ValueError('Pool dir is not a directory: %s'
+                                % self.pool_dir)
+
+        if os.path.exists(os.path.join(self.pool_dir, JOURNAL_NAME)):
+            raise ValueError('Interrupted pool run;  run compoze pool on %s '
+                             'to complete it first' % self.pool_dir)
+
+        # Never fall back to '--path':  run from the wrong directory, every
+        # pooled archive would look unreferenced.
+        if not self.options.release_dirs or not self.release_dirs:
+            msg = StringIO()
+            msg.write('--gc requires at least one --release-dir\n\n')
+            msg.write(self.usage)
+            raise ValueError(msg.getvalue())
+
+        referenced, files = self._collectReferences()
+        pool_dir = os.path.abspath(self.pool_dir)
+        # Links may have been made through another path to the pool.
+        real_pool_dir = os.path.realpath(pool_dir)
+        unreferenced = []
+        for entry in self._pooledEntries():
+            path = entry.path
+            alias = os.path.join(real_pool_dir,
+                                 os.path.relpath(path, pool_dir))
+            if (path not in referenced and alias not in referenced
+                    and not _findSameFile(entry, files)):
+                unreferenced.append(path)
+
+        if not self.options.gc_remove:
+            for path in unreferenced:
+                self.blather('Unreferenced: %s' % path)
+            return unreferenced
+
+        for path in unreferenced:
+            os.remove(path)
+            self.blather('Removed %s' % path)
+        removed = set([os.path.basename(x) for x in unreferenced])
+        manifest = self.loadManifest()
+        if manifest and removed:
+            for archive, digests in list(manifest.items()):
+                digests[:] = [x for x in digests if x not in removed]
+                if not digests:
+                    del manifest[archive]
+            self.saveManifest(manifest)
+        reflinks = self.loadReflinks()
+        stale = [x for x in reflinks if not _isRecordedReflink(x, reflinks)]
+        if stale:
+            for path in stale:
+                del reflinks[path]
+            self.saveReflinks(reflinks)
+        return unreferenced
+
     def move_to_pool(self):
-        """ Move archives the pool directory and create symlinks.
+        """ Move archives from the release directories to the pool
+        directory and create symlinks.
+
+        Ignore any archives which are already symlinks.  Archives found in
+        more than one release directory are moved once;  the symlinks are
+        all created after the moves.  Return the ``(all, pending)`` archive
+        names, summed over the release directories.
 
-        Ignore any archives which are already symlinks.
+        The planned operations are journaled in the pool directory first,
+        and each one leaves the release directory holding either the
+        archive or its link:  a later run resumes an interrupted one.
         """
         if self.pool_dir is None:
             msg = StringIO()
@@ -85,10 +340,30 @@ class Pooler(object):
             msg.write(self.usage)
             raise ValueError(msg.getvalue())
 
-        all, pending = self.listArchives()
+        if os.path.isdir(self.pool_dir):
+            self._resume()
+
+        pooled = None
+        reflinks = None
+        if os.path.isdir(self.pool_dir):
+            if self.options.link_mode == 'hardlink':
+                pooled = self._pooledInodes()
+            reflinks = self.loadReflinks()
+        listings = self._map(
+                        lambda x: self._listArchivesIn(x, pooled, reflinks),
+                        self.release_dirs)
+        all = []
+        pending = []
+        sources = []
+        self.report = []
+        for release_dir, (r_all, r_pending) in listings:
+            all.extend(r_all)
+            pending.extend(r_pending)
+            sources.extend([os.path.join(release_dir, x) for x in r_pending])
+            self.report.append((release_dir, len(r_all), len(r_pending)))
         if len(all) == 0:
             raise ValueError('No non-link archives in release dir: %s'
-                                % self.release_dir)
+                                % ', '.join(self.release_dirs))
 
         if not os.path.exists(self.pool_dir):
             self.blather('Created new pool dir %s' % self.pool_dir)
@@ -98,28 +373,340 @@ class Pooler(object):
             raise ValueError('Pool dir is not a directory: %s'
                                 % self.pool_dir)
 
-        for archive in pending:
-            source = os.path.join(self.release_dir, archive)
-            target = os.path.join(self.pool_dir, archive)
-            if not os.path.exists(target):
-                shutil.move(source, target)
-                self.blather('Moved %s to %s' % (source, target))
-            if os.path.exists(source):
-                os.remove(source)
-            os.symlink(target, source)
+        if self.options.content_addressed:
+            self._run(self._planByDigest(sources), self.options.link_mode)
+        else:
+            pool_dir = os.path.abspath(self.pool_dir)
+            # One listing of the pool replaces an existence check per
+            # archive.
+            existing = set([entry.path for entry
+                                in scan_directory(pool_dir)])
+            self._run([(x, os.path.join(pool_dir, os.path.basename(x)))
+                            for x in sources],
+                      self.options.link_mode, existing)
 
         return all, pending
 
+    def _listArchivesIn(self, release_dir, pooled=None, reflinks=None):
+        if not os.path.isdir(release_dir):
+            raise ValueError('Release dir is not a directory: %s'
+                                % release_dir)
+        return release_dir, self.listArchives(release_dir, pooled, reflinks)
+
+    def _run(self, operations, link_mode, existing=None):
+        # Pool the source archive of each '(source, target)' operation at
+        # 'target', then replace the source with a link.  Each step is
+        # atomic and idempotent, so the journaled operations can simply be
+        # run again after an interruption.
+        journal = os.path.join(self.pool_dir, JOURNAL_NAME)
+        data = {'link_mode': link_mode,
+                'operations': [list(x) for x in operations],
+               }
+        write_atomically(journal, must_encode(json.dumps(data) + '\n'))
+
+        created = set()
+        for source, target in operations:
+            if target in created:
+                exists = True
+            elif existing is not None:
+                exists = target in existing
+            else:
+                exists = os.path.exists(target)
+            if self._poolArchive(source, target, exists):
+                created.add(target)
+        # Pooled archives must be durable before any release copy goes.
+        for dirname in set([os.path.dirname(x) for x in created]):
+            _fsyncDirectory(dirname)
+
+        linked = set()
+        reflinks = self.loadReflinks()
+        recorded = len(reflinks)
+        for source, target in operations:
+            if self._linkArchive(target, source, link_mode, reflinks):
+                linked.add(os.path.dirname(source))
+        for dirname in linked:
+            _fsyncDirectory(dirname)
+        if len(reflinks) != recorded:
+            self.saveReflinks(reflinks)
+
+        os.remove(journal)
+        _fsyncDirectory(self.pool_dir)
+
+    def _resume(self):
+        journal = os.path.join(self.pool_dir, JOURNAL_NAME)
+        try:
+            with open(journal) as f:
+                data = json.load(f)
+        except (IOError, OSError):
+            return
+        self.blather('Resuming interrupted run from %s' % journal)
+        self._run([tuple(x) for x in data['operations']], data['link_mode'])
+
+    def _poolArchive(self, source, target, exists):
+        # Return true if 'target' was created.
+        if os.path.islink(source) or not os.path.exists(source):
+            return False # linked by an interrupted run
+        if exists:
+            self.blather('Deduplicated %s against %s' % (source, target))
+            return False
+        _copyIntoPlace(source, target)
+        self.blather('Moved %s to %s' % (source, target))
+        return True
+
+    def _linkArchive(self, target, source, link_mode, reflinks):
+        # Replace 'source' by a link to 'target';  return true if replaced.
+        # Record reflinked copies in 'reflinks'.
+        if os.path.islink(source):
+            return False
+        if (os.path.exists(source) and
+                _reflinkTarget(source, os.lstat(source), reflinks) == target):
+            return False
+        if not os.path.exists(target):
+            self.blather('Cannot link %s:  %s is missing' % (source, target))
+            return False
+        if (link_mode == 'hardlink' and os.path.exists(source)
+                and os.path.samefile(source, target)):
+            return False
+        tmp = _tempName(source)
+        _removeStale(tmp)
+        made = self._link(target, tmp, link_mode)
+        os.rename(tmp, source)
+        if made == 'reflink':
+            # A clone looks like any other file:  remember it.
+            st = os.lstat(source)
+            reflinks[source] = [os.path.abspath(target), st.st_size,
+                                st.st_mtime]
+        return True
+
+    def _link(self, target, source, mode=None):
+        # Create 'source' in the release dir, pointing at pooled 'target'.
+        # Return the link mode actually used.
+        target = os.path.abspath(target)
+        if mode is None:
+            mode = self.options.link_mode
+        if mode == 'relative':
+            os.symlink(os.path.relpath(target, os.path.dirname(source)),
+                       source)
+            return mode
+        if mode in ('hardlink', 'reflink'):
+            try:
+                if mode == 'hardlink':
+                    os.link(target, source)
+                else:
+                    _reflink(target, source)
+                return mode
+            except (AttributeError, IOError, OSError) as e:
+                # E.g., across filesystems.
+                self.blather('Cannot %s %s (%s);  symlinking instead'
+                                % (mode, target, e))
+        os.symlink(target, source)
+        return 'symlink'
+
+    def _map(self, func, items):
+        # Listing and hashing are dominated by syscalls and hashlib, both
+        # of which release the GIL.
+        if self.options.jobs == 1 or len(items) < 2:
+            return [func(x) for x in items]
+        pool = ThreadPool(min(self.options.jobs, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+
+    def blobPath(self, digest):
+        """ Return the path of the pooled archive with SHA-256 `digest`.
+        """
+        return os.path.join(os.path.abspath(self.pool_dir), 'sha256',
+                            digest[:2], digest)
+
+    def loadManifest(self):
+        """ Return the pool's manifest, mapping archive names to the list
+        of SHA-256 digests pooled under that name.
+        """
+        try:
+            with open(os.path.join(self.pool_dir, MANIFEST_NAME)) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return {}
+
+    def saveManifest(self, manifest):
+        data = json.dumps(manifest, sort_keys=True, indent=1) + '\n'
+        write_atomically(os.path.join(self.pool_dir, MANIFEST_NAME),
+                         must_encode(data))
+
+    def loadReflinks(self):
+        """ Return the pool's record of reflinked release copies, mapping
+        each copy's path to ``[target, size, mtime]``.
+        """
+        try:
+            with open(os.path.join(self.pool_dir, REFLINKS_NAME)) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return {}
+
+    def saveReflinks(self, reflinks):
+        data = json.dumps(reflinks, sort_keys=True, indent=1) + '\n'
+        write_atomically(os.path.join(self.pool_dir, REFLINKS_NAME),
+                         must_encode(data))
+
+    def _planByDigest(self, sources):
+        # -> [(source, target)].  Identical archives from any number of
+        #    release dirs share one blob;  an archive whose name is already
+        #    pooled with different contents gets its own blob, and is
+        #    reported in 'mismatches'.
+        digests = self._map(file_sha256, sources)
+        manifest = self.loadManifest()
+        operations = []
+        for source, digest in zip(sources, digests):
+            archive = os.path.basename(source)
+            known = manifest.setdefault(archive, [])
+            if digest not in known:
+                if known:
+                    self.mismatches.append((archive, digest, list(known)))
+                    self.blather('Mismatched contents for %s: sha256 %s, '
+                                 'already pooled as %s'
+                                    % (source, digest, ', '.join(known)))
+                known.append(digest)
+            operations.append((source, self.blobPath(digest)))
+        # Recording a digest before its blob exists is harmless.
+        self.saveManifest(manifest)
+        return operations
+
     def __call__(self): #pragma NO COVERAGE
-        """ Delegate to :meth:`move_to_pool` and report results.
+        """ Delegate to :meth:`move_to_pool` (or, with '--gc', to
+        :meth:`collectGarbage`) and report results.
         """
         try:
+            if self.options.gc:
+                unreferenced = self.collectGarbage()
+                self.blather("%s %i unreferenced archives"
+                    % (self.options.gc_remove and "Removed" or "Found",
+                       len(unreferenced)))
+                return
             all, pending = self.move_to_pool()
+            if len(self.report) > 1:
+                for release_dir, r_all, r_pending in self.report:
+                    self.blather("%s: updated %i out of %i archives"
+                                    % (release_dir, r_pending, r_all))
             self.blather(
-                "Updated %i out of %i archives" % (len(pending), len(all)))
+                "Updated %i out of %i archives in %i release dirs"
+                    % (len(pending), len(all), len(self.report)))
+            if self.mismatches:
+                self.blather("%i archives mismatched pooled archives of "
+                             "the same name" % len(self.mismatches))
         except ValueError as e:
             self.blather(str(e))
 
+def _findSameFile(entry, by_inode):
+    # Is the file for 'entry' among the entries in 'by_inode' (which may
+    # come from other devices)?
+    candidates = by_inode.get(entry.inode())
+    if not candidates:
+        return False
+    st = entry.stat(follow_symlinks=False)
+    for candidate in candidates:
+        if os.path.samestat(st, candidate.stat(follow_symlinks=False)):
+            return True
+    return False
+
+_FICLONE = 0x40049409 # <linux/fs.h>
+
+def _reflinkTarget(path, st, reflinks):
+    # -> the pooled archive the file at 'path' (with lstat result 'st') was
+    #    recorded as a clone of, or None if not recorded or since replaced.
+    record = reflinks.get(path)
+    if record is None:
+        return None
+    target, size, mtime = record
+    if (not stat.S_ISREG(st.st_mode) or st.st_size != size
+            or st.st_mtime != mtime):
+        return None
+    return target
+
+def _isRecordedReflink(path, reflinks):
+    # Is the file at 'path' still the clone recorded in 'reflinks'?
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return _reflinkTarget(path, st, reflinks) is not None
+
+def _reflink(target, source):
+    # Clone 'target' as 'source', sharing its blocks copy-on-write.
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'reflinks not supported here')
+    with open(target, 'rb') as src:
+        fd = os.open(source, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(fd, _FICLONE, src.fileno())
+        except:
+            os.close(fd)
+            os.remove(source)
+            raise
+        os.close(fd)
+    shutil.copymode(target, source)
+
+def _expandReleaseDir(pattern):
+    if glob.has_magic(pattern):
+        found = sorted([x for x in glob.glob(pattern) if os.path.isdir(x)])
+        if not found:
+            raise ValueError('Release dir pattern matches no directory: %s'
+                                % pattern)
+        return found
+    return [pattern]
+
+_COPY_BUFSIZE = 1 << 20
+
+def _tempName(path):
+    # Fixed, so that an interrupted run's leftovers are found again;  the
+    # leading dot keeps it out of listings.
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, '.%s.tmp' % basename)
+
+def _removeStale(path):
+    if os.path.lexists(path):
+        os.remove(path)
+
+def _copyIntoPlace(source, target):
+    # Put a copy of 'source' at 'target' without touching 'source', never
+    # exposing a partial 'target'.
+    dirname = os.path.dirname(target)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp = _tempName(target)
+    _removeStale(tmp)
+    try:
+        os.link(source, tmp) # same filesystem:  nothing to copy
+    except (AttributeError, OSError):
+        _copyFile(source, tmp)
+    os.rename(tmp, target)
+
+def _copyFile(source, target):
+    # Stream through a bounded buffer, and sync the data before returning.
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            while True:
+                block = src.read(_COPY_BUFSIZE)
+                if not block:
+                    break
+                dst.write(block)
+            dst.flush()
+            os.fsync(dst.fileno())
+    shutil.copystat(source, target)
+
+def _fsyncDirectory(path):
+    # Make renames within 'path' durable.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except (AttributeError, OSError): #pragma NO COVER Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError: #pragma NO COVER
+        pass
+    finally:
+        os.close(fd)
+
 def _print(text): #pragma NO COVERAGE
     print(text)
 
@@ -0,0 +1,450 @@
+import unittest
+
+class DownloadCacheTests(unittest.TestCase):
+
+    _tmpdirs = None
+
+    def tearDown(self):
+        if self._tmpdirs is not None:
+            import shutil
+            for x in self._tmpdirs:
+                shutil.rmtree(x)
+
+    def _getTargetClass(self):
+        from compoze.cacher import DownloadCache
+        return DownloadCache
+
+    def _makeOne(self, path=None, max_size=None):
+        if path is None:
+            path = self._makeTempDir()
+        return self._getTargetClass()(path, max_size)
+
+    def _makeTempDir(self):
+        import tempfile
+        if self._tmpdirs is None:
+            self._tmpdirs = []
+        result = tempfile.mkdtemp()
+        self._tmpdirs.append(result)
+        return result
+
+    def _makeFile(self, dir, name, text='TEXT'):
+        import os
+        filename = os.path.join(dir, name)
+        with open(filename, 'w') as f:
+            f.write(text)
+        return filename
+
+    def _digest(self, text):
+        import hashlib
+        from compoze._compat import must_encode
+        return hashlib.sha256(must_encode(text)).hexdigest()
+
+    def test_lookup_empty(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.lookup('http://example.com/foo.tgz'), None)
+
+    def test_store_and_lookup_by_url(self):
+        import os
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        digest = cache.store('http://example.com/foo.tgz#md5=abc', source)
+        self.assertEqual(digest, self._digest('FOO'))
+        blob = cache.lookup('http://example.com/foo.tgz')
+        self.assertEqual(blob, cache.blobPath(digest))
+        self.assertTrue(os.path.isfile(blob))
+
+    def test_lookup_by_sha256_fragment(self):
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        digest = cache.store('http://example.com/foo.tgz', source)
+        blob = cache.lookup('http://mirror.example.com/foo.tgz#sha256=%s'
+                                % digest)
+        self.assertEqual(blob, cache.blobPath(digest))
+
+    def test_lookup_sha256_fragment_mismatch_ignores_url_map(self):
+        import os
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'a.tar.gz', 'OLD')
+        cache.store('http://x/a.tar.gz', source)
+        url = 'http://x/a.tar.gz#sha256=%s' % self._digest('NEW')
+        self.assertEqual(cache.lookup(url), None)
+        target = os.path.join(self._makeTempDir(), 'a.tar.gz')
+        self.assertFalse(cache.retrieve(url, target))
+        self.assertFalse(os.path.exists(target))
+
+    def test_lookup_md5_fragment_verified(self):
+        import hashlib
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'a.tar.gz', 'OLD')
+        digest = cache.store('http://x/a.tar.gz', source)
+        old_md5 = hashlib.md5(b'OLD').hexdigest()
+        new_md5 = hashlib.md5(b'NEW').hexdigest()
+        self.assertEqual(cache.lookup('http://x/a.tar.gz#md5=%s' % old_md5),
+                         cache.blobPath(digest))
+        self.assertEqual(cache.lookup('http://x/a.tar.gz#md5=%s' % new_md5),
+                         None)
+
+    def test_lookup_rejects_path_traversal_fragment(self):
+        import os
+        tmpdir = self._makeTempDir()
+        cache = self._makeOne(os.path.join(tmpdir, 'cache'))
+        cache.store(None, self._makeFile(self._makeTempDir(), 'foo.tgz'))
+        self._makeFile(tmpdir, 'secret', 'SECRET')
+        # blob_dir/'..'/'../secret' is tmpdir/secret.
+        url = 'http://evil.example.com/x.tar.gz#sha256=../secret'
+        self.assertEqual(cache.lookup(url), None)
+        target = os.path.join(self._makeTempDir(), 'x.tar.gz')
+        self.assertFalse(cache.retrieve(url, target))
+        self.assertFalse(os.path.exists(target))
+
+    def test_lookup_rejects_invalid_digest_in_url_map(self):
+        import os
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        cache.store('http://example.com/foo.tgz', source)
+        url_path = cache._urlPath('http://example.com/foo.tgz')
+        with open(url_path, 'w') as f:
+            f.write(os.path.relpath(source, os.path.dirname(cache.blob_dir)))
+        self.assertEqual(cache.lookup('http://example.com/foo.tgz'), None)
+        self.assertEqual(cache.prune(0), [self._digest('FOO')])
+        self.assertFalse(os.path.exists(url_path))
+
+    def test_blobPath_invalid_digest(self):
+        cache = self._makeOne()
+        self.assertRaises(ValueError, cache.blobPath, '../../etc/passwd')
+        self.assertRaises(ValueError, cache.blobPath, 'A' * 64)
+        self.assertRaises(ValueError, cache.blobPath, 'a' * 63)
+
+    def test_store_same_content_twice_stored_once(self):
+        cache = self._makeOne()
+        tmpdir = self._makeTempDir()
+        one = self._makeFile(tmpdir, 'one.tgz', 'SAME')
+        two = self._makeFile(tmpdir, 'two.tgz', 'SAME')
+        cache.store('http://example.com/one.tgz', one)
+        cache.store('http://example.com/two.tgz', two)
+        self.assertEqual(len(cache.entries()), 1)
+        self.assertEqual(cache.lookup('http://example.com/one.tgz'),
+                         cache.lookup('http://example.com/two.tgz'))
+
+    def test_retrieve_miss(self):
+        import os
+        cache = self._makeOne()
+        target = os.path.join(self._makeTempDir(), 'foo.tgz')
+        self.assertFalse(cache.retrieve('http://example.com/foo.tgz', target))
+        self.assertFalse(os.path.exists(target))
+
+    def test_retrieve_hit(self):
+        import os
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        cache.store('http://example.com/foo.tgz', source)
+        target = os.path.join(self._makeTempDir(), 'foo.tgz')
+        self.assertTrue(cache.retrieve('http://example.com/foo.tgz', target))
+        with open(target) as f:
+            self.assertEqual(f.read(), 'FOO')
+
+    def test_retrieve_hit_hardlinks(self):
+        import os
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        digest = cache.store('http://example.com/foo.tgz', source)
+        target = os.path.join(cache.path, 'foo.tgz')
+        self._makeFile(cache.path, 'foo.tgz', 'STALE')
+        self.assertTrue(cache.retrieve('http://example.com/foo.tgz', target))
+        self.assertEqual(os.stat(target).st_ino,
+                         os.stat(cache.blobPath(digest)).st_ino)
+        with open(target) as f:
+            self.assertEqual(f.read(), 'FOO')
+
+    def test_retrieve_hit_world_readable(self):
+        import os
+        import stat
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        digest = cache.store('http://example.com/foo.tgz', source)
+        self.assertEqual(stat.S_IMODE(os.stat(cache.blobPath(digest)).st_mode),
+                         0o644)
+        target = os.path.join(self._makeTempDir(), 'foo.tgz')
+        self.assertTrue(cache.retrieve('http://example.com/foo.tgz', target))
+        self.assertEqual(stat.S_IMODE(os.stat(target).st_mode), 0o644)
+
+    def test_retrieve_hit_leaves_linked_copies_mtime(self):
+        import os
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        digest = cache.store('http://example.com/foo.tgz', source)
+        first = os.path.join(self._makeTempDir(), 'foo.tgz')
+        cache.retrieve('http://example.com/foo.tgz', first)
+        os.utime(first, (1000, 1000))
+        os.utime(cache._usedPath(digest), (1000, 1000))
+        second = os.path.join(self._makeTempDir(), 'foo.tgz')
+        self.assertTrue(cache.retrieve('http://example.com/foo.tgz', second))
+        self.assertEqual(os.stat(first).st_mtime, 1000)
+        [(used, size, found)] = cache.entries()
+        self.assertEqual(found, digest)
+        self.assertTrue(used > 1000)
+
+    def test_prune_wo_max_size(self):
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        cache.store('http://example.com/foo.tgz', source)
+        self.assertEqual(cache.prune(), [])
+        self.assertEqual(len(cache.entries()), 1)
+
+    def test_prune_evicts_least_recently_used(self):
+        import os
+        cache = self._makeOne(max_size=5)
+        tmpdir = self._makeTempDir()
+        old = self._makeFile(tmpdir, 'old.tgz', 'OLD')
+        new = self._makeFile(tmpdir, 'new.tgz', 'NEW')
+        old_digest = cache.store('http://example.com/old.tgz', old)
+        new_digest = cache.store('http://example.com/new.tgz', new)
+        os.utime(cache._usedPath(old_digest), (1000, 1000))
+        os.utime(cache._usedPath(new_digest), (2000, 2000))
+        self.assertEqual(cache.prune(), [old_digest])
+        self.assertFalse(os.path.exists(cache._usedPath(old_digest)))
+        self.assertEqual(cache.lookup('http://example.com/old.tgz'), None)
+        self.assertEqual(cache.lookup('http://example.com/new.tgz'),
+                         cache.blobPath(new_digest))
+        self.assertEqual(cache.totalSize(), 3)
+
+    def test_clear(self):
+        cache = self._makeOne()
+        source = self._makeFile(self._makeTempDir(), 'foo.tgz', 'FOO')
+        cache.store('http://example.com/foo.tgz', source)
+        cache.clear()
+        self.assertEqual(cache.entries(), [])
+        self.assertEqual(cache.lookup('http://example.com/foo.tgz'), None)
+
+class PageCacheTests(unittest.TestCase):
+
+    _tmpdir = None
+
+    def tearDown(self):
+        if self._tmpdir is not None:
+            import shutil
+            shutil.rmtree(self._tmpdir)
+
+    def _getTargetClass(self):
+        from compoze.cacher import PageCache
+        return PageCache
+
+    def _makeOne(self):
+        import tempfile
+        self._tmpdir = tempfile.mkdtemp()
+        return self._getTargetClass()(self._tmpdir)
+
+    def test_load_miss(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.load('http://example.com/simple/foo/'), None)
+        self.assertEqual(cache.count(), 0)
+
+    def test_save_and_load(self):
+        cache = self._makeOne()
+        headers = ('Content-Type: text/html; charset=utf-8\n'
+                   'ETag: "abc"\n'
+                   'Last-Modified: Sat, 01 Jan 2000 00:00:00 GMT\n\n')
+        cache.save('http://example.com/simple/foo/',
+                   'http://example.com/simple/foo/index.html',
+                   headers, b'<html></html>')
+        self.assertEqual(cache.count(), 1)
+        page = cache.load('http://example.com/simple/foo/')
+        self.assertEqual(page.url, 'http://example.com/simple/foo/index.html')
+        self.assertEqual(page.body, b'<html></html>')
+        self.assertEqual(page.validators(),
+                         [('If-None-Match', '"abc"'),
+                          ('If-Modified-Since',
+                           'Sat, 01 Jan 2000 00:00:00 GMT')])
+        response = page.response()
+        self.assertEqual(response.read(), b'<html></html>')
+        self.assertEqual(response.geturl(),
+                         'http://example.com/simple/foo/index.html')
+        self.assertEqual(response.info().get('content-type'),
+                         'text/html; charset=utf-8')
+
+    def test_clear(self):
+        cache = self._makeOne()
+        cache.save('http://example.com/simple/foo/',
+                   'http://example.com/simple/foo/',
+                   'ETag: "abc"\n\n', b'<html></html>')
+        cache.clear()
+        self.assertEqual(cache.count(), 0)
+        self.assertEqual(cache.load('http://example.com/simple/foo/'), None)
+
+class MetadataCacheTests(unittest.TestCase):
+
+    _tmpdir = None
+    _cache = None
+
+    def tearDown(self):
+        if self._cache is not None:
+            # Close before removing, lest sqlite delete its journal mid-way.
+            self._cache.close()
+        if self._tmpdir is not None:
+            import shutil
+            shutil.rmtree(self._tmpdir)
+
+    def _getTargetClass(self):
+        from compoze.cacher import MetadataCache
+        return MetadataCache
+
+    def _makeOne(self):
+        import os
+        import tempfile
+        self._tmpdir = tempfile.mkdtemp()
+        self._cache = self._getTargetClass()(os.path.join(self._tmpdir,
+                                                          'cache',
+                                                          'metadata.db'))
+        return self._cache
+
+    def _makeArchive(self, text='ARCHIVE'):
+        import os
+        filename = os.path.join(self._tmpdir, 'foo-1.0.tar.gz')
+        with open(filename, 'w') as f:
+            f.write(text)
+        return filename
+
+    def test_lookup_miss(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.lookup(self._makeArchive()), None)
+
+    def test_store_and_lookup(self):
+        cache = self._makeOne()
+        filename = self._makeArchive()
+        cache.store(filename, 'foo', '1.0', sha256='abc',
+                    extra={'requires_python': '>=2.6'})
+        self.assertEqual(cache.lookup(filename),
+                         {'project': 'foo',
+                          'version': '1.0',
+                          'sha256': 'abc',
+                          'extra': {'requires_python': '>=2.6'},
+                         })
+
+    def test_store_negative_result(self):
+        cache = self._makeOne()
+        filename = self._makeArchive()
+        cache.store(filename, None, None)
+        cached = cache.lookup(filename)
+        self.assertEqual(cached['project'], None)
+        self.assertEqual(cached['version'], None)
+
+    def test_lookup_stale_size(self):
+        cache = self._makeOne()
+        filename = self._makeArchive()
+        cache.store(filename, 'foo', '1.0')
+        self._makeArchive('CHANGED CONTENTS')
+        self.assertEqual(cache.lookup(filename), None)
+
+    def test_lookup_stale_mtime(self):
+        import os
+        cache = self._makeOne()
+        filename = self._makeArchive()
+        cache.store(filename, 'foo', '1.0')
+        os.utime(filename, (1000, 1000))
+        self.assertEqual(cache.lookup(filename), None)
+
+    def test_persists_across_instances(self):
+        cache = self._makeOne()
+        filename = self._makeArchive()
+        cache.store(filename, 'foo', '1.0')
+        cache.close()
+        other = self._cache = self._getTargetClass()(cache.filename)
+        self.assertEqual(other.lookup(filename)['project'], 'foo')
+
+class CacherTests(unittest.TestCase):
+
+    _tmpdir = None
+
+    def tearDown(self):
+        if self._tmpdir is not None:
+            import shutil
+            shutil.rmtree(self._tmpdir)
+
+    def _getTargetClass(self):
+        from compoze.cacher import Cacher
+        return Cacher
+
+    def _makeValues(self, **kw):
+        from optparse import Values
+        return Values(kw.copy())
+
+    def _makeOne(self, *args, **kw):
+        logger = kw.pop('logger', None)
+        options = self._makeValues(verbose=False)
+        if logger is not None:
+            return self._getTargetClass()(options, logger=logger, *args)
+        return self._getTargetClass()(options, *args)
+
+    def _makeTempDir(self):
+        import tempfile
+        result = self._tmpdir = tempfile.mkdtemp()
+        return result
+
+    def _populate(self, cache_dir):
+        import os
+        from compoze.cacher import DownloadCache
+        cache = DownloadCache(cache_dir)
+        source = os.path.join(cache_dir, 'foo.tgz')
+        with open(source, 'w') as f:
+            f.write('FOO')
+        digest = cache.store('http://example.com/foo.tgz', source)
+        os.remove(source)
+        return cache, digest
+
+    def test_ctor_defaults(self):
+        cacher = self._getTargetClass()(self._makeValues())
+        self.assertEqual(cacher.action, 'list')
+        self.assertEqual(cacher.options.cache_dir, None)
+        self.assertEqual(cacher.options.cache_max_size, None)
+        self.assertFalse(cacher.options.verbose)
+
+    def test_ctor_uses_global_options_as_default(self):
+        g_options = self._makeValues(verbose=True,
+                                     cache_dir='/tmp/cache',
+                                     cache_max_size='1G',
+                                    )
+        cacher = self._getTargetClass()(g_options, 'prune')
+        self.assertEqual(cacher.action, 'prune')
+        self.assertEqual(cacher.options.cache_dir, '/tmp/cache')
+        self.assertEqual(cacher.options.cache_max_size, '1G')
+        self.assertTrue(cacher.options.verbose)
+
+    def test_ctor_invalid_action_raises(self):
+        self.assertRaises(ValueError, self._makeOne, 'nonesuch')
+
+    def test_getCache_no_cache_dir_raises(self):
+        cacher = self._makeOne()
+        self.assertRaises(ValueError, cacher.getCache)
+
+    def test_list_cache(self):
+        cache_dir = self._makeTempDir()
+        cache, digest = self._populate(cache_dir)
+        logged = []
+        cacher = self._makeOne('--cache-dir=%s' % cache_dir,
+                               logger=logged.append)
+        entries = cacher.list_cache()
+        self.assertEqual([x[2] for x in entries], [digest])
+        self.assertEqual(logged[0], '%s %12d' % (digest, 3))
+        self.assertEqual(logged[1],
+                         '1 archives, 3 bytes in %s' % cache.path)
+        self.assertEqual(logged[2], '0 index pages')
+
+    def test_prune_cache_no_max_size_raises(self):
+        cache_dir = self._makeTempDir()
+        cacher = self._makeOne('--cache-dir=%s' % cache_dir)
+        self.assertRaises(ValueError, cacher.prune_cache)
+
+    def test_prune_cache(self):
+        cache_dir = self._makeTempDir()
+        cache, digest = self._populate(cache_dir)
+        cacher = self._makeOne('--cache-dir=%s' % cache_dir,
+                               '--cache-max-size=0', 'prune')
+        self.assertEqual(cacher.prune_cache(), [digest])
+        self.assertEqual(cache.entries(), [])
+
+    def test_clear_cache(self):
+        cache_dir = self._makeTempDir()
+        cache, digest = self._populate(cache_dir)
+        cacher = self._makeOne('--cache-dir=%s' % cache_dir, 'clear')
+        cacher.clear_cache()
+        self.assertEqual(cache.entries(), [])
@@ -71,6 +71,14 @@ class CompozerTests(unittest.TestCase, _CommandFaker):
         self.assertFalse(compozer.options.keep_tempdir)
         self.assertEqual(compozer.options.use_versions, False)
         self.assertEqual(compozer.options.versions_section, None)
+        self.assertEqual(compozer.options.cache_dir, None)
+        self.assertEqual(compozer.options.cache_max_size, None)
+
+    def test_ctor_cache_dir(self):
+        compozer = self._makeOne(argv=['--cache-dir=/tmp/cache',
+                                       '--cache-max-size=20G'])
+        self.assertEqual(compozer.options.cache_dir, '/tmp/cache')
+        self.assertEqual(compozer.options.cache_max_size, '20G')
 
     def test_ctor_quiet(self):
         compozer = self._makeOne(argv=['--quiet'])
@@ -139,6 +147,8 @@ class CompozerTests(unittest.TestCase, _CommandFaker):
                       'fetch-site-packages = true\n',
                       'include-binary-eggs = false\n',
                       'keep-tempdir = true\n',
+                      'cache-dir = /tmp/cache\n',
+                      'cache-max-size = 1G\n',
                       '\n',
                       '[other]\n',
                       'foo = bar\n',
@@ -160,6 +170,8 @@ class CompozerTests(unittest.TestCase, _CommandFaker):
         self.assertTrue(compozer.options.fetch_site_packages)
         self.assertFalse(compozer.options.source_only)
         self.assertTrue(compozer.options.keep_tempdir)
+        self.assertEqual(compozer.options.cache_dir, '/tmp/cache')
+        self.assertEqual(compozer.options.cache_max_size, '1G')
 
     def test_ctor_config_file_multiple(self):
         import os
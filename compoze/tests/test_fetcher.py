@@ -67,6 +67,12 @@ class FetcherTests(unittest.TestCase):
         self.assertEqual(fetcher.options.use_versions, False)
         self.assertEqual(fetcher.options.versions_section, None)
         self.assertEqual(fetcher.options.config_file_data, {})
+        self.assertEqual(fetcher.options.jobs, 1)
+        self.assertEqual(fetcher.options.cache_dir, None)
+        self.assertEqual(fetcher.download_cache, None)
+        self.assertFalse(fetcher.options.download_in_path)
+        self.assertFalse(fetcher.options.skip_existing)
+        self.assertFalse(fetcher.options.include_wheels)
 
     def test_ctor_uses_global_options_as_default(self):
         g_options = self._makeOptions(path='/tmp/foo',
@@ -125,6 +131,24 @@ class FetcherTests(unittest.TestCase):
         self.assertEqual(fetcher.options.find_links,
                          ['http://example.com/links'])
 
+    def test_ctor_jobs(self):
+        fetcher = self._makeOne('--jobs=4')
+        self.assertEqual(fetcher.options.jobs, 4)
+
+    def test_ctor_jobs_invalid_raises(self):
+        self.assertRaises(ValueError, self._makeOne, '--jobs=0')
+
+    def test_ctor_cache_dir(self):
+        import os
+        from compoze.cacher import DownloadCache
+        path = self._makeTempDir()
+        fetcher = self._makeOne('--cache-dir=%s' % path,
+                                '--cache-max-size=2K')
+        self.assertTrue(isinstance(fetcher.download_cache, DownloadCache))
+        self.assertEqual(fetcher.download_cache.path, path)
+        self.assertEqual(fetcher.download_cache.max_size, 2048)
+        self.assertEqual(fetcher.page_cache.path, os.path.join(path, 'pages'))
+
     def test_ctor_use_versions_no_versions_section(self):
         fetcher = self._makeOne('--use-versions')
         self.assertTrue(fetcher.options.use_versions)
@@ -260,15 +284,11 @@ class FetcherTests(unittest.TestCase):
         self.assertFalse(os.path.isdir(path))
         #os.makedirs(path) NOT!  we want download_distributions to make it.
         rqmt = Requirement.parse('compoze')
-        cheeseshop = self._makeIndex(rqmt)
-        local = self._makeIndex(rqmt, target=target)
+        cheeseshop = self._makeIndex(rqmt, target=target)
         def _factory(index_url, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
                 assert search_path is None
                 return cheeseshop
-            if index_url ==  target:
-                assert search_path == ()
-                return local
             raise ValueError(index_url)
         fetcher = self._makeOne('--quiet', '--path=%s' % path, 'compoze')
         self.assertFalse(os.path.isdir(path))
@@ -282,15 +302,11 @@ class FetcherTests(unittest.TestCase):
         from pkg_resources import Requirement
         target, path = self._makeDirs()
         rqmt = Requirement.parse('compoze')
-        cheeseshop = self._makeIndex(rqmt)
-        local = self._makeIndex(rqmt, target=target)
+        cheeseshop = self._makeIndex(rqmt, target=target)
         def _factory(index_url, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
                 assert search_path is None
                 return cheeseshop
-            if index_url ==  target:
-                assert search_path == ()
-                return local
             raise ValueError(index_url)
         fetcher = self._makeOne('--quiet', '--path=%s' % path, 'compoze')
         fetcher.index_factory = _factory
@@ -301,9 +317,6 @@ class FetcherTests(unittest.TestCase):
         self.assertEqual(cheeseshop._fetched_with,
                          [(rqmt, target, False, True, False)])
 
-        self.assertEqual(local._fetched_with,
-                         [(rqmt, target, True, False, False)])
-
         self.assertTrue(os.path.isfile(os.path.join(path, 'compoze')))
 
     def test_download_distributions_w_missing_dist(self):
@@ -312,14 +325,10 @@ class FetcherTests(unittest.TestCase):
         target, path = self._makeDirs()
         rqmt = Requirement.parse('compoze')
         cheeseshop = self._makeIndex()
-        local = self._makeIndex(target=target)
         def _factory(index_url, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
                 assert search_path is None
                 return cheeseshop
-            if index_url ==  target:
-                assert search_path == ()
-                return local
             raise ValueError(index_url)
         fetcher = self._makeOne('--quiet', '--path=%s' % path, 'compoze')
         fetcher.index_factory = _factory
@@ -330,9 +339,6 @@ class FetcherTests(unittest.TestCase):
         self.assertEqual(cheeseshop._fetched_with,
                          [(rqmt, target, False, True, False)])
 
-        self.assertEqual(local._fetched_with,
-                         [(rqmt, target, True, False, False)])
-
         self.assertFalse(os.path.isfile(os.path.join(path, 'compoze')))
 
     def test_download_distributions_w_dist_on_both_indexes(self):
@@ -340,9 +346,8 @@ class FetcherTests(unittest.TestCase):
         from pkg_resources import Requirement
         target, path = self._makeDirs()
         rqmt = Requirement.parse('compoze')
-        cheeseshop = self._makeIndex(rqmt)
-        other = self._makeIndex(rqmt)
-        local = self._makeIndex(rqmt, target=target)
+        cheeseshop = self._makeIndex(rqmt, target=target)
+        other = self._makeIndex(rqmt, target=target)
         def _factory(index_url, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
                 assert search_path is None
@@ -350,9 +355,6 @@ class FetcherTests(unittest.TestCase):
             if index_url == 'http://example.com/simple':
                 assert search_path is None
                 return other
-            if index_url ==  target:
-                assert search_path == ()
-                return local
             raise ValueError(index_url)
         fetcher = self._makeOne('--quiet', '--path=%s' % path,
                                 '--index=http://pypi.python.org/simple',
@@ -368,9 +370,6 @@ class FetcherTests(unittest.TestCase):
 
         self.assertEqual(other._fetched_with, [])
 
-        self.assertEqual(local._fetched_with,
-                         [(rqmt, target, True, False, False)])
-
         self.assertTrue(os.path.isfile(os.path.join(path, 'compoze')))
 
     def test_download_distributions_w_dist_not_on_first_index(self):
@@ -379,8 +378,7 @@ class FetcherTests(unittest.TestCase):
         target, path = self._makeDirs()
         rqmt = Requirement.parse('compoze')
         cheeseshop = self._makeIndex()
-        other = self._makeIndex(rqmt)
-        local = self._makeIndex(rqmt, target=target)
+        other = self._makeIndex(rqmt, target=target)
         def _factory(index_url, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
                 assert search_path is None
@@ -388,9 +386,6 @@ class FetcherTests(unittest.TestCase):
             if index_url == 'http://example.com/simple':
                 assert search_path is None
                 return other
-            if index_url ==  target:
-                assert search_path == ()
-                return local
             raise ValueError(index_url)
         fetcher = self._makeOne('--quiet', '--path=%s' % path,
                                 '--index=http://pypi.python.org/simple',
@@ -407,9 +402,6 @@ class FetcherTests(unittest.TestCase):
         self.assertEqual(other._fetched_with,
                          [(rqmt, target, False, True, False)])
 
-        self.assertEqual(local._fetched_with,
-                         [(rqmt, target, True, False, False)])
-
         self.assertTrue(os.path.isfile(os.path.join(path, 'compoze')))
 
     def test_download_distributions_w_find_links_dist_in_index(self):
@@ -417,16 +409,12 @@ class FetcherTests(unittest.TestCase):
         from pkg_resources import Requirement
         target, path = self._makeDirs()
         rqmt = Requirement.parse('compoze')
-        cheeseshop = self._makeIndex(rqmt)
-        local = self._makeIndex(rqmt, target=target)
+        cheeseshop = self._makeIndex(rqmt, target=target)
         findlinks = self._makeIndex()
         def _factory(index_url=None, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
                 assert search_path is None
                 return cheeseshop
-            if index_url ==  target:
-                assert search_path == ()
-                return local
             if index_url is None:
                 assert search_path is None
                 return findlinks
@@ -445,9 +433,6 @@ class FetcherTests(unittest.TestCase):
         self.assertEqual(findlinks._fetched_with, [])
         self.assertEqual(findlinks._find_links, ['http://example.com/'])
 
-        self.assertEqual(local._fetched_with,
-                         [(rqmt, target, True, False, False)])
-
         self.assertTrue(os.path.isfile(os.path.join(path, 'compoze')))
 
     def test_download_distributions_w_find_links_dist_not_in_index(self):
@@ -456,15 +441,11 @@ class FetcherTests(unittest.TestCase):
         target, path = self._makeDirs()
         rqmt = Requirement.parse('compoze')
         cheeseshop = self._makeIndex()
-        local = self._makeIndex(rqmt, target=target)
-        findlinks = self._makeIndex(rqmt)
+        findlinks = self._makeIndex(rqmt, target=target)
         def _factory(index_url=None, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
                 assert search_path is None
                 return cheeseshop
-            if index_url ==  target:
-                assert search_path == ()
-                return local
             if index_url is None:
                 assert search_path is None
                 return findlinks
@@ -484,9 +465,6 @@ class FetcherTests(unittest.TestCase):
                          [(rqmt, target, False, True, False)])
         self.assertEqual(findlinks._find_links, ['http://example.com/'])
 
-        self.assertEqual(local._fetched_with,
-                         [(rqmt, target, True, False, False)])
-
         self.assertTrue(os.path.isfile(os.path.join(path, 'compoze')))
 
     def test_download_distributions_w_cheeseshop_raises(self):
@@ -502,14 +480,10 @@ class FetcherTests(unittest.TestCase):
                     (rqmt, target_dir, force_scan, source, develop_ok))
             raise AttributeError
         cheeseshop.fetch_distribution = _fetch_distribution
-        local = self._makeIndex(rqmt, target=target)
         def _factory(index_url=None, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
                 assert search_path is None
                 return cheeseshop
-            if index_url ==  target:
-                assert search_path == ()
-                return local
             raise ValueError(index_url)
         fetcher = self._makeOne('--quiet', '--path=%s' % path,
                                 'compoze', logger=logged.append)
@@ -521,60 +495,396 @@ class FetcherTests(unittest.TestCase):
         self.assertEqual(cheeseshop._fetched_with,
                          [(rqmt, target, False, True, False)])
 
-        self.assertEqual(local._fetched_with,
-                         [(rqmt, target, True, False, False)])
-
-        self.assertTrue(os.path.isfile(os.path.join(path, 'compoze')))
+        self.assertFalse(os.path.isfile(os.path.join(path, 'compoze')))
         self.assertEqual(logged, ['  Error fetching: compoze'])
 
-    def test_download_distributions_w_local_raises(self):
+    def test_download_distributions_w_dist_location_not_a_file(self):
         import os
         from pkg_resources import Requirement
         target, path = self._makeDirs()
         rqmt = Requirement.parse('compoze')
-        cheeseshop = self._makeIndex(rqmt, target=target)
-        local = self._makeIndex()
+        checkout = os.path.join(target, 'compoze-checkout')
+        os.makedirs(checkout)
+        cheeseshop = DummyIndex({rqmt: DummyDistribution('compoze',
+                                                         location=checkout)})
+        def _factory(index_url=None, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                return cheeseshop
+            raise ValueError(index_url)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path, 'compoze')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
+        self.assertEqual(os.listdir(path), [])
+
+    def test_download_distributions_same_archive_copied_once(self):
+        import os
+        import shutil
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        rqmt1 = Requirement.parse('compoze')
+        rqmt2 = Requirement.parse('compoze[extra]')
+        archive = os.path.join(target, 'compoze-1.0.tar.gz')
+        with open(archive, 'w') as f:
+            f.write('ARCHIVE')
+        dist = DummyDistribution('compoze', location=archive)
+        cheeseshop = DummyIndex({rqmt1: dist, rqmt2: dist})
+        def _factory(index_url=None, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                return cheeseshop
+            raise ValueError(index_url)
+        copied = []
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                'compoze', 'compoze[extra]')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+        orig = shutil.copy
+        def _copy(source, target):
+            copied.append(source)
+            return orig(source, target)
+        shutil.copy = _copy
+        try:
+            fetcher.download_distributions()
+        finally:
+            shutil.copy = orig
+
+        self.assertEqual(copied, [archive])
+        self.assertEqual(os.listdir(path), ['compoze-1.0.tar.gz'])
+
+    def test_download_distributions_w_jobs_first_index_wins(self):
+        import os
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        rqmt1 = Requirement.parse('compoze')
+        rqmt2 = Requirement.parse('pkginfo')
+        cheeseshop = self._makeIndex(rqmt1, target=target)
+        other = self._makeIndex(rqmt1, rqmt2, target=target)
+        def _factory(index_url, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                assert search_path is None
+                return cheeseshop
+            if index_url == 'http://example.com/simple':
+                assert search_path is None
+                return other
+            raise ValueError(index_url)
+        logged = []
+        fetcher = self._makeOne('--verbose', '--path=%s' % path, '--jobs=3',
+                                '--index=http://pypi.python.org/simple',
+                                '--index=http://example.com/simple',
+                                'compoze', 'pkginfo', 'nonesuch',
+                                logger=logged.append)
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
+        def _fetched(index):
+            return sorted([(str(x[0]),) + x[1:] for x in index._fetched_with])
+        self.assertEqual(_fetched(cheeseshop),
+                         [('compoze', target, False, True, False),
+                          ('nonesuch', target, False, True, False),
+                          ('pkginfo', target, False, True, False),
+                         ])
+        self.assertEqual(_fetched(other),
+                         [('nonesuch', target, False, True, False),
+                          ('pkginfo', target, False, True, False),
+                         ])
+        self.assertTrue(os.path.isfile(os.path.join(path, 'compoze')))
+        self.assertTrue(os.path.isfile(os.path.join(path, 'pkginfo')))
+        found = logged.index('Found eggs:')
+        notfound = logged.index('Not found eggs:')
+        self.assertEqual(sorted(logged[found + 1:notfound]),
+                         ['  compoze', '  pkginfo'])
+        self.assertEqual(logged[notfound + 1:], ['  nonesuch'])
+
+    def test_download_distributions_w_jobs_find_links(self):
+        import os
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        rqmt = Requirement.parse('compoze')
+        cheeseshop = self._makeIndex()
+        findlinks = self._makeIndex(rqmt, target=target)
+        def _factory(index_url=None, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                return cheeseshop
+            if index_url is None:
+                return findlinks
+            raise ValueError(index_url)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path, '--jobs=2',
+                                '--find-link=http://example.com/',
+                                'compoze')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
+        self.assertEqual(cheeseshop._fetched_with,
+                         [(rqmt, target, False, True, False)])
+        self.assertEqual(findlinks._fetched_with,
+                         [(rqmt, target, False, True, False)])
+        self.assertTrue('http://example.com/' in findlinks._find_links)
+        self.assertTrue(os.path.isfile(os.path.join(path, 'compoze')))
+
+    def test_download_distributions_w_jobs_cheeseshop_raises(self):
+        from pkg_resources import Requirement
+        logged = []
+        target, path = self._makeDirs()
+        rqmt = Requirement.parse('compoze')
+        cheeseshop = self._makeIndex()
         def _fetch_distribution(rqmt, target_dir, force_scan=False,
                                 source=False, develop_ok=False):
-            local._fetched_with.append(
-                    (rqmt, target_dir, force_scan, source, develop_ok))
             raise AttributeError
-        local.fetch_distribution = _fetch_distribution
+        cheeseshop.fetch_distribution = _fetch_distribution
         def _factory(index_url=None, search_path=None):
             if index_url == 'http://pypi.python.org/simple':
-                assert search_path is None
                 return cheeseshop
-            if index_url ==  target:
-                assert search_path == ()
-                return local
+            raise ValueError(index_url)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path, '--jobs=2',
+                                'compoze', logger=logged.append)
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
+        self.assertEqual(logged, ['  Error fetching: compoze'])
+
+    def test_download_distributions_w_cache_dir(self):
+        import os
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        cache_dir = os.path.join(self._tmpdir, 'cache')
+        rqmt = Requirement.parse('compoze')
+        cheeseshop = self._makeIndex(rqmt, target=target)
+        cache_kws = []
+        def _factory(index_url=None, search_path=None, download_cache=None,
+                     page_cache=None):
+            if index_url == 'http://pypi.python.org/simple':
+                cache_kws.append((download_cache, page_cache))
+                return cheeseshop
             raise ValueError(index_url)
         fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--cache-dir=%s' % cache_dir,
                                 'compoze')
         fetcher.index_factory = _factory
         fetcher.tmpdir = target
 
         fetcher.download_distributions()
 
+        self.assertEqual(cache_kws,
+                         [(fetcher.download_cache, fetcher.page_cache)])
+
+    def test_download_distributions_w_download_in_path_renames(self):
+        import os
+        from pkg_resources import Requirement
+        root = self._makeTempDir()
+        path = os.path.join(root, 'path')
+        target = os.path.join(path, '.compoze-tmp')
+        os.makedirs(target)
+        archive = os.path.join(target, 'compoze-1.0.tar.gz')
+        with open(archive, 'w') as f:
+            f.write('ARCHIVE')
+        rqmt = Requirement.parse('compoze')
+        cheeseshop = DummyIndex({rqmt: DummyDistribution('compoze',
+                                                         location=archive)})
+        def _factory(index_url=None, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                return cheeseshop
+            raise ValueError(index_url)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--download-in-path', 'compoze')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
+        self.assertFalse(os.path.exists(archive))
+        with open(os.path.join(path, 'compoze-1.0.tar.gz')) as f:
+            self.assertEqual(f.read(), 'ARCHIVE')
+
+    def test_download_distributions_w_download_in_path_outside_tmpdir(self):
+        import os
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        elsewhere = os.path.join(self._tmpdir, 'elsewhere')
+        os.makedirs(elsewhere)
+        archive = os.path.join(elsewhere, 'compoze-1.0.tar.gz')
+        with open(archive, 'w') as f:
+            f.write('ARCHIVE')
+        rqmt = Requirement.parse('compoze')
+        cheeseshop = DummyIndex({rqmt: DummyDistribution('compoze',
+                                                         location=archive)})
+        def _factory(index_url=None, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                return cheeseshop
+            raise ValueError(index_url)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--download-in-path', 'compoze')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
+        self.assertTrue(os.path.exists(archive)) # copied, not moved
+        self.assertTrue(
+            os.path.isfile(os.path.join(path, 'compoze-1.0.tar.gz')))
+
+    def test_download_distributions_w_skip_existing(self):
+        import os
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        with open(os.path.join(path, 'compoze-1.0.tar.gz'), 'w') as f:
+            f.write('EXISTING')
+        rqmt1 = Requirement.parse('compoze==1.0')
+        rqmt2 = Requirement.parse('pkginfo')
+        cheeseshop = self._makeIndex(rqmt1, rqmt2, target=target)
+        def _factory(index_url=None, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                return cheeseshop
+            raise ValueError(index_url)
+        logged = []
+        fetcher = self._makeOne('--verbose', '--path=%s' % path,
+                                '--skip-existing', 'compoze==1.0', 'pkginfo',
+                                logger=logged.append)
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
+        self.assertEqual([str(x[0]) for x in cheeseshop._fetched_with],
+                         ['pkginfo'])
+        self.assertTrue('  Already present: compoze==1.0 '
+                        '(compoze-1.0.tar.gz)' in logged)
+        self.assertEqual(sorted(os.listdir(path)),
+                         ['compoze-1.0.tar.gz', 'pkginfo'])
+        with open(os.path.join(path, 'compoze-1.0.tar.gz')) as f:
+            self.assertEqual(f.read(), 'EXISTING')
+        found = logged.index('Found eggs:')
+        notfound = logged.index('Not found eggs:')
+        self.assertEqual(sorted(logged[found + 1:notfound]),
+                         ['  compoze==1.0', '  pkginfo'])
+
+    def test_download_distributions_w_skip_existing_version_mismatch(self):
+        import os
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        with open(os.path.join(path, 'compoze-0.9.tar.gz'), 'w') as f:
+            f.write('EXISTING')
+        rqmt = Requirement.parse('compoze==1.0')
+        cheeseshop = self._makeIndex(rqmt, target=target)
+        def _factory(index_url=None, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                return cheeseshop
+            raise ValueError(index_url)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--skip-existing', 'compoze==1.0')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
         self.assertEqual(cheeseshop._fetched_with,
                          [(rqmt, target, False, True, False)])
 
-        self.assertEqual(local._fetched_with,
-                         [(rqmt, target, True, False, False)])
+    def test_download_distributions_w_skip_existing_ambiguous_name(self):
+        # 'zope-interface-4.0.tar.gz' is not project 'zope', version
+        # 'interface-4.0'.
+        import os
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        with open(os.path.join(path, 'zope-interface-4.0.tar.gz'), 'w') as f:
+            f.write('EXISTING')
+        rqmt = Requirement.parse('zope')
+        cheeseshop = self._makeIndex(rqmt, target=target)
+        def _factory(index_url=None, search_path=None):
+            if index_url == 'http://pypi.python.org/simple':
+                return cheeseshop
+            raise ValueError(index_url)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--skip-existing', 'zope')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
 
-        self.assertFalse(os.path.isfile(os.path.join(path, 'compoze')))
+        fetcher.download_distributions()
+
+        self.assertEqual(cheeseshop._fetched_with,
+                         [(rqmt, target, False, True, False)])
+
+    def test_download_distributions_w_skip_existing_all_present(self):
+        import os
+        target, path = self._makeDirs()
+        with open(os.path.join(path, 'compoze-1.0.zip'), 'w') as f:
+            f.write('EXISTING')
+        def _factory(index_url=None, search_path=None):
+            raise ValueError(index_url)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--skip-existing', 'compoze==1.0')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions() # no index created
+
+    def test_download_distributions_w_include_wheels(self):
+        from pkg_resources import Requirement
+        target, path = self._makeDirs()
+        rqmt = Requirement.parse('compoze')
+        cheeseshop = self._makeIndex(rqmt, target=target)
+        factory_kw = []
+        def _factory(**kw):
+            factory_kw.append(kw)
+            return cheeseshop
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--include-wheels', 'compoze')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions()
+
+        self.assertEqual(factory_kw, [{'index_url':
+                                        'http://pypi.python.org/simple',
+                                       'exclude_eggs': True}])
+        self.assertEqual(cheeseshop._fetched_with,
+                         [(rqmt, target, False, False, False)])
+
+    def test_download_distributions_w_skip_existing_wheel(self):
+        import os
+        target, path = self._makeDirs()
+        with open(os.path.join(path, 'compoze-1.0-py2.py3-none-any.whl'),
+                  'w') as f:
+            f.write('EXISTING')
+        def _factory(**kw):
+            raise ValueError(kw)
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--skip-existing', '--include-wheels',
+                                'compoze==1.0')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+
+        fetcher.download_distributions() # no index created
+
+        # Without '--include-wheels', the wheel doesn't count.
+        fetcher = self._makeOne('--quiet', '--path=%s' % path,
+                                '--skip-existing', 'compoze==1.0')
+        fetcher.index_factory = _factory
+        fetcher.tmpdir = target
+        self.assertRaises(ValueError, fetcher.download_distributions)
 
 
 
 class DummyDistribution(object):
 
-    def __init__(self, name, tmpdir=None, precedence=None):
+    def __init__(self, name, tmpdir=None, precedence=None, location=None):
         self.project_name = name
         self.tmpdir = tmpdir
         self.precedence = precedence
+        self._location = location
 
     def _get_location(self):
         from compoze._compat import must_encode
         import os
+        if self._location is not None:
+            return self._location
         result = os.path.join(self.tmpdir, self.project_name) 
         f = open(result, 'wb')
         f.write(must_encode(self.project_name))
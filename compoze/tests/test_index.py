@@ -29,3 +29,176 @@ class CompozePackageIndexTests(unittest.TestCase):
         cpi = self._makeOne()
         cpi.warn('foo')
         self.assertEqual(cpi.warn_msgs, [('foo', ())])
+
+    def _makeDist(self, location, precedence):
+        from pkg_resources import Distribution
+        return Distribution(location=location, project_name='foo',
+                            version='1.0', precedence=precedence)
+
+    def test_add_w_exclude_eggs(self):
+        from pkg_resources import EGG_DIST
+        from pkg_resources import SOURCE_DIST
+        cpi = self._makeOne(exclude_eggs=True)
+        sdist = self._makeDist('foo-1.0.tar.gz', SOURCE_DIST)
+        egg = self._makeDist('foo-1.0-py3.11.egg', EGG_DIST)
+        wheel = self._makeDist('foo-1.0-py3-none-any.whl', EGG_DIST + 1)
+        for dist in (sdist, egg, wheel):
+            cpi.add(dist)
+        self.assertEqual(sorted([x.location for x in cpi['foo']]),
+                         ['foo-1.0-py3-none-any.whl', 'foo-1.0.tar.gz'])
+
+    def test_add_wo_exclude_eggs(self):
+        from pkg_resources import EGG_DIST
+        cpi = self._makeOne()
+        cpi.add(self._makeDist('foo-1.0-py3.11.egg', EGG_DIST))
+        self.assertEqual(len(cpi['foo']), 1)
+
+    def test_ctor_download_cache(self):
+        cache = object()
+        cpi = self._makeOne(download_cache=cache)
+        self.assertTrue(cpi.download_cache is cache)
+
+    def test__download_to_wo_cache(self):
+        from setuptools.package_index import PackageIndex
+        cpi = self._makeOne()
+        called = []
+        def _download_to(self, url, filename):
+            called.append((url, filename))
+            return {'content-type': 'application/x-gzip'}
+        orig = PackageIndex._download_to
+        PackageIndex._download_to = _download_to
+        try:
+            headers = cpi._download_to('http://example.com/foo.tgz', 'foo')
+        finally:
+            PackageIndex._download_to = orig
+        self.assertEqual(called, [('http://example.com/foo.tgz', 'foo')])
+        self.assertEqual(headers, {'content-type': 'application/x-gzip'})
+
+    def test__download_to_w_cache_hit(self):
+        cache = DummyCache(hit=True)
+        cpi = self._makeOne(download_cache=cache)
+        headers = cpi._download_to('http://example.com/foo.tgz', 'foo')
+        self.assertEqual(cache._retrieved,
+                         [('http://example.com/foo.tgz', 'foo')])
+        self.assertEqual(cache._stored, [])
+        self.assertEqual(headers['content-type'], 'application/octet-stream')
+
+    def test__download_to_w_cache_miss(self):
+        from setuptools.package_index import PackageIndex
+        cache = DummyCache(hit=False)
+        cpi = self._makeOne(download_cache=cache)
+        def _download_to(self, url, filename):
+            return {'content-type': 'application/x-gzip'}
+        orig = PackageIndex._download_to
+        PackageIndex._download_to = _download_to
+        try:
+            cpi._download_to('http://example.com/foo.tgz', 'foo')
+        finally:
+            PackageIndex._download_to = orig
+        self.assertEqual(cache._stored,
+                         [('http://example.com/foo.tgz', 'foo')])
+
+    def test__download_to_w_cache_miss_html_not_stored(self):
+        from setuptools.package_index import PackageIndex
+        cache = DummyCache(hit=False)
+        cpi = self._makeOne(download_cache=cache)
+        def _download_to(self, url, filename):
+            return {'content-type': 'text/html'}
+        orig = PackageIndex._download_to
+        PackageIndex._download_to = _download_to
+        try:
+            cpi._download_to('http://example.com/foo.tgz', 'foo')
+        finally:
+            PackageIndex._download_to = orig
+        self.assertEqual(cache._stored, [])
+
+    def _makePageCache(self):
+        import shutil
+        import tempfile
+        from compoze.cacher import PageCache
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        return PageCache(tmpdir)
+
+    def test_ctor_page_cache_wraps_opener(self):
+        cpi = self._makeOne(page_cache=self._makePageCache())
+        self.assertEqual(cpi.opener, cpi._conditionalOpen)
+
+    def test__conditionalOpen_stores_and_revalidates(self):
+        from compoze._compat import BytesIO
+        from compoze._compat import HTTPError
+        from compoze._compat import addinfourl
+        from compoze._compat import parse_http_headers
+        URL = 'http://example.com/simple/foo/'
+        page_cache = self._makePageCache()
+        cpi = self._makeOne(page_cache=page_cache)
+        requests = []
+        def _opener(request):
+            requests.append(dict(request.header_items()))
+            if len(requests) == 1:
+                headers = parse_http_headers('Content-Type: text/html\n'
+                                             'ETag: "abc"\n\n')
+                return addinfourl(BytesIO(b'<html></html>'), headers, URL,
+                                  200)
+            raise HTTPError(URL, 304, 'Not Modified', {}, None)
+        cpi._uncached_opener = _opener
+
+        first = cpi.opener(DummyRequest(URL))
+        self.assertEqual(first.read(), b'<html></html>')
+        second = cpi.opener(DummyRequest(URL))
+        self.assertEqual(second.read(), b'<html></html>')
+        self.assertEqual(second.geturl(), URL)
+        self.assertEqual(requests[0], {})
+        self.assertEqual(requests[1], {'If-None-Match': '"abc"'})
+
+    def test__conditionalOpen_wo_validators_not_stored(self):
+        from compoze._compat import BytesIO
+        from compoze._compat import addinfourl
+        from compoze._compat import parse_http_headers
+        URL = 'http://example.com/simple/foo/'
+        page_cache = self._makePageCache()
+        cpi = self._makeOne(page_cache=page_cache)
+        def _opener(request):
+            headers = parse_http_headers('Content-Type: text/html\n\n')
+            return addinfourl(BytesIO(b'<html></html>'), headers, URL, 200)
+        cpi._uncached_opener = _opener
+        cpi.opener(DummyRequest(URL))
+        self.assertEqual(page_cache.count(), 0)
+
+    def test__conditionalOpen_reraises_other_errors(self):
+        from compoze._compat import HTTPError
+        URL = 'http://example.com/simple/foo/'
+        cpi = self._makeOne(page_cache=self._makePageCache())
+        def _opener(request):
+            raise HTTPError(URL, 404, 'Not Found', {}, None)
+        cpi._uncached_opener = _opener
+        self.assertRaises(HTTPError, cpi.opener, DummyRequest(URL))
+
+class DummyRequest(object):
+
+    def __init__(self, url):
+        self._url = url
+        self._headers = {}
+
+    def get_full_url(self):
+        return self._url
+
+    def add_header(self, name, value):
+        self._headers[name] = value
+
+    def header_items(self):
+        return list(self._headers.items())
+
+class DummyCache(object):
+
+    def __init__(self, hit):
+        self._hit = hit
+        self._retrieved = []
+        self._stored = []
+
+    def retrieve(self, url, filename):
+        self._retrieved.append((url, filename))
+        return self._hit
+
+    def store(self, url, filename):
+        self._stored.append((url, filename))
@@ -36,6 +36,10 @@ class _ArchiveTests:
         expected = [ x['name'] for x in self._fixtureFiles() ]
         self.assertEqual(names, expected)
 
+    def test_iternames(self):
+        archive = self._makeOne()
+        self.assertEqual(list(archive.iternames()), archive.names())
+
     def test_lines(self):
         archive = self._makeOne()
         name = self._fixtureFiles()[0]['name']
@@ -44,6 +48,13 @@ class _ArchiveTests:
                          [b'This is the first line of text file 1.',
                           b'This is the second line of text file 1.'])
 
+    def test_read(self):
+        archive = self._makeOne()
+        name = self._fixtureFiles()[0]['name']
+        data = archive.read(name)
+        self.assertTrue(data.startswith(
+                            b'This is the first line of text file 1.\n'))
+
     def test_extract(self):
         import os
         archive = self._makeOne()
@@ -74,12 +85,23 @@ class _ArchiveTests:
         with open(path) as f:
             self.assertEqual(f.read(), expected)
 
+    def test_extractall_w_names(self):
+        import os
+        archive = self._makeOne()
+        target = self._makeTempdir()
+        name = self._fixtureFiles()[1]['name']
+        archive.extractall(target, [name])
+        self.assertTrue(os.path.isfile(os.path.join(target, name)))
+        other = self._fixtureFiles()[0]['name']
+        self.assertFalse(os.path.exists(os.path.join(target, other)))
+
     def test_close_disables_other_methods(self):
         archive = self._makeOne()
         archive.close()
         self.assertRaises(IOError, archive.names)
         name = self._fixtureFiles()[1]['name']
         self.assertRaises(IOError, archive.lines, name)
+        self.assertRaises(IOError, archive.read, name)
         self.assertRaises(IOError, archive.extract, name, self._makeTempdir())
 
 class ZipArchiveTests(_ArchiveTests, unittest.TestCase):
@@ -207,6 +229,76 @@ class Test__getArchiver(unittest.TestCase):
         self.assertTrue(isinstance(_getArchiver(fname), ZipArchive))
 
 
+class Test__isPkgInfo(unittest.TestCase):
+
+    def _callFUT(self, name):
+        from compoze.indexer import _isPkgInfo
+        return _isPkgInfo(name)
+
+    def test_root(self):
+        self.assertTrue(self._callFUT('PKG-INFO'))
+
+    def test_top_level_dir(self):
+        self.assertTrue(self._callFUT('testpackage-3.14/PKG-INFO'))
+
+    def test_nested(self):
+        self.assertFalse(self._callFUT(
+                            'testpackage-3.14/src/foo.egg-info/PKG-INFO'))
+
+    def test_other(self):
+        self.assertFalse(self._callFUT('testpackage-3.14/PKG-INFO.txt'))
+
+class Test__wheelNameVersion(unittest.TestCase):
+
+    def _callFUT(self, filename):
+        from compoze.indexer import _wheelNameVersion
+        return _wheelNameVersion(filename)
+
+    def test_not_a_wheel(self):
+        self.assertEqual(self._callFUT('foo-1.0.tar.gz'), None)
+
+    def test_malformed(self):
+        self.assertEqual(self._callFUT('foo-1.0.whl'), None)
+        self.assertEqual(self._callFUT('foo--py3-none-any.whl'), None)
+
+    def test_wheel(self):
+        self.assertEqual(self._callFUT('/pool/foo_bar-1.0-py3-none-any.whl'),
+                         ('foo_bar', '1.0'))
+
+    def test_wheel_w_build_tag(self):
+        self.assertEqual(self._callFUT(
+                            'foo-1.0-1-cp311-cp311-manylinux1_x86_64.whl'),
+                         ('foo', '1.0'))
+
+class Test__setupFiles(unittest.TestCase):
+
+    def _callFUT(self, names, prefix):
+        from compoze.indexer import _setupFiles
+        return _setupFiles(names, prefix)
+
+    def test_nested(self):
+        names = ['pkg/',
+                 'pkg/setup.py',
+                 'pkg/README',
+                 'pkg/data.bin',
+                 'pkg/src/pkg/__init__.py',
+                 'pkg/tests/fixtures/blob.bin',
+                 'pkg/docs/index.rst',
+                 'other/setup.py',
+                ]
+        self.assertEqual(self._callFUT(names, 'pkg'),
+                         ['pkg/setup.py',
+                          'pkg/README',
+                          'pkg/data.bin',
+                          'pkg/src/pkg/__init__.py',
+                          'pkg/docs/index.rst',
+                         ])
+
+    def test_root(self):
+        names = ['setup.py', 'pkg/__init__.py', 'pkg/blob.bin']
+        self.assertEqual(self._callFUT(names, ''),
+                         ['setup.py', 'pkg/__init__.py'])
+
 class IndexerTests(unittest.TestCase):
 
     _tmpdir = None
@@ -252,6 +344,44 @@ class IndexerTests(unittest.TestCase):
         self.assertFalse(indexer.options.verbose)
         self.assertEqual(indexer.options.index_name, 'simple')
         self.assertFalse(indexer.options.keep_tempdir)
+        self.assertEqual(indexer.options.workers, 1)
+        self.assertFalse(indexer.options.update)
+        self.assertFalse(indexer.options.atomic)
+        self.assertFalse(indexer.options.rollback)
+        self.assertFalse(indexer.options.run_setup_py)
+        self.assertEqual(indexer.options.setup_timeout, 60.0)
+        self.assertEqual(indexer.options.setup_cpu_limit, None)
+        self.assertEqual(indexer.options.setup_memory_limit, None)
+        self.assertEqual(indexer.failures, [])
+
+    def test_ctor_setup_limits(self):
+        indexer = self._makeOne('--setup-timeout=2.5',
+                                '--setup-cpu-limit=10',
+                                '--setup-memory-limit=512M')
+        self.assertEqual(indexer.options.setup_timeout, 2.5)
+        self.assertEqual(indexer.options.setup_cpu_limit, 10)
+        self.assertEqual(indexer.options.setup_memory_limit, 512 << 20)
+
+    def test_ctor_setup_timeout_invalid_raises(self):
+        self.assertRaises(ValueError, self._makeOne, '--setup-timeout=0')
+
+    def test_ctor_setup_memory_limit_invalid_raises(self):
+        self.assertRaises(ValueError, self._makeOne,
+                          '--setup-memory-limit=lots')
+
+    def test_ctor_workers(self):
+        indexer = self._makeOne('--workers=4')
+        self.assertEqual(indexer.options.workers, 4)
+
+    def test_ctor_workers_invalid_raises(self):
+        self.assertRaises(ValueError, self._makeOne, '--workers=0')
+
+    def test___getstate___drops_logger(self):
+        import pickle
+        indexer = self._makeOne('--workers=2', logger=[].append)
+        clone = pickle.loads(pickle.dumps(indexer))
+        self.assertFalse('_logger' in clone.__dict__)
+        self.assertEqual(clone.options.workers, 2)
 
     def test_ctor_uses_global_options_as_default(self):
         options = self._makeOptions(path='/tmp/foo',
@@ -309,6 +439,7 @@ class IndexerTests(unittest.TestCase):
 
     def test_make_index_w_distribution(self):
         import os
+        import hashlib
         import tarfile
         from compoze._compat import BytesIO
         tmpdir = self._makeTempdir()
@@ -338,9 +469,229 @@ class IndexerTests(unittest.TestCase):
                  ) as f:
             sub = f.read()
         self.assertTrue('<h1>testpackage Distributions</h1>' in sub)
+        with open(filename, 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        self.assertTrue(
+                '<li><a href="../../testpackage-3.14.tar.gz#sha256=%s">'
+                'testpackage-3.14.tar.gz</a></li>' % sha256 in sub)
+
+    def _makeSdist(self, tmpdir, name, version, requires_python=None):
+        import os
+        import tarfile
+        from compoze._compat import BytesIO
+        from compoze._compat import must_encode
+        filename = os.path.join(tmpdir, '%s-%s.tar.gz' % (name, version))
+        archive = tarfile.TarFile(filename, mode='w')
+        buffer = BytesIO()
+        buffer.writelines([b'Metadata-Version: 1.2\n',
+                           must_encode('Name: %s\n' % name),
+                           must_encode('Version: %s\n' % version),
+                          ])
+        if requires_python is not None:
+            buffer.write(must_encode('Requires-Python: %s\n'
+                                        % requires_python))
+        size = buffer.tell()
+        buffer.seek(0)
+        info = tarfile.TarInfo('PKG-INFO')
+        info.size = size
+        archive.addfile(info, buffer)
+        archive.close()
+        return filename
+
+    def test_make_index_w_workers(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeSdist(tmpdir, 'testpackage', '2.71')
+        self._makeSdist(tmpdir, 'otherpackage', '1.0')
+        with open(os.path.join(tmpdir, 'README.txt'), 'w') as f:
+            f.write('not a distribution')
+        logged = []
+        indexer = self._makeOne('--path=%s' % tmpdir, '--workers=2',
+                                '--verbose', logger=logged.append)
+
+        indexer.make_index()
+
+        parsed = [x for x in logged if x.startswith('Parsing: ')]
+        self.assertEqual(parsed,
+                         ['Parsing: %s' % os.path.join(tmpdir, x)
+                            for x in ['README.txt',
+                                      'otherpackage-1.0.tar.gz',
+                                      'testpackage-2.71.tar.gz',
+                                      'testpackage-3.14.tar.gz']])
+        with open(os.path.join(tmpdir, 'simple', 'index.html')) as f:
+            top = f.read()
         self.assertTrue(
-                '<li><a href="../../testpackage-3.14.tar.gz">'
-                'testpackage-3.14.tar.gz</a></li>' in sub)
+                '<li><a href="otherpackage">otherpackage</a></li>' in top)
+        with open(os.path.join(tmpdir, 'simple', 'testpackage', 'index.html')
+                 ) as f:
+            sub = f.read()
+        self.assertTrue(sub.index('testpackage-2.71.tar.gz') <
+                        sub.index('testpackage-3.14.tar.gz'))
+
+    def test_make_index_w_metadata_cache(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        with open(os.path.join(tmpdir, 'README.txt'), 'w') as f:
+            f.write('not a distribution')
+        cache_file = os.path.join(tmpdir, 'cache', 'metadata.db')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--metadata-cache=%s' % cache_file)
+        indexer.make_index()
+
+        logged = []
+        indexer = self._makeOne('--path=%s' % tmpdir, '--verbose',
+                                '--metadata-cache=%s' % cache_file,
+                                '--index-name=other',
+                                logger=logged.append)
+        def _extractMetadata(filename):
+            raise AssertionError('Not cached: %s' % filename)
+        indexer._extractMetadata = _extractMetadata
+
+        indexer.make_index()
+
+        self.assertTrue('Cached: %s' % os.path.join(tmpdir, 'README.txt')
+                            in logged)
+        with open(os.path.join(tmpdir, 'other', 'testpackage', 'index.html')
+                 ) as f:
+            sub = f.read()
+        self.assertTrue('testpackage-3.14.tar.gz' in sub)
+
+    def test_make_index_w_update_no_existing_index(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--update')
+        indexer.make_index()
+        self.assertTrue(os.path.isfile(
+            os.path.join(tmpdir, 'simple', 'testpackage', 'index.html')))
+
+    def test_make_index_w_update(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeSdist(tmpdir, 'otherpackage', '1.0')
+        vanishing = self._makeSdist(tmpdir, 'vanishing', '0.1')
+        indexer = self._makeOne('--path=%s' % tmpdir)
+        indexer.make_index()
+        index_dir = os.path.join(tmpdir, 'simple')
+        other_html = os.path.join(index_dir, 'otherpackage', 'index.html')
+        os.utime(other_html, (1000, 1000))
+        os.makedirs(os.path.join(index_dir, 'not-a-project'))
+
+        os.remove(vanishing)
+        self._makeSdist(tmpdir, 'testpackage', '4.0')
+        logged = []
+        indexer = self._makeOne('--path=%s' % tmpdir, '--update',
+                                '--verbose', logger=logged.append)
+        indexer.make_index()
+
+        self.assertTrue('Rewrote 2 pages; removed 1 projects' in logged)
+        self.assertEqual(os.stat(other_html).st_mtime, 1000) # untouched
+        self.assertFalse(os.path.exists(os.path.join(index_dir, 'vanishing')))
+        self.assertTrue(os.path.isdir(os.path.join(index_dir,
+                                                   'not-a-project')))
+        with open(os.path.join(index_dir, 'testpackage', 'index.html')) as f:
+            sub = f.read()
+        self.assertTrue('testpackage-4.0.tar.gz' in sub)
+        with open(os.path.join(index_dir, 'index.html')) as f:
+            top = f.read()
+        self.assertFalse('vanishing' in top)
+
+    def test_make_index_w_atomic(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        index_dir = os.path.join(tmpdir, 'simple')
+
+        self._makeOne('--path=%s' % tmpdir, '--atomic').make_index()
+        self.assertTrue(os.path.islink(index_dir))
+        self.assertEqual(os.readlink(index_dir), '.simple-1')
+
+        self._makeSdist(tmpdir, 'otherpackage', '1.0')
+        self._makeOne('--path=%s' % tmpdir, '--atomic').make_index()
+        self.assertEqual(os.readlink(index_dir), '.simple-2')
+        with open(os.path.join(index_dir, 'index.html')) as f:
+            self.assertTrue('otherpackage' in f.read())
+        with open(os.path.join(tmpdir, '.simple-1', 'index.html')) as f:
+            self.assertFalse('otherpackage' in f.read())
+
+        self._makeOne('--path=%s' % tmpdir, '--atomic').make_index()
+        self.assertEqual(os.readlink(index_dir), '.simple-3')
+        self.assertFalse(os.path.exists(os.path.join(tmpdir, '.simple-1')))
+        self.assertTrue(os.path.isdir(os.path.join(tmpdir, '.simple-2')))
+
+    def test_make_index_w_atomic_failure_removes_staging_dir(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeOne('--path=%s' % tmpdir, '--atomic').make_index()
+        indexer = self._makeOne('--path=%s' % tmpdir, '--atomic')
+        def _fail(*args):
+            raise IOError('disk full')
+        indexer._writePage = _fail
+
+        self.assertRaises(IOError, indexer.make_index)
+
+        self.assertFalse(os.path.exists(os.path.join(tmpdir, '.simple-2')))
+        self.assertEqual(os.readlink(os.path.join(tmpdir, 'simple')),
+                         '.simple-1')
+
+    def test_make_index_w_atomic_replaces_plain_directory(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeOne('--path=%s' % tmpdir).make_index()
+        index_dir = os.path.join(tmpdir, 'simple')
+
+        self._makeOne('--path=%s' % tmpdir, '--atomic').make_index()
+
+        self.assertEqual(os.readlink(index_dir), '.simple-2')
+        self.assertTrue(os.path.isfile(
+            os.path.join(tmpdir, '.simple-1', 'index.html')))
+
+    def test_make_index_w_atomic_update_leaves_previous_generation(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeOne('--path=%s' % tmpdir, '--atomic').make_index()
+        old_page = os.path.join(tmpdir, '.simple-1', 'testpackage',
+                                'index.html')
+        with open(old_page) as f:
+            before = f.read()
+
+        self._makeSdist(tmpdir, 'testpackage', '4.0')
+        self._makeOne('--path=%s' % tmpdir, '--atomic', '--update'
+                     ).make_index()
+
+        with open(old_page) as f:
+            self.assertEqual(f.read(), before)
+        new_page = os.path.join(tmpdir, 'simple', 'testpackage', 'index.html')
+        with open(new_page) as f:
+            self.assertTrue('testpackage-4.0.tar.gz' in f.read())
+
+    def test_rollback_index(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeOne('--path=%s' % tmpdir, '--atomic').make_index()
+        self._makeOne('--path=%s' % tmpdir, '--atomic').make_index()
+        indexer = self._makeOne('--path=%s' % tmpdir, '--rollback')
+
+        restored = indexer.rollback_index()
+
+        self.assertEqual(restored, os.path.join(tmpdir, '.simple-1'))
+        self.assertEqual(os.readlink(os.path.join(tmpdir, 'simple')),
+                         '.simple-1')
+        self.assertRaises(ValueError, indexer.rollback_index)
+
+    def test_rollback_index_not_atomic_raises(self):
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeOne('--path=%s' % tmpdir).make_index()
+        indexer = self._makeOne('--path=%s' % tmpdir, '--rollback')
+        self.assertRaises(ValueError, indexer.rollback_index)
 
     def test__extractNameVersion_non_archive(self):
         import tempfile
@@ -434,7 +785,7 @@ class IndexerTests(unittest.TestCase):
         import tarfile
         import tempfile
         from compoze._compat import BytesIO
-        tested = self._makeOne()
+        tested = self._makeOne('--run-setup-py')
         tfile = tempfile.NamedTemporaryFile(suffix='.tgz')
         archive = tarfile.TarFile(fileobj=tfile, mode='w')
         dinfo = tarfile.TarInfo('testpackage')
@@ -459,7 +810,7 @@ class IndexerTests(unittest.TestCase):
         import tempfile
         from compoze._compat import BytesIO
         from compoze._compat import must_encode
-        tested = self._makeOne()
+        tested = self._makeOne('--run-setup-py')
         tfile = tempfile.NamedTemporaryFile(suffix='.tgz')
         archive = tarfile.TarFile(fileobj=tfile, mode='w')
         def add_tar_dir(path):
@@ -493,7 +844,7 @@ class IndexerTests(unittest.TestCase):
         import tempfile
         from compoze._compat import BytesIO
         from compoze._compat import must_encode
-        tested = self._makeOne()
+        tested = self._makeOne('--run-setup-py')
         tfile = tempfile.NamedTemporaryFile(suffix='.tgz')
         archive = tarfile.TarFile(fileobj=tfile, mode='w')
         def add_tar_dir(path):
@@ -526,7 +877,7 @@ class IndexerTests(unittest.TestCase):
         import tarfile
         import tempfile
         from compoze._compat import BytesIO
-        tested = self._makeOne()
+        tested = self._makeOne('--run-setup-py')
         tfile = tempfile.NamedTemporaryFile(suffix='.tgz')
         archive = tarfile.TarFile(fileobj=tfile, mode='w')
         dinfo = tarfile.TarInfo('testpackage')
@@ -549,7 +900,7 @@ class IndexerTests(unittest.TestCase):
         import tarfile
         import tempfile
         from compoze._compat import BytesIO
-        tested = self._makeOne()
+        tested = self._makeOne('--run-setup-py')
         tfile = tempfile.NamedTemporaryFile(suffix='.tgz')
         archive = tarfile.TarFile(fileobj=tfile, mode='w')
         dinfo = tarfile.TarInfo('testpackage')
@@ -572,7 +923,7 @@ class IndexerTests(unittest.TestCase):
         import tarfile
         import tempfile
         from compoze._compat import BytesIO
-        tested = self._makeOne()
+        tested = self._makeOne('--run-setup-py')
         tfile = tempfile.NamedTemporaryFile(suffix='.tgz')
         archive = tarfile.TarFile(fileobj=tfile, mode='w')
         dinfo = tarfile.TarInfo('testpackage')
@@ -591,6 +942,573 @@ class IndexerTests(unittest.TestCase):
         self.assertEqual(tested._extractNameVersion(tfile.name),
                          (None, None))
 
+    def _makeSourceArchive(self, files, suffix='.tgz'):
+        import tarfile
+        import tempfile
+        from compoze._compat import BytesIO
+        tfile = tempfile.NamedTemporaryFile(suffix=suffix)
+        self.addCleanup(tfile.close)
+        archive = tarfile.TarFile(fileobj=tfile, mode='w')
+        for name, data in files:
+            buffer = BytesIO(data)
+            finfo = tarfile.TarInfo(name)
+            finfo.size = len(data)
+            archive.addfile(finfo, buffer)
+        archive.close()
+        tfile.flush()
+        return tfile.name
+
+    def test__extractNameVersion_archive_w_literal_setup_kwargs(self):
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _LITERAL_SETUP),
+            ])
+        tested = self._makeOne()
+        self.assertEqual(tested._extractNameVersion(filename),
+                         ('testpackage', '3.14'))
+
+    def test__extractNameVersion_archive_w_setup_cfg(self):
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _DUMMY_SETUP),
+            ('testpackage/setup.cfg', _SETUP_CFG),
+            ])
+        tested = self._makeOne()
+        self.assertEqual(tested._extractNameVersion(filename),
+                         ('testpackage', '3.14'))
+
+    def test__extractNameVersion_archive_w_pyproject_only(self):
+        from compoze._compat import tomllib
+        if tomllib is None: #pragma NO COVER
+            return
+        filename = self._makeSourceArchive([
+            ('testpackage/pyproject.toml', _PYPROJECT),
+            ])
+        tested = self._makeOne()
+        self.assertEqual(tested._extractNameVersion(filename),
+                         ('testpackage', '3.14'))
+
+    def test__extractNameVersion_archive_wo_static_metadata_no_run(self):
+        logged = []
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _DUMMY_SETUP),
+            ])
+        tested = self._makeOne('--verbose', logger=logged.append)
+        self.assertEqual(tested._extractNameVersion(filename),
+                         (None, None))
+        self.assertTrue('--run-setup-py' in logged[-1])
+
+    def test__extractNameVersion_stops_scanning_at_pkg_info(self):
+        import os
+        import tarfile
+        from compoze._compat import BytesIO
+        tmpdir = self._makeTempdir()
+        filename = os.path.join(tmpdir, 'testpackage-3.14.tar.gz')
+        archive = tarfile.open(filename, mode='w:gz')
+        for name, data in [
+                ('testpackage-3.14/PKG-INFO',
+                 b'Metadata-Version: 1.0\nName: testpackage\n'
+                 b'Version: 3.14\n'),
+                ('testpackage-3.14/payload.bin', os.urandom(256 * 1024)),
+                ]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, BytesIO(data))
+        archive.close()
+        # Chop off the tail:  listing all members would now fail.
+        with open(filename, 'r+b') as f:
+            f.truncate(os.path.getsize(filename) // 2)
+        tested = self._makeOne()
+        self.assertEqual(tested._extractNameVersion(filename),
+                         ('testpackage', '3.14'))
+
+    def test__extractNameVersion_skips_nested_pkg_info(self):
+        filename = self._makeSourceArchive([
+            ('testpackage/src/other.egg-info/PKG-INFO',
+             b'Metadata-Version: 1.0\nName: other\nVersion: 1.0\n'),
+            ('testpackage/setup.py', _LITERAL_SETUP),
+            ])
+        tested = self._makeOne()
+        self.assertEqual(tested._extractNameVersion(filename),
+                         ('testpackage', '3.14'))
+
+    def test__extractNameVersion_archive_w_setup_skips_payload(self):
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _PAYLOAD_CHECKING_SETUP),
+            ('testpackage/testpackage/__init__.py', b''),
+            ('testpackage/tests/blob.bin', b'x' * 1024),
+            ])
+        tested = self._makeOne('--run-setup-py')
+        self.assertEqual(tested._extractNameVersion(filename),
+                         ('testpackage', '3.14'))
+
+    def test__extractNameVersion_archive_w_hanging_setup(self):
+        import time
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _HANGING_SETUP),
+            ])
+        tested = self._makeOne('--run-setup-py', '--setup-timeout=0.5')
+        started = time.time()
+        self.assertEqual(tested._extractNameVersion(filename),
+                         (None, None))
+        self.assertTrue(time.time() - started < 10)
+        self.assertEqual(tested.failures,
+            [(filename, 'setup.py timed out after 0.5 seconds')])
+
+    def test__extractNameVersion_archive_w_forking_setup(self):
+        import os
+        import time
+        if getattr(os, 'killpg', None) is None: #pragma NO COVER
+            return
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _FORKING_SETUP),
+            ])
+        tested = self._makeOne('--run-setup-py', '--setup-timeout=0.5')
+        started = time.time()
+        self.assertEqual(tested._extractNameVersion(filename),
+                         (None, None))
+        # The sleeping grandchild holds the pipes open, and must be killed.
+        self.assertTrue(time.time() - started < 10)
+        self.assertEqual(tested.failures,
+            [(filename, 'setup.py timed out after 0.5 seconds')])
+
+    def test__extractNameVersion_archive_w_cpu_limit(self):
+        from compoze.indexer import resource
+        if resource is None: #pragma NO COVER
+            return
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _HANGING_SETUP),
+            ])
+        tested = self._makeOne('--run-setup-py', '--setup-cpu-limit=1')
+        self.assertEqual(tested._extractNameVersion(filename),
+                         (None, None))
+        [(failed, reason)] = tested.failures
+        self.assertEqual(failed, filename)
+        self.assertTrue(reason.startswith('setup.py killed by signal'))
+
+    def test__extractNameVersion_archive_w_memory_limit(self):
+        from compoze.indexer import resource
+        if resource is None: #pragma NO COVER
+            return
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _GREEDY_SETUP),
+            ])
+        tested = self._makeOne('--run-setup-py', '--setup-memory-limit=1G')
+        self.assertEqual(tested._extractNameVersion(filename),
+                         (None, None))
+        [(failed, reason)] = tested.failures
+        self.assertTrue('MemoryError' in reason)
+
+    def test_make_index_w_failure_report(self):
+        import os
+        import shutil
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        shutil.copy(self._makeSourceArchive([
+                        ('broken/setup.py', _ERRORING_SETUP),
+                        ]),
+                    os.path.join(tmpdir, 'broken-1.0.tgz'))
+        report = os.path.join(tmpdir, 'failures.txt')
+        logged = []
+        indexer = self._makeOne('--path=%s' % tmpdir, '--verbose',
+                                '--run-setup-py', '--workers=2',
+                                '--failure-report=%s' % report,
+                                '--index-name=other',
+                                logger=logged.append)
+        indexer.make_index()
+        failed = os.path.join(tmpdir, 'broken-1.0.tgz')
+        self.assertEqual([x[0] for x in indexer.failures], [failed])
+        self.assertTrue('Failed archives:' in logged)
+        with open(report) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('%s\tError in setup.py' % failed))
+
+    def test_make_index_w_metadata_cache_skips_failures(self):
+        import os
+        import shutil
+        from compoze.cacher import MetadataCache
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        failed = os.path.join(tmpdir, 'broken-1.0.tgz')
+        shutil.copy(self._makeSourceArchive([
+                        ('broken/setup.py', _ERRORING_SETUP),
+                        ]), failed)
+        cache_file = os.path.join(tmpdir, 'metadata.db')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--run-setup-py', '--index-name=other',
+                                '--metadata-cache=%s' % cache_file)
+        indexer.make_index()
+        cache = MetadataCache(cache_file)
+        try:
+            self.assertEqual(cache.lookup(failed), None)
+            self.assertNotEqual(cache.lookup(
+                os.path.join(tmpdir, 'testpackage-3.14.tar.gz')), None)
+        finally:
+            cache.close()
+
+    def test_make_index_w_metadata_cache_wo_run_setup_py_not_cached(self):
+        import os
+        import shutil
+        tmpdir = self._makeTempdir()
+        dynamic = os.path.join(tmpdir, 'testpackage-3.14.tgz')
+        shutil.copy(self._makeSourceArchive([
+                        ('testpackage/setup.py', _DUMMY_SETUP),
+                        ]), dynamic)
+        cache_file = os.path.join(tmpdir, 'metadata.db')
+        report = os.path.join(tmpdir, 'failures.txt')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--index-name=first',
+                                '--failure-report=%s' % report,
+                                '--metadata-cache=%s' % cache_file)
+        self.assertRaises(ValueError, indexer.make_index)
+        with open(report) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('%s\tNo static metadata'
+                                                % dynamic))
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--run-setup-py', '--index-name=second',
+                                '--metadata-cache=%s' % cache_file)
+        indexer.make_index()
+        self.assertTrue(os.path.isdir(
+            os.path.join(tmpdir, 'second', 'testpackage')))
+
+    def test_make_index_normalizes_project_names(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'Test_Package', '3.14')
+        self._makeSdist(tmpdir, 'test.package', '2.71')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet')
+        indexer.make_index()
+        self.assertEqual(sorted(os.listdir(os.path.join(tmpdir, 'simple'))),
+                         ['index.html', 'test-package'])
+        with open(os.path.join(tmpdir, 'simple', 'test-package',
+                               'index.html')) as f:
+            sub = f.read()
+        self.assertTrue('Test_Package-3.14.tar.gz' in sub)
+        self.assertTrue('test.package-2.71.tar.gz' in sub)
+
+    def test_make_index_w_no_hashes(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--no-hashes')
+        indexer.make_index()
+        with open(os.path.join(tmpdir, 'simple', 'testpackage',
+                               'index.html')) as f:
+            sub = f.read()
+        self.assertTrue('<a href="../../testpackage-3.14.tar.gz">' in sub)
+
+    def test_make_index_w_workers_hashes_in_parallel(self):
+        import os
+        from compoze._util import file_sha256
+        tmpdir = self._makeTempdir()
+        first = self._makeSdist(tmpdir, 'testpackage', '3.14')
+        second = self._makeSdist(tmpdir, 'otherpackage', '1.0')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--workers=2')
+        indexer.make_index()
+        for name, filename in [('testpackage', first),
+                               ('otherpackage', second)]:
+            with open(os.path.join(tmpdir, 'simple', name,
+                                   'index.html')) as f:
+                sub = f.read()
+            self.assertTrue('#sha256=%s"' % file_sha256(filename) in sub)
+
+    def test_make_index_w_metadata_cache_stores_hashes(self):
+        import os
+        from compoze.cacher import MetadataCache
+        from compoze._util import file_sha256
+        tmpdir = self._makeTempdir()
+        filename = self._makeSdist(tmpdir, 'testpackage', '3.14')
+        cache_file = os.path.join(tmpdir, 'metadata.db')
+        # Simulate an entry recorded without a hash.
+        cache = MetadataCache(cache_file)
+        cache.store(filename, 'testpackage', '3.14')
+        cache.close()
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--metadata-cache=%s' % cache_file)
+        indexer.make_index()
+        cache = MetadataCache(cache_file)
+        try:
+            self.assertEqual(cache.lookup(filename)['sha256'],
+                             file_sha256(filename))
+        finally:
+            cache.close()
+
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--metadata-cache=%s' % cache_file,
+                                '--index-name=other')
+        def _hashMany(path, candidates):
+            self.assertEqual(candidates, [])
+            return {}
+        indexer._hashMany = _hashMany
+        indexer.make_index()
+
+    def test_make_index_w_format_json(self):
+        import json
+        import os
+        from compoze._util import file_sha256
+        tmpdir = self._makeTempdir()
+        filename = self._makeSdist(tmpdir, 'testpackage', '3.14',
+                                   requires_python='>=3.6')
+        self._makeSdist(tmpdir, 'testpackage', '2.71')
+        with open(os.path.join(tmpdir, 'testpackage-2.71.tar.gz.yanked'),
+                  'w') as f:
+            f.write('Broken\n')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--format=json')
+        indexer.make_index()
+
+        self.assertFalse(os.path.exists(
+                            os.path.join(tmpdir, 'simple', 'index.html')))
+        with open(os.path.join(tmpdir, 'simple', 'index.json')) as f:
+            top = json.load(f)
+        self.assertEqual(top, {'meta': {'api-version': '1.0'},
+                               'projects': [{'name': 'testpackage'}]})
+        with open(os.path.join(tmpdir, 'simple', 'testpackage',
+                               'index.json')) as f:
+            sub = json.load(f)
+        self.assertEqual(sub['meta'], {'api-version': '1.0'})
+        self.assertEqual(sub['name'], 'testpackage')
+        self.assertEqual(sub['files'], [
+            {'filename': 'testpackage-2.71.tar.gz',
+             'url': '../../testpackage-2.71.tar.gz',
+             'hashes': {'sha256': file_sha256(
+                            os.path.join(tmpdir, 'testpackage-2.71.tar.gz'))},
+             'yanked': 'Broken',
+            },
+            {'filename': 'testpackage-3.14.tar.gz',
+             'url': '../../testpackage-3.14.tar.gz',
+             'hashes': {'sha256': file_sha256(filename)},
+             'requires-python': '>=3.6',
+             'yanked': False,
+            },
+            ])
+
+    def test_make_index_w_format_both(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14',
+                        requires_python='>=3.6')
+        with open(os.path.join(tmpdir, 'testpackage-3.14.tar.gz.yanked'),
+                  'w') as f:
+            pass
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--format=both', '--no-hashes')
+        indexer.make_index()
+        for page in ('index.html', 'index.json'):
+            self.assertTrue(os.path.isfile(
+                        os.path.join(tmpdir, 'simple', page)))
+            self.assertTrue(os.path.isfile(
+                        os.path.join(tmpdir, 'simple', 'testpackage', page)))
+        with open(os.path.join(tmpdir, 'simple', 'testpackage',
+                               'index.html')) as f:
+            sub = f.read()
+        self.assertTrue('<a href="../../testpackage-3.14.tar.gz"'
+                        ' data-requires-python="&gt;=3.6" data-yanked="">'
+                        in sub)
+
+    def test_ctor_format_invalid_raises(self):
+        self.assertRaises(SystemExit, self._makeOne, '--format=xml')
+
+    def test_make_index_w_update_removes_vanished_json_pages(self):
+        import os
+        tmpdir = self._makeTempdir()
+        gone = self._makeSdist(tmpdir, 'otherpackage', '1.0')
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeOne('--path=%s' % tmpdir, '--quiet',
+                      '--format=json').make_index()
+        os.remove(gone)
+        self._makeOne('--path=%s' % tmpdir, '--quiet', '--update',
+                      '--format=json').make_index()
+        self.assertEqual(sorted(os.listdir(os.path.join(tmpdir, 'simple'))),
+                         ['index.json', 'testpackage'])
+
+    def test_make_index_w_compress(self):
+        import gzip
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--compress', '--format=both')
+        indexer.make_index()
+        for page in ('index.html', 'index.json',
+                     os.path.join('testpackage', 'index.html'),
+                     os.path.join('testpackage', 'index.json')):
+            filename = os.path.join(tmpdir, 'simple', page)
+            with open(filename, 'rb') as f:
+                expected = f.read()
+            with gzip.open(filename + '.gz', 'rb') as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_make_index_w_compress_brotli(self):
+        import os
+        from compoze._compat import brotli
+        if brotli is None: #pragma NO COVER
+            return
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'testpackage', '3.14')
+        self._makeOne('--path=%s' % tmpdir, '--quiet',
+                      '--compress').make_index()
+        filename = os.path.join(tmpdir, 'simple', 'index.html')
+        with open(filename, 'rb') as f:
+            expected = f.read()
+        with open(filename + '.br', 'rb') as f:
+            self.assertEqual(brotli.decompress(f.read()), expected)
+
+    def test__writePage_w_compress_unchanged_and_stale_copies(self):
+        import os
+        tmpdir = self._makeTempdir()
+        filename = os.path.join(tmpdir, 'index.html')
+        indexer = self._makeOne('--compress')
+        self.assertEqual(indexer._writePage(filename, 'PAGE'), 1)
+        self.assertEqual(indexer._writePage(filename, 'PAGE'), 0)
+        # Turning compression off removes the now stale copies.
+        indexer = self._makeOne()
+        self.assertEqual(indexer._writePage(filename, 'PAGE'), 1)
+        self.assertFalse(os.path.exists(filename + '.gz'))
+        self.assertEqual(indexer._writePage(filename, 'PAGE'), 0)
+        # ... and turning it back on restores them.
+        indexer = self._makeOne('--compress')
+        self.assertEqual(indexer._writePage(filename, 'PAGE'), 1)
+        self.assertTrue(os.path.isfile(filename + '.gz'))
+
+    def test_make_index_w_core_metadata(self):
+        import hashlib
+        import json
+        import os
+        tmpdir = self._makeTempdir()
+        filename = self._makeSdist(tmpdir, 'testpackage', '3.14')
+        logged = []
+        indexer = self._makeOne('--path=%s' % tmpdir, '--verbose',
+                                '--core-metadata', '--format=both',
+                                logger=logged.append)
+        indexer.make_index()
+
+        with open(filename + '.metadata', 'rb') as f:
+            data = f.read()
+        self.assertTrue(data.startswith(b'Metadata-Version: 1.2\n'))
+        self.assertTrue(b'Name: testpackage\n' in data)
+        sha256 = hashlib.sha256(data).hexdigest()
+        with open(os.path.join(tmpdir, 'simple', 'testpackage',
+                               'index.html')) as f:
+            sub = f.read()
+        self.assertTrue('data-dist-info-metadata="sha256=%s"' % sha256 in sub)
+        self.assertTrue('data-core-metadata="sha256=%s"' % sha256 in sub)
+        with open(os.path.join(tmpdir, 'simple', 'testpackage',
+                               'index.json')) as f:
+            [info] = json.load(f)['files']
+        self.assertEqual(info['core-metadata'], {'sha256': sha256})
+        self.assertEqual(info['dist-info-metadata'], {'sha256': sha256})
+        # The sidecar is not itself a candidate on later runs.
+        logged[:] = []
+        self._makeOne('--path=%s' % tmpdir, '--verbose', '--update',
+                      '--core-metadata', logger=logged.append).make_index()
+        self.assertEqual([x for x in logged if x.startswith('Parsing: ')],
+                         ['Parsing: %s' % filename])
+        self.assertFalse([x for x in logged if x.startswith('Metadata: ')])
+
+    def test_make_index_w_core_metadata_and_cache(self):
+        import os
+        tmpdir = self._makeTempdir()
+        filename = self._makeSdist(tmpdir, 'testpackage', '3.14')
+        cache_file = os.path.join(tmpdir, 'cache', 'metadata.db')
+        # Cached without sidecars, the archive is re-read when wanted.
+        self._makeOne('--path=%s' % tmpdir, '--quiet',
+                      '--metadata-cache=%s' % cache_file,
+                      '--index-name=first').make_index()
+        self._makeOne('--path=%s' % tmpdir, '--quiet', '--core-metadata',
+                      '--metadata-cache=%s' % cache_file,
+                      '--index-name=second').make_index()
+        self.assertTrue(os.path.isfile(filename + '.metadata'))
+
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--core-metadata',
+                                '--metadata-cache=%s' % cache_file,
+                                '--index-name=third')
+        def _extractMetadata(filename):
+            raise AssertionError('Not cached: %s' % filename)
+        indexer._extractMetadata = _extractMetadata
+        indexer.make_index()
+        with open(os.path.join(tmpdir, 'third', 'testpackage',
+                               'index.html')) as f:
+            self.assertTrue('data-core-metadata=' in f.read())
+
+        # Without the option, the sidecar is not advertised.
+        self._makeOne('--path=%s' % tmpdir, '--quiet',
+                      '--metadata-cache=%s' % cache_file,
+                      '--index-name=fourth').make_index()
+        with open(os.path.join(tmpdir, 'fourth', 'testpackage',
+                               'index.html')) as f:
+            self.assertFalse('data-core-metadata=' in f.read())
+
+    def _makeWheel(self, tmpdir, name, version):
+        import os
+        import zipfile
+        filename = os.path.join(tmpdir,
+                                '%s-%s-py3-none-any.whl' % (name, version))
+        archive = zipfile.ZipFile(filename, 'w')
+        archive.writestr('%s/__init__.py' % name, '')
+        archive.writestr('%s-%s.dist-info/METADATA' % (name, version),
+                         'Metadata-Version: 2.1\nName: %s\nVersion: %s\n'
+                         'Requires-Python: >=3.6\n' % (name, version))
+        archive.close()
+        return filename
+
+    def test__extractMetadata_unreadable_wheel_uses_filename(self):
+        import os
+        tmpdir = self._makeTempdir()
+        filename = os.path.join(tmpdir, 'test_package-3.14-py3-none-any.whl')
+        with open(filename, 'w') as f:
+            f.write('not even a zipfile')
+        tested = self._makeOne()
+        self.assertEqual(tested._extractMetadata(filename),
+                         ('test_package', '3.14', {}))
+
+    def test_make_index_w_wheel_requires_python(self):
+        import json
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeWheel(tmpdir, 'test_package', '3.14')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--format=both')
+        indexer.make_index()
+        page = os.path.join(tmpdir, 'simple', 'test-package', 'index')
+        with open(page + '.json') as f:
+            [info] = json.load(f)['files']
+        self.assertEqual(info['requires-python'], '>=3.6')
+        with open(page + '.html') as f:
+            self.assertTrue('data-requires-python="&gt;=3.6"' in f.read())
+        self.assertFalse(os.path.exists(os.path.join(
+                tmpdir, 'test_package-3.14-py3-none-any.whl.metadata')))
+
+    def test_make_index_w_wheel_and_core_metadata(self):
+        import os
+        tmpdir = self._makeTempdir()
+        self._makeSdist(tmpdir, 'test-package', '2.71')
+        filename = self._makeWheel(tmpdir, 'test_package', '3.14')
+        indexer = self._makeOne('--path=%s' % tmpdir, '--quiet',
+                                '--core-metadata')
+        indexer.make_index()
+        with open(filename + '.metadata') as f:
+            self.assertTrue('Version: 3.14\n' in f.read())
+        with open(os.path.join(tmpdir, 'simple', 'test-package',
+                               'index.html')) as f:
+            sub = f.read()
+        self.assertTrue('test_package-3.14-py3-none-any.whl' in sub)
+        self.assertTrue('test-package-2.71.tar.gz' in sub)
+        self.assertTrue('data-requires-python="&gt;=3.6"' in sub)
+
+    def test__extractNameVersion_archive_static_wins_over_run_setup(self):
+        # The static path never executes setup.py, even when allowed to.
+        filename = self._makeSourceArchive([
+            ('testpackage/setup.py', _LITERAL_SETUP + _ERRORING_SETUP),
+            ])
+        tested = self._makeOne('--run-setup-py')
+        self.assertEqual(tested._extractNameVersion(filename),
+                         ('testpackage', '3.14'))
+
 _DUMMY_SETUP = b"""\
 print('testpackage')
 print('3.14')
@@ -603,3 +1521,48 @@ sys.exit(1)
 
 _NOOUT_SETUP = b"""\
 """
+
+_LITERAL_SETUP = b"""\
+from setuptools import setup
+VERSION = '3.14'
+setup(name='testpackage',
+      version=VERSION,
+     )
+"""
+
+_SETUP_CFG = b"""\
+[metadata]
+name = testpackage
+version = 3.14
+"""
+
+_PYPROJECT = b"""\
+[project]
+name = "testpackage"
+version = "3.14"
+"""
+
+_PAYLOAD_CHECKING_SETUP = b"""\
+import os
+assert os.path.exists('testpackage/__init__.py')
+assert not os.path.exists('tests/blob.bin')
+print('testpackage')
+print('3.14')
+"""
+
+_HANGING_SETUP = b"""\
+while True:
+    pass
+"""
+
+_FORKING_SETUP = b"""\
+import subprocess
+import sys
+subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+while True:
+    pass
+"""
+
+_GREEDY_SETUP = b"""\
+hog = b'x' * (2 << 30)
+"""
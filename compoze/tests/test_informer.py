@@ -76,6 +76,26 @@ class InformerTests(unittest.TestCase):
         self.assertEqual(informer.options.use_versions, False)
         self.assertEqual(informer.options.versions_section, None)
         self.assertEqual(informer.options.config_file_data, {})
+        self.assertEqual(informer.options.cache_dir, None)
+        self.assertEqual(informer.page_cache, None)
+
+    def test_ctor_cache_dir(self):
+        import os
+        path = self._makeTempDir()
+        informer = self._makeOne('--cache-dir=%s' % path)
+        self.assertEqual(informer.page_cache.path,
+                         os.path.join(path, 'pages'))
+
+    def test__makeIndex_w_cache_dir(self):
+        informer = self._makeOne('--cache-dir=%s' % self._makeTempDir())
+        called = []
+        def _factory(**kw):
+            called.append(kw)
+        informer.index_factory = _factory
+        informer._makeIndex(index_url='http://example.com/simple')
+        self.assertEqual(called,
+                         [{'index_url': 'http://example.com/simple',
+                           'page_cache': informer.page_cache}])
 
     def test_ctor_uses_global_options_as_default(self):
         g_options = self._makeOptions(path='/tmp/foo',
@@ -0,0 +1,101 @@
+import unittest
+
+class Test_static_name_version(unittest.TestCase):
+
+    def _callFUT(self, files, prefix='testpackage'):
+        from compoze.metadata import static_name_version
+        return static_name_version(DummyArchive(files), prefix)
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT({}), (None, None))
+
+    def test_setup_py_literal_kwargs(self):
+        files = {'testpackage/setup.py':
+                    b"from setuptools import setup\n"
+                    b"setup(name='testpackage', version='3.14')\n"}
+        self.assertEqual(self._callFUT(files), ('testpackage', '3.14'))
+
+    def test_setup_py_attribute_call_and_constants(self):
+        files = {'testpackage/setup.py':
+                    b"import setuptools\n"
+                    b"NAME = 'testpackage'\n"
+                    b"__version__ = '3.14'\n"
+                    b"setuptools.setup(name=NAME, version=__version__)\n"}
+        self.assertEqual(self._callFUT(files), ('testpackage', '3.14'))
+
+    def test_setup_py_computed_version(self):
+        files = {'testpackage/setup.py':
+                    b"from setuptools import setup\n"
+                    b"setup(name='testpackage', version=open('V').read())\n"}
+        self.assertEqual(self._callFUT(files), (None, None))
+
+    def test_setup_py_wo_setup_call(self):
+        files = {'testpackage/setup.py': b"print('testpackage')\n"}
+        self.assertEqual(self._callFUT(files), (None, None))
+
+    def test_setup_py_syntax_error(self):
+        files = {'testpackage/setup.py': b"setup(name='testpackage'\n"}
+        self.assertEqual(self._callFUT(files), (None, None))
+
+    def test_setup_py_at_root(self):
+        files = {'setup.py': b"setup(name='testpackage', version='3.14')\n"}
+        self.assertEqual(self._callFUT(files, prefix=''),
+                         ('testpackage', '3.14'))
+
+    def test_setup_cfg(self):
+        files = {'testpackage/setup.cfg':
+                    b"[metadata]\nname = testpackage\nversion = 3.14\n"}
+        self.assertEqual(self._callFUT(files), ('testpackage', '3.14'))
+
+    def test_setup_cfg_wo_metadata_section(self):
+        files = {'testpackage/setup.cfg': b"[bdist_wheel]\nuniversal = 1\n"}
+        self.assertEqual(self._callFUT(files), (None, None))
+
+    def test_setup_cfg_version_from_file(self):
+        files = {'testpackage/setup.cfg':
+                    b"[metadata]\nname = testpackage\nversion = file: VERSION\n",
+                 'testpackage/VERSION': b"3.14\n"}
+        self.assertEqual(self._callFUT(files), ('testpackage', '3.14'))
+
+    def test_setup_cfg_version_from_attr(self):
+        files = {'testpackage/setup.cfg':
+                    b"[metadata]\nname = testpackage\n"
+                    b"version = attr: testpackage.__version__\n",
+                 'testpackage/src/testpackage/__init__.py':
+                    b"__version__ = '3.14'\n"}
+        self.assertEqual(self._callFUT(files), ('testpackage', '3.14'))
+
+    def test_setup_cfg_name_setup_py_version(self):
+        files = {'testpackage/setup.cfg': b"[metadata]\nname = testpackage\n",
+                 'testpackage/setup.py': b"setup(version='3.14')\n"}
+        self.assertEqual(self._callFUT(files), ('testpackage', '3.14'))
+
+    def test_pyproject(self):
+        from compoze._compat import tomllib
+        if tomllib is None: #pragma NO COVER
+            return
+        files = {'testpackage/pyproject.toml':
+                    b'[project]\nname = "testpackage"\nversion = "3.14"\n'}
+        self.assertEqual(self._callFUT(files), ('testpackage', '3.14'))
+
+    def test_pyproject_dynamic_version(self):
+        from compoze._compat import tomllib
+        if tomllib is None: #pragma NO COVER
+            return
+        files = {'testpackage/pyproject.toml':
+                    b'[project]\nname = "testpackage"\n'
+                    b'dynamic = ["version"]\nversion = "0.0"\n',
+                 'testpackage/setup.cfg':
+                    b"[metadata]\nversion = 3.14\n"}
+        self.assertEqual(self._callFUT(files), ('testpackage', '3.14'))
+
+class DummyArchive(object):
+
+    def __init__(self, files):
+        self._files = files
+
+    def names(self):
+        return sorted(self._files)
+
+    def read(self, name):
+        return self._files[name]
@@ -32,6 +32,10 @@ class Test_is_archive(unittest.TestCase):
         self.assertFalse(self._callFUT('foo_zip'))
         self.assertTrue(self._callFUT('foo.zip'))
 
+    def test_whl(self):
+        self.assertFalse(self._callFUT('foo_whl'))
+        self.assertTrue(self._callFUT('foo-1.0-py3-none-any.whl'))
+
 class PoolerTests(unittest.TestCase):
 
     _tmpdirs = None
@@ -152,6 +156,21 @@ class PoolerTests(unittest.TestCase):
         self.assertEqual(pooler.listArchives(),
                         (['foo.tar.gz'], []))
 
+    def test_listArchves_skips_dirs_and_dangling_links(self):
+        import os
+        release_dir = self._makeTempDir()
+        os.mkdir(os.path.join(release_dir, 'dir.tar.gz'))
+        os.symlink(os.path.join(release_dir, 'nonesuch.tar.gz'),
+                   os.path.join(release_dir, 'dangling.tar.gz'))
+        self._makeFile(release_dir, 'foo.tar.gz')
+        self._makeFile(release_dir, 'README.txt')
+        pooler = self._makeOne('--quiet',
+                                '--path=%s' % release_dir,
+                                self._makeTempDir(),
+                               )
+        self.assertEqual(pooler.listArchives(),
+                        (['foo.tar.gz'], ['foo.tar.gz']))
+
     def test_move_to_pool_no_pool_dir_raises(self):
         pooler = self._makeOne()
         self.assertRaises(ValueError, pooler.move_to_pool)
@@ -207,3 +226,686 @@ class PoolerTests(unittest.TestCase):
         with open(target) as f:
             self.assertEqual(f.read(), 'TARGET') # not replaced
         self.assertTrue(os.path.islink(source))
+
+    def test_ctor_content_addressed_default(self):
+        pooler = self._makeOne(self._makeTempDir())
+        self.assertFalse(pooler.options.content_addressed)
+        self.assertEqual(pooler.mismatches, [])
+
+    def test_blobPath(self):
+        import os
+        pool_dir = self._makeTempDir()
+        pooler = self._makeOne(pool_dir)
+        self.assertEqual(pooler.blobPath('abcdef'),
+                         os.path.join(pool_dir, 'sha256', 'ab', 'abcdef'))
+
+    def test_loadManifest_missing(self):
+        pooler = self._makeOne(self._makeTempDir())
+        self.assertEqual(pooler.loadManifest(), {})
+
+    def test_move_to_pool_content_addressed(self):
+        import hashlib
+        import json
+        import os
+        release_dir = self._makeTempDir()
+        source = self._makeFile(release_dir, 'foo.tar.gz', 'SOURCE')
+        pool_dir = self._makeTempDir()
+        pooler = self._makeOne('--quiet',
+                                '--content-addressed',
+                                '--path=%s' % release_dir,
+                                pool_dir,
+                               )
+        pooler.move_to_pool()
+
+        digest = hashlib.sha256(b'SOURCE').hexdigest()
+        blob = pooler.blobPath(digest)
+        self.assertTrue(os.path.islink(source))
+        self.assertEqual(os.readlink(source), blob)
+        with open(blob) as f:
+            self.assertEqual(f.read(), 'SOURCE')
+        self.assertFalse(os.path.exists(os.path.join(pool_dir,
+                                                     'foo.tar.gz')))
+        with open(os.path.join(pool_dir, 'manifest.json')) as f:
+            self.assertEqual(json.load(f), {'foo.tar.gz': [digest]})
+        self.assertEqual(pooler.mismatches, [])
+
+    def test_move_to_pool_content_addressed_dedups_across_release_dirs(self):
+        import os
+        pool_dir = self._makeTempDir()
+        sources = []
+        for name in ('foo.tar.gz', 'foo.tar.gz', 'bar.tar.gz'):
+            release_dir = self._makeTempDir()
+            sources.append(self._makeFile(release_dir, name, 'SAME'))
+            pooler = self._makeOne('--quiet',
+                                    '--content-addressed',
+                                    '--path=%s' % release_dir,
+                                    pool_dir,
+                                   )
+            pooler.move_to_pool()
+        targets = set([os.readlink(x) for x in sources])
+        self.assertEqual(len(targets), 1)
+        self.assertEqual(os.listdir(os.path.join(pool_dir, 'sha256')),
+                         [os.path.basename(os.path.dirname(targets.pop()))])
+        self.assertEqual(sorted(pooler.loadManifest()),
+                         ['bar.tar.gz', 'foo.tar.gz'])
+        self.assertEqual(pooler.mismatches, [])
+
+    def test_move_to_pool_content_addressed_detects_mismatch(self):
+        import hashlib
+        import os
+        pool_dir = self._makeTempDir()
+        logged = []
+        first_dir = self._makeTempDir()
+        first = self._makeFile(first_dir, 'foo.tar.gz', 'FIRST')
+        self._makeOne('--quiet', '--content-addressed',
+                      '--path=%s' % first_dir, pool_dir).move_to_pool()
+        second_dir = self._makeTempDir()
+        second = self._makeFile(second_dir, 'foo.tar.gz', 'SECOND')
+        pooler = self._makeOne('--verbose', '--content-addressed',
+                               '--path=%s' % second_dir, pool_dir,
+                               logger=logged.append)
+        pooler.move_to_pool()
+
+        first_digest = hashlib.sha256(b'FIRST').hexdigest()
+        second_digest = hashlib.sha256(b'SECOND').hexdigest()
+        self.assertEqual(pooler.mismatches,
+                         [('foo.tar.gz', second_digest, [first_digest])])
+        self.assertTrue(logged[0].startswith('Mismatched contents for'))
+        self.assertEqual(pooler.loadManifest(),
+                         {'foo.tar.gz': [first_digest, second_digest]})
+        # Each release dir keeps its own contents.
+        with open(first) as f:
+            self.assertEqual(f.read(), 'FIRST')
+        with open(second) as f:
+            self.assertEqual(f.read(), 'SECOND')
+        self.assertNotEqual(os.readlink(first), os.readlink(second))
+
+    def test_ctor_release_dirs(self):
+        first = self._makeTempDir()
+        second = self._makeTempDir()
+        pooler = self._makeOne('--path=%s' % self._makeTempDir(),
+                               '--release-dir=%s' % second,
+                               '--release-dir=%s' % first,
+                               '--release-dir=%s' % second,
+                               self._makeTempDir())
+        self.assertEqual(pooler.release_dirs, [second, first])
+        self.assertFalse(pooler.options.gc)
+        self.assertFalse(pooler.options.gc_remove)
+
+    def test_ctor_path_is_default_release_dir(self):
+        release_dir = self._makeTempDir()
+        pooler = self._makeOne('--path=%s' % release_dir,
+                               self._makeTempDir())
+        self.assertEqual(pooler.release_dirs, [release_dir])
+
+    def test_ctor_release_dir_is_pool_dir_raises(self):
+        import os
+        pool_dir = self._makeTempDir()
+        self.assertRaises(ValueError, self._makeOne,
+                          '--path=%s' % pool_dir, pool_dir)
+        alias = os.path.join(self._makeTempDir(), 'alias')
+        os.symlink(pool_dir, alias)
+        self.assertRaises(ValueError, self._makeOne,
+                          '--release-dir=%s' % self._makeTempDir(),
+                          '--release-dir=%s' % alias, pool_dir)
+
+    def test_ctor_release_dir_wo_path_skips_cwd_pool_dir(self):
+        # 'cd pool; compoze pool -r release .' must not pool the pool.
+        import os
+        pool_dir = self._makeTempDir()
+        target = self._makeFile(pool_dir, 'foo.tar.gz', 'POOLED')
+        release_dir = self._makeTempDir()
+        self._makeFile(release_dir, 'bar.tar.gz')
+        cwd = os.getcwd()
+        os.chdir(pool_dir)
+        try:
+            pooler = self._makeOne('--quiet',
+                                   '--release-dir=%s' % release_dir, '.')
+            pooler.move_to_pool()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(pooler.release_dirs, [release_dir])
+        self.assertFalse(os.path.islink(target))
+        with open(target) as f:
+            self.assertEqual(f.read(), 'POOLED')
+
+    def test_listReferences(self):
+        import os
+        pool_dir = self._makeTempDir()
+        release_dir = self._makeTempDir()
+        self._makeFile(pool_dir, 'foo.tar.gz')
+        self._makeLink(pool_dir, release_dir, 'foo.tar.gz')
+        os.symlink(os.path.join('..', os.path.basename(pool_dir),
+                                'bar.tar.gz'),
+                   os.path.join(release_dir, 'bar.tar.gz'))
+        self._makeFile(release_dir, 'baz.tar.gz')
+        pooler = self._makeOne('--path=%s' % release_dir, pool_dir)
+        self.assertEqual(pooler.listReferences(),
+                         set([os.path.join(pool_dir, 'foo.tar.gz'),
+                              os.path.join(pool_dir, 'bar.tar.gz')]))
+
+    def test_listReferences_missing_release_dir_raises(self):
+        import os
+        pooler = self._makeOne('--path=%s' % os.path.join(
+                                    self._makeTempDir(), 'nonesuch'),
+                               self._makeTempDir())
+        self.assertRaises(ValueError, pooler.listReferences)
+
+    def test_collectGarbage_no_pool_dir_raises(self):
+        pooler = self._makeOne('--gc')
+        self.assertRaises(ValueError, pooler.collectGarbage)
+
+    def test_collectGarbage_invalid_pool_dir_raises(self):
+        pool_dir = self._makeTempDir()
+        pooler = self._makeOne('--gc', self._makeFile(pool_dir, 'foolish'))
+        self.assertRaises(ValueError, pooler.collectGarbage)
+
+    def test_collectGarbage_wo_release_dir_raises(self):
+        import os
+        pool_dir = self._makeTempDir()
+        pooled = self._makeFile(pool_dir, 'foo.tar.gz')
+        pooler = self._makeOne('--gc', '--remove',
+                               '--path=%s' % self._makeTempDir(), pool_dir)
+        self.assertRaises(ValueError, pooler.collectGarbage)
+        self.assertTrue(os.path.exists(pooled))
+
+    def test_collectGarbage_empty_release_dirs_raises(self):
+        import os
+        pool_dir = self._makeTempDir()
+        pooled = self._makeFile(pool_dir, 'foo.tar.gz')
+        pooler = self._makeOne('--gc', '--remove',
+                               '--release-dir=%s' % self._makeTempDir(),
+                               pool_dir)
+        pooler.release_dirs = []  # e.g., emptied by a caller
+        self.assertRaises(ValueError, pooler.collectGarbage)
+        self.assertTrue(os.path.exists(pooled))
+
+    def test_collectGarbage_reports_only(self):
+        import os
+        pool_dir = self._makeTempDir()
+        first = self._makeTempDir()
+        second = self._makeTempDir()
+        for name in ('foo.tar.gz', 'bar.tar.gz', 'baz.tar.gz'):
+            self._makeFile(pool_dir, name)
+        self._makeFile(pool_dir, 'README.txt')
+        self._makeLink(pool_dir, first, 'foo.tar.gz')
+        self._makeLink(pool_dir, second, 'bar.tar.gz')
+        logged = []
+        pooler = self._makeOne('--verbose', '--gc',
+                               '--release-dir=%s' % first,
+                               '--release-dir=%s' % second,
+                               pool_dir, logger=logged.append)
+        unreferenced = pooler.collectGarbage()
+        baz = os.path.join(pool_dir, 'baz.tar.gz')
+        self.assertEqual(unreferenced, [baz])
+        self.assertEqual(logged, ['Unreferenced: %s' % baz])
+        self.assertTrue(os.path.exists(baz))
+
+    def test_collectGarbage_links_through_other_pool_path(self):
+        import os
+        pool_dir = self._makeTempDir()
+        alias = os.path.join(self._makeTempDir(), 'alias')
+        os.symlink(pool_dir, alias)
+        release_dir = self._makeTempDir()
+        self._makeFile(pool_dir, 'foo.tar.gz')
+        self._makeLink(pool_dir, release_dir, 'foo.tar.gz')
+        pooler = self._makeOne('--quiet', '--gc',
+                               '--release-dir=%s' % release_dir, alias)
+        self.assertEqual(pooler.collectGarbage(), [])
+
+    def test_collectGarbage_remove_content_addressed(self):
+        import hashlib
+        import os
+        pool_dir = self._makeTempDir()
+        first = self._makeTempDir()
+        second = self._makeTempDir()
+        self._makeFile(first, 'foo.tar.gz', 'FIRST')
+        self._makeFile(second, 'foo.tar.gz', 'SECOND')
+        for release_dir in (first, second):
+            self._makeOne('--quiet', '--content-addressed',
+                          '--path=%s' % release_dir,
+                          pool_dir).move_to_pool()
+        os.remove(os.path.join(first, 'foo.tar.gz'))
+        pooler = self._makeOne('--quiet', '--gc', '--remove',
+                               '--release-dir=%s' % first,
+                               '--release-dir=%s' % second,
+                               pool_dir)
+        first_digest = hashlib.sha256(b'FIRST').hexdigest()
+        second_digest = hashlib.sha256(b'SECOND').hexdigest()
+        self.assertEqual(pooler.collectGarbage(),
+                         [pooler.blobPath(first_digest)])
+        self.assertFalse(os.path.exists(pooler.blobPath(first_digest)))
+        self.assertTrue(os.path.exists(pooler.blobPath(second_digest)))
+        self.assertEqual(pooler.loadManifest(),
+                         {'foo.tar.gz': [second_digest]})
+
+    def test_ctor_jobs_invalid(self):
+        self.assertRaises(ValueError, self._makeOne, '--jobs=0')
+
+    def test_ctor_release_dir_glob_no_match_raises(self):
+        import os
+        pattern = os.path.join(self._makeTempDir(), 'rel-*')
+        try:
+            self._makeOne('--release-dir=%s' % pattern, self._makeTempDir())
+        except ValueError as e:
+            self.assertTrue(pattern in str(e))
+        else:
+            self.fail('ValueError not raised')
+
+    def test_ctor_release_dir_glob(self):
+        import os
+        parent = self._makeTempDir()
+        for name in ('rel-2', 'rel-1', 'other'):
+            os.mkdir(os.path.join(parent, name))
+        self._makeFile(parent, 'rel-3')
+        first = self._makeTempDir()
+        pooler = self._makeOne('--release-dir=%s' % first,
+                               '--release-dir=%s' % os.path.join(parent,
+                                                                 'rel-*'),
+                               self._makeTempDir())
+        self.assertEqual(pooler.release_dirs,
+                         [first,
+                          os.path.join(parent, 'rel-1'),
+                          os.path.join(parent, 'rel-2'),
+                         ])
+
+    def test_move_to_pool_multiple_release_dirs(self):
+        import os
+        pool_dir = self._makeTempDir()
+        first = self._makeTempDir()
+        second = self._makeTempDir()
+        sources = [self._makeFile(first, 'foo.tar.gz', 'FOO'),
+                   self._makeFile(first, 'bar.tar.gz', 'BAR'),
+                   self._makeFile(second, 'foo.tar.gz', 'FOO'),
+                  ]
+        self._makeFile(pool_dir, 'baz.tar.gz')
+        self._makeLink(pool_dir, second, 'baz.tar.gz')
+        logged = []
+        pooler = self._makeOne('--verbose', '--jobs=2',
+                               '--release-dir=%s' % first,
+                               '--release-dir=%s' % second,
+                               pool_dir, logger=logged.append)
+        all, pending = pooler.move_to_pool()
+
+        self.assertEqual(sorted(all), ['bar.tar.gz', 'baz.tar.gz',
+                                       'foo.tar.gz', 'foo.tar.gz'])
+        self.assertEqual(len(pending), 3)
+        self.assertEqual(pooler.report, [(first, 2, 2), (second, 2, 1)])
+        self.assertEqual(len([x for x in logged if x.startswith('Moved')]),
+                         2) # 'foo.tar.gz' only once
+        for source in sources:
+            self.assertTrue(os.path.islink(source))
+            self.assertEqual(os.readlink(source),
+                             os.path.join(pool_dir,
+                                          os.path.basename(source)))
+        self.assertEqual(sorted(os.listdir(pool_dir)),
+                         ['bar.tar.gz', 'baz.tar.gz', 'foo.tar.gz'])
+
+    def test_move_to_pool_missing_release_dir_raises(self):
+        import os
+        release_dir = self._makeTempDir()
+        self._makeFile(release_dir, 'foo.tar.gz')
+        pooler = self._makeOne('--quiet',
+                               '--release-dir=%s' % release_dir,
+                               '--release-dir=%s' % os.path.join(
+                                    release_dir, 'nonesuch'),
+                               self._makeTempDir())
+        self.assertRaises(ValueError, pooler.move_to_pool)
+        self.assertFalse(os.path.islink(os.path.join(release_dir,
+                                                     'foo.tar.gz')))
+
+    def test_move_to_pool_content_addressed_dedups_within_run(self):
+        import os
+        pool_dir = self._makeTempDir()
+        dirs = [self._makeTempDir() for i in range(3)]
+        sources = [self._makeFile(x, 'foo.tar.gz', 'SAME') for x in dirs]
+        logged = []
+        pooler = self._makeOne('--verbose', '--content-addressed',
+                               '--jobs=3',
+                               '--release-dir=%s' % dirs[0],
+                               '--release-dir=%s' % dirs[1],
+                               '--release-dir=%s' % dirs[2],
+                               pool_dir, logger=logged.append)
+        pooler.move_to_pool()
+        self.assertEqual(len(set([os.readlink(x) for x in sources])), 1)
+        self.assertEqual([x.split()[0] for x in logged],
+                         ['Moved', 'Deduplicated', 'Deduplicated'])
+
+    def test_ctor_link_mode_default(self):
+        pooler = self._makeOne(self._makeTempDir())
+        self.assertEqual(pooler.options.link_mode, 'symlink')
+
+    def test_move_to_pool_symlink_is_absolute(self):
+        import os
+        release_dir = self._makeTempDir()
+        source = self._makeFile(release_dir, 'foo.tar.gz')
+        pool_dir = self._makeTempDir()
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(pool_dir))
+        try:
+            pooler = self._makeOne('--quiet',
+                                   '--path=%s' % release_dir,
+                                   os.path.basename(pool_dir))
+            pooler.move_to_pool()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(os.readlink(source),
+                         os.path.join(pool_dir, 'foo.tar.gz'))
+
+    def test_move_to_pool_relative(self):
+        import os
+        parent = self._makeTempDir()
+        release_dir = os.path.join(parent, 'releases', '1.0')
+        pool_dir = os.path.join(parent, 'pool')
+        os.makedirs(release_dir)
+        source = self._makeFile(release_dir, 'foo.tar.gz', 'FOO')
+        pooler = self._makeOne('--quiet', '--link-mode=relative',
+                               '--path=%s' % release_dir, pool_dir)
+        pooler.move_to_pool()
+        self.assertEqual(os.readlink(source),
+                         os.path.join('..', '..', 'pool', 'foo.tar.gz'))
+        # The tree stays valid when moved elsewhere.
+        moved = os.path.join(self._makeTempDir(), 'moved')
+        os.rename(parent, moved)
+        os.mkdir(parent) # for tearDown
+        with open(os.path.join(moved, 'releases', '1.0', 'foo.tar.gz')) as f:
+            self.assertEqual(f.read(), 'FOO')
+
+    def test_move_to_pool_hardlink(self):
+        import os
+        pool_dir = self._makeTempDir()
+        release_dir = self._makeTempDir()
+        source = self._makeFile(release_dir, 'foo.tar.gz')
+        pooler = self._makeOne('--quiet', '--link-mode=hardlink',
+                               '--path=%s' % release_dir, pool_dir)
+        self.assertEqual(pooler.move_to_pool(),
+                         (['foo.tar.gz'], ['foo.tar.gz']))
+        self.assertFalse(os.path.islink(source))
+        self.assertTrue(os.path.samefile(source,
+                                         os.path.join(pool_dir,
+                                                      'foo.tar.gz')))
+        # Already pooled on the next run.
+        self.assertEqual(pooler.move_to_pool(), (['foo.tar.gz'], []))
+
+    def test_move_to_pool_hardlink_content_addressed(self):
+        import os
+        pool_dir = self._makeTempDir()
+        release_dir = self._makeTempDir()
+        source = self._makeFile(release_dir, 'foo.tar.gz')
+        pooler = self._makeOne('--quiet', '--link-mode=hardlink',
+                               '--content-addressed',
+                               '--path=%s' % release_dir, pool_dir)
+        pooler.move_to_pool()
+        self.assertEqual(pooler.move_to_pool(), (['foo.tar.gz'], []))
+        self.assertEqual(len(pooler.listPooled()), 1)
+        self.assertTrue(os.path.samefile(source, pooler.listPooled()[0]))
+
+    def test_move_to_pool_reflink_or_fallback(self):
+        import os
+        pool_dir = self._makeTempDir()
+        release_dir = self._makeTempDir()
+        source = self._makeFile(release_dir, 'foo.tar.gz', 'FOO')
+        pooler = self._makeOne('--quiet', '--link-mode=reflink',
+                               '--path=%s' % release_dir, pool_dir)
+        pooler.move_to_pool()
+        target = os.path.join(pool_dir, 'foo.tar.gz')
+        if os.path.islink(source):  # filesystem can't clone
+            self.assertEqual(os.readlink(source), target)
+        else:
+            self.assertFalse(os.path.samefile(source, target))
+        with open(source) as f:
+            self.assertEqual(f.read(), 'FOO')
+        with open(target) as f:
+            self.assertEqual(f.read(), 'FOO')
+
+    def test_move_to_pool_link_failure_falls_back_to_symlink(self):
+        import errno
+        import os
+        from compoze import pooler as MUT
+        def _fail(target, source):
+            raise OSError(errno.EXDEV, 'Cross-device link')
+        original, MUT._reflink = MUT._reflink, _fail
+        try:
+            pool_dir = self._makeTempDir()
+            release_dir = self._makeTempDir()
+            source = self._makeFile(release_dir, 'foo.tar.gz')
+            logged = []
+            pooler = self._makeOne('--verbose', '--link-mode=reflink',
+                                   '--path=%s' % release_dir, pool_dir,
+                                   logger=logged.append)
+            pooler.move_to_pool()
+        finally:
+            MUT._reflink = original
+        self.assertEqual(os.readlink(source),
+                         os.path.join(pool_dir, 'foo.tar.gz'))
+        self.assertTrue(logged[-1].startswith('Cannot reflink'))
+        self.assertEqual(pooler.loadReflinks(), {})
+
+    def _fakeReflink(self, target, source):
+        import shutil
+        shutil.copy2(target, source)
+
+    def test_move_to_pool_reflink_recorded_as_pooled(self):
+        import os
+        from compoze import pooler as MUT
+        original, MUT._reflink = MUT._reflink, self._fakeReflink
+        try:
+            pool_dir = self._makeTempDir()
+            release_dir = self._makeTempDir()
+            source = self._makeFile(release_dir, 'foo.tar.gz', 'FOO')
+            pooler = self._makeOne('--quiet', '--link-mode=reflink',
+                                   '--release-dir=%s' % release_dir,
+                                   pool_dir)
+            pooler.move_to_pool()
+            self.assertFalse(os.path.islink(source))
+            target = os.path.join(pool_dir, 'foo.tar.gz')
+            self.assertEqual(list(pooler.loadReflinks()), [source])
+            self.assertEqual(pooler.loadReflinks()[source][0], target)
+            self.assertEqual(pooler.move_to_pool(), (['foo.tar.gz'], []))
+        finally:
+            MUT._reflink = original
+
+    def test_move_to_pool_reflink_replaced_is_pooled_again(self):
+        import os
+        from compoze import pooler as MUT
+        original, MUT._reflink = MUT._reflink, self._fakeReflink
+        try:
+            pool_dir = self._makeTempDir()
+            release_dir = self._makeTempDir()
+            source = self._makeFile(release_dir, 'foo.tar.gz', 'FOO')
+            pooler = self._makeOne('--quiet', '--link-mode=reflink',
+                                   '--release-dir=%s' % release_dir,
+                                   pool_dir)
+            pooler.move_to_pool()
+            os.remove(source)
+            self._makeFile(release_dir, 'foo.tar.gz', 'CHANGED')
+            self.assertEqual(pooler.listArchives(
+                                release_dir,
+                                reflinks=pooler.loadReflinks()),
+                             (['foo.tar.gz'], ['foo.tar.gz']))
+        finally:
+            MUT._reflink = original
+
+    def test_collectGarbage_reflinked(self):
+        import os
+        from compoze import pooler as MUT
+        original, MUT._reflink = MUT._reflink, self._fakeReflink
+        try:
+            pool_dir = self._makeTempDir()
+            release_dir = self._makeTempDir()
+            source = self._makeFile(release_dir, 'foo.tar.gz')
+            self._makeOne('--quiet', '--link-mode=reflink',
+                          '--release-dir=%s' % release_dir,
+                          pool_dir).move_to_pool()
+        finally:
+            MUT._reflink = original
+        bar = self._makeFile(pool_dir, 'bar.tar.gz')
+        pooler = self._makeOne('--quiet', '--gc', '--remove',
+                               '--release-dir=%s' % release_dir, pool_dir)
+        self.assertEqual(pooler.collectGarbage(), [bar])
+        self.assertTrue(os.path.exists(os.path.join(pool_dir, 'foo.tar.gz')))
+        self.assertEqual(list(pooler.loadReflinks()), [source])
+
+    def test_collectGarbage_remove_drops_stale_reflinks(self):
+        import os
+        from compoze import pooler as MUT
+        original, MUT._reflink = MUT._reflink, self._fakeReflink
+        try:
+            pool_dir = self._makeTempDir()
+            release_dir = self._makeTempDir()
+            source = self._makeFile(release_dir, 'foo.tar.gz')
+            self._makeOne('--quiet', '--link-mode=reflink',
+                          '--release-dir=%s' % release_dir,
+                          pool_dir).move_to_pool()
+        finally:
+            MUT._reflink = original
+        os.remove(source)
+        pooler = self._makeOne('--quiet', '--gc', '--remove',
+                               '--release-dir=%s' % release_dir, pool_dir)
+        self.assertEqual(pooler.collectGarbage(),
+                         [os.path.join(pool_dir, 'foo.tar.gz')])
+        self.assertEqual(pooler.loadReflinks(), {})
+
+    def test_collectGarbage_hardlinked(self):
+        import os
+        pool_dir = self._makeTempDir()
+        release_dir = self._makeTempDir()
+        self._makeFile(release_dir, 'foo.tar.gz')
+        self._makeOne('--quiet', '--link-mode=hardlink',
+                      '--path=%s' % release_dir, pool_dir).move_to_pool()
+        self._makeFile(pool_dir, 'bar.tar.gz')
+        pooler = self._makeOne('--quiet', '--gc',
+                               '--release-dir=%s' % release_dir, pool_dir)
+        self.assertEqual(pooler.collectGarbage(),
+                         [os.path.join(pool_dir, 'bar.tar.gz')])
+
+    def _writeJournal(self, pool_dir, operations, link_mode='symlink'):
+        import json
+        import os
+        with open(os.path.join(pool_dir, '.journal.json'), 'w') as f:
+            json.dump({'link_mode': link_mode,
+                       'operations': operations}, f)
+
+    def test_move_to_pool_leaves_no_journal_or_temp_files(self):
+        import os
+        pool_dir = self._makeTempDir()
+        release_dir = self._makeTempDir()
+        self._makeFile(release_dir, 'foo.tar.gz')
+        pooler = self._makeOne('--quiet',
+                               '--path=%s' % release_dir, pool_dir)
+        pooler.move_to_pool()
+        self.assertEqual(os.listdir(pool_dir), ['foo.tar.gz'])
+        self.assertEqual(os.listdir(release_dir), ['foo.tar.gz'])
+
+    def test_move_to_pool_resumes_after_pooling(self):
+        import os
+        pool_dir = self._makeTempDir()
+        first = self._makeTempDir()
+        second = self._makeTempDir()
+        # Interrupted after pooling 'foo.tar.gz', before linking it.
+        source = self._makeFile(first, 'foo.tar.gz', 'FOO')
+        target = os.path.join(pool_dir, 'foo.tar.gz')
+        os.link(source, target)
+        self._writeJournal(pool_dir, [[source, target]], 'relative')
+        self._makeFile(second, 'bar.tar.gz')
+        logged = []
+        pooler = self._makeOne('--verbose', '--path=%s' % second, pool_dir,
+                               logger=logged.append)
+        self.assertEqual(pooler.move_to_pool(),
+                         (['bar.tar.gz'], ['bar.tar.gz']))
+        self.assertTrue(logged[0].startswith('Resuming interrupted run'))
+        self.assertEqual(os.readlink(source),
+                         os.path.join('..', os.path.basename(pool_dir),
+                                      'foo.tar.gz')) # journaled link mode
+        self.assertTrue(os.path.islink(os.path.join(second, 'bar.tar.gz')))
+        self.assertFalse(os.path.exists(os.path.join(pool_dir,
+                                                     '.journal.json')))
+
+    def test_move_to_pool_resumes_with_stale_temp_files(self):
+        import os
+        pool_dir = self._makeTempDir()
+        release_dir = self._makeTempDir()
+        source = self._makeFile(release_dir, 'foo.tar.gz', 'FOO')
+        target = os.path.join(pool_dir, 'foo.tar.gz')
+        self._makeFile(pool_dir, '.foo.tar.gz.tmp', 'PARTIAL')
+        os.symlink(target, os.path.join(release_dir, '.foo.tar.gz.tmp'))
+        self._writeJournal(pool_dir, [[source, target]])
+        pooler = self._makeOne('--quiet', '--path=%s' % release_dir,
+                               pool_dir)
+        self.assertEqual(pooler.move_to_pool(), (['foo.tar.gz'], []))
+        self.assertEqual(os.readlink(source), target)
+        with open(source) as f:
+            self.assertEqual(f.read(), 'FOO')
+        self.assertEqual(os.listdir(pool_dir), ['foo.tar.gz'])
+        self.assertEqual(os.listdir(release_dir), ['foo.tar.gz'])
+
+    def test_move_to_pool_resume_already_complete(self):
+        import os
+        pool_dir = self._makeTempDir()
+        release_dir = self._makeTempDir()
+        target = self._makeFile(pool_dir, 'foo.tar.gz')
+        self._makeLink(pool_dir, release_dir, 'foo.tar.gz')
+        source = os.path.join(release_dir, 'foo.tar.gz')
+        self._writeJournal(pool_dir, [[source, target]])
+        pooler = self._makeOne('--quiet', '--path=%s' % release_dir,
+                               pool_dir)
+        self.assertEqual(pooler.move_to_pool(), (['foo.tar.gz'], []))
+        self.assertEqual(os.readlink(source), target)
+        self.assertEqual(os.listdir(pool_dir), ['foo.tar.gz'])
+
+    def test_collectGarbage_w_journal_raises(self):
+        pool_dir = self._makeTempDir()
+        self._writeJournal(pool_dir, [])
+        pooler = self._makeOne('--gc', '--release-dir=%s' % self._makeTempDir(),
+                               pool_dir)
+        self.assertRaises(ValueError, pooler.collectGarbage)
+
+class Test_copyIntoPlace(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self._tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self._tmpdir)
+
+    def _callFUT(self, source, target):
+        from compoze.pooler import _copyIntoPlace
+        return _copyIntoPlace(source, target)
+
+    def _makeSource(self):
+        import os
+        source = os.path.join(self._tmpdir, 'foo.tar.gz')
+        with open(source, 'wb') as f:
+            f.write(b'x' * 3000000)
+        os.utime(source, (1000, 1000))
+        return source
+
+    def test_same_filesystem_links(self):
+        import os
+        source = self._makeSource()
+        target = os.path.join(self._tmpdir, 'pool', 'sha256', 'foo')
+        self._callFUT(source, target)
+        self.assertTrue(os.path.samefile(source, target))
+        self.assertEqual(os.listdir(os.path.dirname(target)), ['foo'])
+
+    def test_cross_device_copies(self):
+        import errno
+        import os
+        def _link(source, target):
+            raise OSError(errno.EXDEV, 'Cross-device link')
+        source = self._makeSource()
+        target = os.path.join(self._tmpdir, 'pool', 'foo.tar.gz')
+        original, os.link = os.link, _link
+        try:
+            self._callFUT(source, target)
+        finally:
+            os.link = original
+        self.assertFalse(os.path.samefile(source, target))
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 3000000)
+        self.assertEqual(os.stat(target).st_mtime, 1000)
+        self.assertTrue(os.path.exists(source))
+        self.assertEqual(os.listdir(os.path.dirname(target)),
+                         ['foo.tar.gz'])
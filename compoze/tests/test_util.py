@@ -0,0 +1,138 @@
+import unittest
+
+class Test_normalize_name(unittest.TestCase):
+
+    def _callFUT(self, name):
+        from compoze._util import normalize_name
+        return normalize_name(name)
+
+    def test_already_normal(self):
+        self.assertEqual(self._callFUT('testpackage'), 'testpackage')
+
+    def test_case(self):
+        self.assertEqual(self._callFUT('TestPackage'), 'testpackage')
+
+    def test_separators(self):
+        self.assertEqual(self._callFUT('Test_Package'), 'test-package')
+        self.assertEqual(self._callFUT('test.package'), 'test-package')
+        self.assertEqual(self._callFUT('test-._package'), 'test-package')
+
+class Test_file_sha256(unittest.TestCase):
+
+    def test_small_blocks(self):
+        import hashlib
+        import tempfile
+        data = b'x' * 1000
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            from compoze._util import file_sha256
+            self.assertEqual(file_sha256(f.name, blocksize=7),
+                             hashlib.sha256(data).hexdigest())
+
+class Test_parse_size(unittest.TestCase):
+
+    def _callFUT(self, text):
+        from compoze._util import parse_size
+        return parse_size(text)
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT(None), None)
+        self.assertEqual(self._callFUT(' '), None)
+
+    def test_suffixes(self):
+        self.assertEqual(self._callFUT('100'), 100)
+        self.assertEqual(self._callFUT('2K'), 2048)
+        self.assertEqual(self._callFUT('1.5m'), 3 << 19)
+        self.assertEqual(self._callFUT('1GB'), 1 << 30)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self._callFUT, 'lots')
+        self.assertRaises(ValueError, self._callFUT, '-1K')
+
+class _ScanTestBase(object):
+
+    def _makeTree(self):
+        import os
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        with open(os.path.join(tmpdir, 'b.tar.gz'), 'w') as f:
+            f.write('ARCHIVE')
+        os.mkdir(os.path.join(tmpdir, 'c'))
+        os.symlink(os.path.join(tmpdir, 'b.tar.gz'),
+                   os.path.join(tmpdir, 'a.tar.gz'))
+        os.symlink(os.path.join(tmpdir, 'nonesuch'),
+                   os.path.join(tmpdir, 'd.tar.gz'))
+        return tmpdir
+
+class Test_scan_directory(_ScanTestBase, unittest.TestCase):
+
+    def _callFUT(self, path):
+        from compoze._util import scan_directory
+        return scan_directory(path)
+
+    def test_entries(self):
+        import os
+        tmpdir = self._makeTree()
+        entries = self._callFUT(tmpdir)
+        self.assertEqual([x.name for x in entries],
+                         ['a.tar.gz', 'b.tar.gz', 'c', 'd.tar.gz'])
+        self.assertEqual([x.path for x in entries],
+                         [os.path.join(tmpdir, x.name) for x in entries])
+        self.assertEqual([x.is_file() for x in entries],
+                         [True, True, False, False])
+        self.assertEqual([x.is_symlink() for x in entries],
+                         [True, False, False, True])
+        self.assertEqual(entries[1].stat().st_size, len('ARCHIVE'))
+
+class Test_ListdirEntry(_ScanTestBase, unittest.TestCase):
+
+    def _makeEntries(self, path):
+        import os
+        from compoze._util import _ListdirEntry
+        return [_ListdirEntry(path, x) for x in sorted(os.listdir(path))]
+
+    def test_same_answers_as_scandir(self):
+        from compoze._util import scan_directory
+        tmpdir = self._makeTree()
+        expected = scan_directory(tmpdir)
+        entries = self._makeEntries(tmpdir)
+        for method in ('is_file', 'is_dir', 'is_symlink', 'inode'):
+            self.assertEqual([getattr(x, method)() for x in entries],
+                             [getattr(x, method)() for x in expected])
+        self.assertEqual(entries[0].stat().st_size,
+                         entries[1].stat().st_size)
+        self.assertEqual(entries[0].stat(follow_symlinks=False).st_size,
+                         expected[0].stat(follow_symlinks=False).st_size)
+
+    def test_stat_cached(self):
+        tmpdir = self._makeTree()
+        entry = self._makeEntries(tmpdir)[1]
+        first = entry.stat()
+        self.assertTrue(entry.stat() is first)
+        self.assertTrue(entry.stat(follow_symlinks=False) is first)
+
+class Test_write_atomically(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self._tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self._tmpdir)
+
+    def _callFUT(self, target, data):
+        from compoze._util import write_atomically
+        return write_atomically(target, data)
+
+    def test_creates_directory_and_replaces(self):
+        import os
+        target = os.path.join(self._tmpdir, 'sub', 'file')
+        self._callFUT(target, b'FIRST')
+        self._callFUT(target, b'SECOND')
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'SECOND')
+        self.assertEqual(os.listdir(os.path.dirname(target)), ['file'])
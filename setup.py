@@ -64,6 +64,7 @@ setup(name='compoze',
          'index = compoze.indexer:Indexer',
          'show = compoze.informer:Informer',
          'pool = compoze.pooler:Pooler',
+         'cache = compoze.cacher:Cacher',
         ],
       },
       extras_require = {